@@ -0,0 +1,130 @@
+import heapq
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from ai_limits import AIOverloaded
+from ai_utils import ai_autocomplete, ai_autoreply, ai_fix_grammar, ai_rewrite
+
+# Items in flight at once for one batch; a request may ask for fewer, or
+# for more up to AI_BATCH_MAX_CONCURRENCY.
+AI_BATCH_CONCURRENCY = int(os.getenv("AI_BATCH_CONCURRENCY", 4))
+AI_BATCH_MAX_CONCURRENCY = int(os.getenv("AI_BATCH_MAX_CONCURRENCY", 8))
+AI_BATCH_MAX_ITEMS = int(os.getenv("AI_BATCH_MAX_ITEMS", 500))
+AI_BATCH_MAX_TEXT = int(os.getenv("AI_BATCH_MAX_TEXT", 8000))
+# Tries per item for transient upstream errors (429, 5xx, timeouts). The
+# OpenAI client already retries OPENAI_MAX_RETRIES times inside each try.
+AI_BATCH_ATTEMPTS = int(os.getenv("AI_BATCH_ATTEMPTS", 3))
+AI_BATCH_RETRY_BASE = float(os.getenv("AI_BATCH_RETRY_BASE", 1))
+# Waiting for an admission slot (AIOverloaded) does not use up attempts;
+# items still waiting after this long fail.
+AI_BATCH_TIMEOUT = float(os.getenv("AI_BATCH_TIMEOUT", 600))
+
+AI_FUNCTIONS = {
+    "autocomplete": ai_autocomplete,
+    "autoreply": ai_autoreply,
+    "rewrite": ai_rewrite,
+    "grammar": ai_fix_grammar,
+}
+
+
+def parse_items(raw):
+    """Validate request items; returns ``(items, error)``.
+
+    Each item is ``{"operation", "text", "style"?}``; ``style`` only applies
+    to rewrite.
+    """
+    if not isinstance(raw, list) or not raw:
+        return None, "items must be a non-empty list"
+    if len(raw) > AI_BATCH_MAX_ITEMS:
+        return None, f"At most {AI_BATCH_MAX_ITEMS} items per batch"
+    items = []
+    for index, item in enumerate(raw):
+        if not isinstance(item, dict):
+            return None, f"Item {index}: expected an object"
+        operation = item.get("operation")
+        text = str(item.get("text") or "").strip()
+        if operation not in AI_FUNCTIONS:
+            return None, f"Item {index}: unknown operation {operation!r}"
+        if not text:
+            return None, f"Item {index}: empty text"
+        if len(text) > AI_BATCH_MAX_TEXT:
+            return None, f"Item {index}: text longer than {AI_BATCH_MAX_TEXT} characters"
+        style = (item.get("style") or "professional") if operation == "rewrite" else None
+        items.append((operation, text, style))
+    return items, None
+
+
+def is_transient(exc):
+    if isinstance(exc, AIOverloaded):
+        return True
+    import openai
+    if isinstance(exc, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code in (408, 409)
+
+
+def _call(client, operation, text, style, use_cache):
+    kwargs = {"style": style} if operation == "rewrite" else {}
+    # No user_id: the per-user admission limit would serialize the batch.
+    # AI_BATCH_CONCURRENCY is this batch's cap; the global and
+    # per-operation limits still apply.
+    return AI_FUNCTIONS[operation](client, text, use_cache=use_cache, **kwargs)
+
+
+def run_batch(client, items, concurrency=AI_BATCH_CONCURRENCY, use_cache=True,
+              attempts=AI_BATCH_ATTEMPTS, timeout=AI_BATCH_TIMEOUT):
+    """Run ``items`` (from ``parse_items``) concurrently; yield results as they finish.
+
+    Yields ``{"index", "ok", "text"}`` or ``{"index", "ok": False, "error",
+    "attempts"}``, one per item, in completion order. Identical items are
+    sent upstream once. A failed call is retried on its own with jittered
+    backoff; the rest of the batch keeps going. Closing the generator
+    cancels everything not yet started.
+    """
+    groups = {}
+    for index, item in enumerate(items):
+        groups.setdefault(item, []).append(index)
+    ready = deque((item, 1) for item in groups)
+    delayed = []  # heap of (due, seq, item, attempt)
+    running = {}
+    deadline = time.monotonic() + timeout
+    seq = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="ai-batch")
+    try:
+        while ready or delayed or running:
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                _, _, item, attempt = heapq.heappop(delayed)
+                ready.append((item, attempt))
+            while ready and len(running) < concurrency:
+                item, attempt = ready.popleft()
+                running[executor.submit(_call, client, *item, use_cache)] = (item, attempt)
+            wake = delayed[0][0] - now if delayed else None
+            if not running:
+                time.sleep(max(wake, 0))
+                continue
+            done, _ = wait(running, timeout=wake, return_when=FIRST_COMPLETED)
+            for future in done:
+                item, attempt = running.pop(future)
+                exc = future.exception()
+                if exc is None:
+                    text = future.result()
+                    for index in groups[item]:
+                        yield {"index": index, "ok": True, "text": text}
+                    continue
+                overloaded = isinstance(exc, AIOverloaded)
+                if is_transient(exc) and (overloaded or attempt < attempts) and time.monotonic() < deadline:
+                    if overloaded:
+                        delay = exc.retry_after * random.uniform(0.5, 1.0)
+                    else:
+                        delay = AI_BATCH_RETRY_BASE * (2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+                        attempt += 1
+                    seq += 1
+                    heapq.heappush(delayed, (time.monotonic() + delay, seq, item, attempt))
+                    continue
+                for index in groups[item]:
+                    yield {"index": index, "ok": False, "error": str(exc), "attempts": attempt}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
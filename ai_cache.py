@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from cache_utils import TTLCache
+
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "1") != "0"
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", 2048))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", 86400))
+# Optional SQLite file shared by every gunicorn worker on the machine,
+# e.g. AI_CACHE_DB=instance/ai_cache.db. Empty disables the shared tier.
+AI_CACHE_DB = os.getenv("AI_CACHE_DB", "").strip()
+
+_SPACES_RE = re.compile(r"[ \t\f\v]+")
+
+
+def normalize_text(text):
+    """Whitespace-insensitive form of ``text`` used only for the cache key."""
+    lines = (_SPACES_RE.sub(" ", line).strip() for line in text.replace("\r\n", "\n").split("\n"))
+    return "\n".join(lines).strip()
+
+
+def make_key(operation, style, model, max_tokens, text):
+    text_hash = hashlib.sha256(normalize_text(text).encode()).hexdigest()
+    return f"{operation}|{style or ''}|{model}|{max_tokens}|{text_hash}"
+
+
+class _SQLiteTier:
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM ai_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, entry):
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO ai_cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(entry), now + self.ttl),
+        )
+        if random.random() < 0.01:
+            conn.execute("DELETE FROM ai_cache WHERE expires_at <= ?", (now,))
+
+
+class AIResponseCache:
+    """Two-tier (process LRU, then optional shared SQLite) cache of AI completions.
+
+    Entries remember how long the original call took and how many tokens it
+    used, so the stats show the latency and tokens a hit saved.
+    """
+
+    def __init__(self, maxsize=AI_CACHE_SIZE, ttl=AI_CACHE_TTL, db_path=AI_CACHE_DB):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.shared = _SQLiteTier(db_path, ttl) if db_path else None
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0, "shared_hits": 0, "misses": 0, "stores": 0,
+            "shared_errors": 0, "saved_seconds": 0.0, "saved_tokens": 0,
+        }
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self.counters[name] += delta
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            self._count(memory_hits=1, saved_seconds=entry["latency"], saved_tokens=entry["tokens"])
+            return entry["text"]
+        if self.shared is not None:
+            try:
+                entry = self.shared.get(key)
+            except sqlite3.Error:
+                self._count(shared_errors=1)
+                entry = None
+            if entry is not None:
+                self.memory.set(key, entry)
+                self._count(shared_hits=1, saved_seconds=entry["latency"], saved_tokens=entry["tokens"])
+                return entry["text"]
+        self._count(misses=1)
+        return None
+
+    def set(self, key, text, latency, tokens):
+        entry = {"text": text, "latency": latency, "tokens": tokens or 0}
+        self.memory.set(key, entry)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, entry)
+            except sqlite3.Error:
+                self._count(shared_errors=1)
+        self._count(stores=1)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["memory_hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["saved_seconds"] = round(stats["saved_seconds"], 3)
+        stats["memory_size"] = len(self.memory)
+        stats["shared_tier"] = self.shared is not None
+        return stats
+
+
+response_cache = AIResponseCache()
@@ -0,0 +1,193 @@
+import math
+import os
+import re
+from collections import namedtuple
+
+# Token counts use tiktoken when it is installed; otherwise a conservative
+# estimate (one token per word or punctuation mark, at least one per four
+# characters), which over-counts English by ~20%.
+AI_TOKENIZER = os.getenv("AI_TOKENIZER", "o200k_base")
+
+_tokenizer = None
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def _get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding(AI_TOKENIZER).encode
+        except Exception:
+            _tokenizer = False
+    return _tokenizer
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    encode = _get_tokenizer()
+    if encode:
+        return len(encode(text, disallowed_special=()))
+    return max(len(_WORD_RE.findall(text)), math.ceil(len(text) / 4))
+
+
+# -------------------------
+# Quoted history and signatures
+# -------------------------
+# ``body``: the newest message without its signature. ``signature``: that
+# signature, verbatim. ``history``: the older messages, unquoted and without
+# signatures, newest first. ``tail``: everything from the first older
+# message on, verbatim.
+Thread = namedtuple("Thread", "body signature history tail")
+
+_HISTORY_START = re.compile(
+    r"^\s*(?:On\s.{0,200}\swrote:\s*$"
+    r"|-{2,}\s*(?:Original|Forwarded) Message\s*-{2,}"
+    r"|Begin forwarded message:"
+    r"|_{10,}\s*$)",
+    re.I,
+)
+# Gmail wraps long "On <date> <name> <address> wrote:" lines.
+_WRAPPED_ON = re.compile(r"^\s*On\s.{0,200}$", re.I)
+_WRAPPED_WROTE = re.compile(r"^(?:.{0,120}\s)?wrote:\s*$", re.I)
+_OUTLOOK_FROM = re.compile(r"^\s*\*?From:\*?\s", re.I)
+_OUTLOOK_NEXT = re.compile(r"^\s*\*?(?:Sent|Date|To):\*?\s", re.I)
+_SIGNATURE_START = re.compile(r"^(?:--|Sent from my\s.*|Get Outlook for\s.*)$", re.I)
+_CLOSING = re.compile(r"^(?:(?:best|kind|warm)?\s*regards|best|thanks|thank you|cheers|sincerely),?$", re.I)
+
+
+def _is_header(lines, i):
+    line = lines[i]
+    if _HISTORY_START.match(line):
+        return True
+    if i + 1 < len(lines):
+        if _OUTLOOK_FROM.match(line) and _OUTLOOK_NEXT.match(lines[i + 1]):
+            return True
+        if _WRAPPED_ON.match(line) and _WRAPPED_WROTE.match(lines[i + 1]):
+            return True
+    return False
+
+
+def _segments(lines):
+    """Split at reply headers and quote-depth changes: ``[start line, [lines]]``, newest first."""
+    quote = re.compile(r"^\s*((?:>\s?)*)")
+    depths, contents = [], []
+    for line in lines:
+        markers = quote.match(line)
+        depths.append(markers.group(1).count(">"))
+        contents.append(line[markers.end():])
+    segments = [[0, []]]
+    depth, header_only = 0, False
+    for i, content in enumerate(contents):
+        if not content.strip():
+            segments[-1][1].append(content)
+            continue
+        if _is_header(contents, i):
+            # "-----Original Message-----" followed by "From:"/"Sent:" is one header.
+            if header_only:
+                segments[-1][1].append(content)
+            else:
+                segments.append([i, [content]])
+            depth, header_only = depths[i], True
+            continue
+        if depths[i] != depth:
+            # The quote under "On ... wrote:" belongs to that header.
+            if not (header_only and depths[i] > depth):
+                segments.append([i, []])
+            depth = depths[i]
+        header_only = header_only and bool(_WRAPPED_WROTE.match(content))
+        segments[-1][1].append(content)
+    return segments
+
+
+def _split_signature(lines):
+    # Only the last few lines can start a signature: "Thanks," halfway
+    # through a message is prose, and a closing must be followed by a few
+    # short lines (a name, a title), not more text.
+    for i in range(max(len(lines) - 8, 1), len(lines)):
+        line = lines[i].strip()
+        if _SIGNATURE_START.match(line):
+            return lines[:i], lines[i:]
+        if _CLOSING.match(line):
+            rest = [l for l in lines[i + 1:] if l.strip()]
+            if len(rest) <= 4 and all(len(l) < 60 for l in rest):
+                return lines[:i], lines[i:]
+    return lines, []
+
+
+def _squeeze(lines):
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def parse_thread(text):
+    """Split a pasted email into the newest message, its signature and the quoted history."""
+    lines = (text or "").replace("\r\n", "\n").split("\n")
+    segments = _segments(lines)
+    body, signature = _split_signature(segments[0][1])
+    history, seen = [], set()
+    for _, message in segments[1:]:
+        message = _squeeze(_split_signature(message)[0])
+        # Replies quote the same message again and again.
+        key = re.sub(r"\s+", " ", message).lower()
+        if message and key not in seen:
+            seen.add(key)
+            history.append(message)
+    tail = "\n".join(lines[segments[1][0]:]).strip() if len(segments) > 1 else ""
+    return Thread(_squeeze(body), "\n".join(signature).strip(), history, tail)
+
+
+# -------------------------
+# Chunking
+# -------------------------
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _pieces(text, max_tokens):
+    """Paragraphs, then lines, sentences and finally slices, each within ``max_tokens``."""
+    for paragraph in re.split(r"\n\s*\n", text):
+        if count_tokens(paragraph) <= max_tokens:
+            yield paragraph
+            continue
+        for line in paragraph.split("\n"):
+            if count_tokens(line) <= max_tokens:
+                yield line
+                continue
+            for part in _SENTENCE_RE.split(line):
+                if count_tokens(part) <= max_tokens:
+                    yield part
+                    continue
+                # A run-on sentence: cut it into slices that fit.
+                yield from _slices(part, max_tokens)
+
+
+def _slices(text, max_tokens):
+    """Cut ``text`` into the longest character slices that fit in ``max_tokens``."""
+    start = 0
+    while start < len(text):
+        # Binary search: a token is rarely more than four characters, and
+        # dense text (digits, punctuation, CJK) can be one per character.
+        low, high = start + 1, min(start + max_tokens * 4, len(text))
+        while low < high:
+            mid = (low + high + 1) // 2
+            if count_tokens(text[start:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        yield text[start:low]
+        start = low
+
+
+def split_chunks(text, max_tokens):
+    """Greedily pack paragraphs into chunks of at most ``max_tokens``."""
+    chunks, current, size = [], [], 0
+    for piece in _pieces(text, max_tokens):
+        tokens = count_tokens(piece) + 1
+        if current and size + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
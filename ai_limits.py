@@ -0,0 +1,156 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Per worker process. gunicorn_config.py runs 4 threads per worker, so the
+# defaults leave threads free for /login, /api/templates etc. even when
+# every AI slot and queue spot is taken.
+AI_MAX_CONCURRENT = int(os.getenv("AI_MAX_CONCURRENT", 2))
+AI_MAX_PER_USER = int(os.getenv("AI_MAX_PER_USER", 1))
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", 1))
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", 3))
+AI_RETRY_AFTER = int(os.getenv("AI_RETRY_AFTER", 2))
+# Per-operation overrides, e.g.
+# AI_LIMITS='{"autocomplete": {"max_concurrent": 1, "max_queue": 0}}'
+AI_LIMITS = json.loads(os.getenv("AI_LIMITS", "{}") or "{}")
+
+WAIT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class AIOverloaded(Exception):
+    """Raised when an AI call cannot be admitted; maps to HTTP 429."""
+
+    def __init__(self, message, retry_after=AI_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """Caps concurrent calls overall and per user, with a bounded wait queue.
+
+    Callers over the limit wait up to ``queue_timeout`` for a slot; once
+    ``max_queue`` callers are already waiting, new ones are rejected at once.
+    """
+
+    def __init__(self, name, max_concurrent, max_per_user, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._per_user = {}
+        self._waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_sum = 0.0
+
+    def _has_slot(self, user_id):
+        if self._active >= self.max_concurrent:
+            return False
+        return user_id is None or self._per_user.get(user_id, 0) < self.max_per_user
+
+    def _observe(self, waited):
+        self.wait_counts[bisect.bisect_left(WAIT_BUCKETS, waited)] += 1
+        self.wait_sum += waited
+
+    def acquire(self, user_id=None):
+        start = time.monotonic()
+        with self._cond:
+            if not self._has_slot(user_id):
+                if self._waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise AIOverloaded(f"AI service busy ({self.name}); try again shortly.")
+                self._waiting += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self._has_slot(user_id), timeout=self.queue_timeout)
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    self.rejected += 1
+                    raise AIOverloaded(f"AI service busy ({self.name}); try again shortly.")
+            self._active += 1
+            if user_id is not None:
+                self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            self.admitted += 1
+            self._observe(time.monotonic() - start)
+
+    def release(self, user_id=None):
+        with self._cond:
+            self._active -= 1
+            if user_id is not None:
+                left = self._per_user.get(user_id, 1) - 1
+                if left:
+                    self._per_user[user_id] = left
+                else:
+                    self._per_user.pop(user_id, None)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self._active,
+                "queue_depth": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "wait_seconds": {
+                    "buckets": dict(zip([str(b) for b in WAIT_BUCKETS] + ["+Inf"], self.wait_counts)),
+                    "sum": round(self.wait_sum, 4),
+                    "count": sum(self.wait_counts),
+                },
+            }
+
+
+def _limiter_for(name, overrides):
+    return AdmissionLimiter(
+        name,
+        max_concurrent=int(overrides.get("max_concurrent", AI_MAX_CONCURRENT)),
+        max_per_user=int(overrides.get("max_per_user", AI_MAX_PER_USER)),
+        max_queue=int(overrides.get("max_queue", AI_MAX_QUEUE)),
+        queue_timeout=float(overrides.get("queue_timeout", AI_QUEUE_TIMEOUT)),
+    )
+
+
+global_limiter = _limiter_for("global", AI_LIMITS.get("global", {}))
+_operation_limiters = {}
+_operation_lock = threading.Lock()
+
+
+def operation_limiter(operation):
+    limiter = _operation_limiters.get(operation)
+    if limiter is None:
+        with _operation_lock:
+            limiter = _operation_limiters.setdefault(operation, _limiter_for(operation, AI_LIMITS.get(operation, {})))
+    return limiter
+
+
+@contextmanager
+def admit(operation, user_id=None):
+    """Hold a per-operation slot and a global slot for the duration of an AI call."""
+    op_limiter = operation_limiter(operation)
+    op_limiter.acquire(user_id)
+    try:
+        # The global limiter is not per user; the operation limiter already is.
+        global_limiter.acquire()
+    except AIOverloaded:
+        op_limiter.release(user_id)
+        raise
+    try:
+        yield
+    finally:
+        global_limiter.release()
+        op_limiter.release(user_id)
+
+
+def stats():
+    return {
+        "global": global_limiter.stats(),
+        "operations": {name: limiter.stats() for name, limiter in sorted(_operation_limiters.items())},
+    }
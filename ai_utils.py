@@ -1,17 +1,59 @@
 import base64
+import hashlib
 import os
-from cryptography.fernet import Fernet
-from openai import OpenAI
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from cache_utils import TTLCache
+from ai_input import count_tokens, parse_thread, split_chunks
+from ai_cache import AI_CACHE_ENABLED, make_key, response_cache
+from ai_limits import AIOverloaded, admit
+from metrics import (
+    ai_first_token_seconds, ai_input_chunks, ai_request_seconds, ai_requests_total, observe_ai_usage, timed,
+)
+
+# Decrypted secrets are kept briefly so each request doesn't pay for a decrypt.
+SECRET_CACHE_TTL = float(os.getenv("SECRET_CACHE_TTL", 300))
+SECRET_CACHE_SIZE = int(os.getenv("SECRET_CACHE_SIZE", 1024))
+
+# One OpenAI client per API key (LRU), all sharing a single keep-alive pool.
+OPENAI_CLIENT_CACHE_SIZE = int(os.getenv("OPENAI_CLIENT_CACHE_SIZE", 256))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 20))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", 10))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 60))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 30))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
 
 # -------------------------------
 # Encryption for storing API Keys
 # -------------------------------
-def _get_fernet():
-    key = os.getenv("FERNET_KEY")
-    if not key:
-        key = Fernet.generate_key()
+_fernet = None
+_fernet_lock = threading.Lock()
+
+
+def _load_fernet():
+    # FERNET_KEYS="new,old,..." supports rotation: encrypt with the first
+    # key, decrypt with any of them. FERNET_KEY is the single-key form.
+    from cryptography.fernet import Fernet, MultiFernet
+    keys = [k.strip() for k in os.getenv("FERNET_KEYS", "").split(",") if k.strip()]
+    if not keys and os.getenv("FERNET_KEY"):
+        keys = [os.getenv("FERNET_KEY").strip()]
+    if not keys:
+        keys = [Fernet.generate_key()]
         print("WARNING: No FERNET_KEY found. Generated a temporary one.")
-    return Fernet(key)
+    return MultiFernet([Fernet(k) for k in keys])
+
+
+def _get_fernet():
+    global _fernet
+    if _fernet is None:
+        with _fernet_lock:
+            if _fernet is None:
+                _fernet = _load_fernet()
+    return _fernet
 
 def encrypt_key(key: str) -> str:
     f = _get_fernet()
@@ -21,61 +63,385 @@ def decrypt_key(enc_key: str) -> str:
     f = _get_fernet()
     return f.decrypt(enc_key.encode()).decode()
 
+def rotate_encrypted(enc_key: str) -> str:
+    """Re-encrypt a stored value under the current primary key."""
+    return _get_fernet().rotate(enc_key.encode()).decode()
+
+# -------------------------------
+# Decrypted secret cache
+# -------------------------------
+_secret_cache = TTLCache(maxsize=SECRET_CACHE_SIZE, ttl=SECRET_CACHE_TTL)
+
+
+def decrypt_for_user(user_id, enc_key: str) -> str:
+    """``decrypt_key`` with a per-process TTL cache keyed by (user id, ciphertext).
+
+    Saving a new secret produces a new ciphertext, so other workers never
+    serve a stale value; the old entry just ages out.
+    """
+    cache_key = (user_id, hashlib.sha256(enc_key.encode()).hexdigest())
+    secret = _secret_cache.get(cache_key)
+    if secret is None:
+        secret = decrypt_key(enc_key)
+        _secret_cache.set(cache_key, secret)
+    return secret
+
+
+def forget_user_secrets(user_id):
+    return _secret_cache.invalidate_where(lambda k: k[0] == user_id)
+
 # -------------------------------
 # Get OpenAI Client
 # -------------------------------
-def get_openai_client(enc_key=None):
+# openai/httpx take a few hundred ms to import, so they are imported on the
+# first AI call rather than when a worker boots.
+_http_client = None
+_http_client_lock = threading.Lock()
+_client_cache = TTLCache(maxsize=OPENAI_CLIENT_CACHE_SIZE, ttl=None)
+
+
+def _get_http_client():
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                import httpx
+                from openai import DefaultHttpxClient
+                _http_client = DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+                    ),
+                    timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                )
+    return _http_client
+
+
+def get_openai_client(enc_key=None, user_id=None):
     if enc_key:
-        api_key = decrypt_key(enc_key)
+        api_key = decrypt_for_user(user_id, enc_key)
     else:
         api_key = os.getenv("OPENAI_API_KEY")
 
-    return OpenAI(api_key=api_key)
+    cache_key = hashlib.sha256((api_key or "").encode()).hexdigest()
+    client = _client_cache.get(cache_key)
+    if client is None:
+        # Evicted clients are just dropped: the shared pool outlives them.
+        from openai import OpenAI
+        client = OpenAI(api_key=api_key, http_client=_get_http_client(), max_retries=OPENAI_MAX_RETRIES)
+        _client_cache.set(cache_key, client)
+    return client
+
+
+def openai_client_stats():
+    return {**_client_cache.stats, "size": len(_client_cache)}
 
 # -------------------------------
 # AI FUNCTIONS
 # -------------------------------
+AI_MODEL = os.getenv("AI_MODEL", "gpt-4o-mini")
+# Long autoreply/rewrite inputs: no single call is sent more than
+# AI_INPUT_MAX_TOKENS of text. Longer threads are cut into AI_CHUNK_TOKENS
+# chunks that are summarized (autoreply, up to AI_MAX_CHUNKS of them) or
+# rewritten (rewrite) AI_CHUNK_CONCURRENCY at a time. A fan-out takes one
+# admission slot, like a single call.
+AI_INPUT_MAX_TOKENS = int(os.getenv("AI_INPUT_MAX_TOKENS", 3000))
+AI_CHUNK_TOKENS = int(os.getenv("AI_CHUNK_TOKENS", 1500))
+AI_MAX_CHUNKS = int(os.getenv("AI_MAX_CHUNKS", 12))
+AI_CHUNK_CONCURRENCY = int(os.getenv("AI_CHUNK_CONCURRENCY", 4))
+# A rewrite is about as long as its input, so its max_tokens scales with
+# the input (never below the table's value), up to this.
+AI_REWRITE_MAX_TOKENS = int(os.getenv("AI_REWRITE_MAX_TOKENS", 2000))
+# Longer rewrite inputs are refused rather than cut.
+AI_REWRITE_MAX_INPUT_TOKENS = int(os.getenv("AI_REWRITE_MAX_INPUT_TOKENS", AI_MAX_CHUNKS * AI_CHUNK_TOKENS))
+
+# operation -> (system prompt, user prompt, max_tokens)
+AI_OPERATIONS = {
+    "autocomplete": ("You complete emails professionally.", "{text}", 120),
+    "autoreply": ("You write helpful email replies.", "Reply to this message:\n{text}", 150),
+    "rewrite": ("Rewrite text in a {style} tone.", "{text}", 150),
+    "grammar": ("Fix grammar but keep meaning the same.", "{text}", 150),
+    "summarize": (
+        "You summarize email threads for someone who has to reply to them.",
+        "Summarize this part of an email thread. Keep names, dates, questions, decisions and commitments:\n{text}",
+        200,
+    ),
+}
+# Operations exposed over HTTP; "summarize" is internal to long inputs.
+PUBLIC_OPERATIONS = ("autocomplete", "autoreply", "rewrite", "grammar")
+LONG_INPUT_OPERATIONS = ("autoreply", "rewrite")
+
+
+def build_messages(operation, text, style=None):
+    system, user, _ = AI_OPERATIONS[operation]
+    return [
+        {"role": "system", "content": system.format(style=style)},
+        {"role": "user", "content": user.format(text=text)},
+    ]
+
+
+@contextmanager
+def _counted(operation):
+    try:
+        yield
+    except AIOverloaded:
+        ai_requests_total.labels(operation=operation, outcome="rejected").inc()
+        raise
+    except GeneratorExit:
+        # Stream closed by the client; not an upstream failure.
+        ai_requests_total.labels(operation=operation, outcome="ok").inc()
+        raise
+    except Exception:
+        ai_requests_total.labels(operation=operation, outcome="error").inc()
+        raise
+    else:
+        ai_requests_total.labels(operation=operation, outcome="ok").inc()
+
+
+def run_ai(client, operation, text, style=None, use_cache=True, user_id=None, max_tokens=None, admitted=False):
+    """Run one AI operation, answering from the response cache when possible.
+
+    Uncached calls go through admission control and may raise
+    ``ai_limits.AIOverloaded``, unless the caller already holds a slot
+    (``admitted``).
+    """
+    max_tokens = max_tokens or AI_OPERATIONS[operation][2]
+    use_cache = use_cache and AI_CACHE_ENABLED
+    key = make_key(operation, style, AI_MODEL, max_tokens, text)
+    if use_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            ai_requests_total.labels(operation=operation, outcome="cache_hit").inc()
+            return cached
+
+    with _counted(operation), (nullcontext() if admitted else admit(operation, user_id)):
+        start = time.perf_counter()
+        with timed(ai_request_seconds, operation=operation, mode="complete"):
+            response = client.chat.completions.create(
+                model=AI_MODEL,
+                messages=build_messages(operation, text, style),
+                max_tokens=max_tokens
+            )
+    observe_ai_usage(operation, getattr(response, "usage", None))
+    out = response.choices[0].message.content
+    if use_cache and out:
+        tokens = response.usage.total_tokens if getattr(response, "usage", None) else 0
+        response_cache.set(key, out, time.perf_counter() - start, tokens)
+    return out
+
+def stream_ai(client, operation, text, style=None, use_cache=True, user_id=None, max_tokens=None):
+    """Like ``run_ai`` but yields the completion piece by piece as it arrives.
+
+    Closing the generator early (the browser went away) closes the upstream
+    HTTP stream, which cancels the generation.
+    """
+    max_tokens = max_tokens or AI_OPERATIONS[operation][2]
+    use_cache = use_cache and AI_CACHE_ENABLED
+    key = make_key(operation, style, AI_MODEL, max_tokens, text)
+    if use_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            ai_requests_total.labels(operation=operation, outcome="cache_hit").inc()
+            yield cached
+            return
+
+    parts = []
+    tokens = 0
+    # The slot is held until the stream finishes or is closed.
+    with _counted(operation), admit(operation, user_id):
+        start = time.perf_counter()
+        stream = client.chat.completions.create(
+            model=AI_MODEL,
+            messages=build_messages(operation, text, style),
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    tokens = chunk.usage.total_tokens
+                    observe_ai_usage(operation, chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        ai_first_token_seconds.labels(operation=operation).observe(time.perf_counter() - start)
+                    parts.append(delta)
+                    yield delta
+        finally:
+            stream.close()
+            ai_request_seconds.labels(operation=operation, mode="stream").observe(time.perf_counter() - start)
+    if use_cache and parts:
+        response_cache.set(key, "".join(parts), time.perf_counter() - start, tokens)
+
+# -------------------------------
+# Long inputs (autoreply, rewrite)
+# -------------------------------
+# ``texts`` go to the operation one call each and the outputs are joined
+# with blank lines; ``suffix`` (signature, quoted history) is appended as is.
+Prepared = namedtuple("Prepared", "texts max_tokens suffix")
+
+
+@contextmanager
+def _fan_out(operation, user_id):
+    """Hold one admission slot for a whole fan-out; its calls pass ``admitted=True``.
+
+    Admitting each chunk call separately would have them queue behind one
+    another (and behind other users) for the few global slots, and a long
+    input would be refused under modest load.
+    """
+    slot = admit(operation, user_id)
+    try:
+        slot.__enter__()
+    except AIOverloaded:
+        ai_requests_total.labels(operation=operation, outcome="rejected").inc()
+        raise
+    try:
+        yield
+    finally:
+        slot.__exit__(None, None, None)
+
+
+def _map(client, operation, texts, style=None, use_cache=True, max_tokens=None, user_id=None):
+    """Run ``operation`` over ``texts`` in parallel; outputs in input order."""
+    if len(texts) == 1:
+        return [run_ai(client, operation, texts[0], style, use_cache, user_id, max_tokens)]
+    workers = max(1, min(AI_CHUNK_CONCURRENCY, len(texts)))
+    with _fan_out(operation, user_id), ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-chunk") as pool:
+        return list(pool.map(
+            lambda text: run_ai(client, operation, text, style, use_cache, max_tokens=max_tokens, admitted=True), texts
+        ))
+
+
+def _condense(client, text, budget, use_cache, report, user_id=None):
+    """Summarize ``text`` until it fits in ``budget`` tokens, keeping its start.
+
+    Each round summarizes all chunks at once, so latency is one call per
+    round; a round shrinks the text about sevenfold.
+    """
+    for _ in range(3):
+        if count_tokens(text) <= budget:
+            return text
+        chunks = split_chunks(text, AI_CHUNK_TOKENS)
+        if len(chunks) > AI_MAX_CHUNKS:
+            # History is newest first: the oldest messages go.
+            chunks = chunks[:AI_MAX_CHUNKS]
+            report["truncated"] = True
+        report["chunks"] += len(chunks)
+        report["calls"] += len(chunks)
+        report["prompt_tokens"] = max(report["prompt_tokens"], max(count_tokens(c) for c in chunks))
+        text = "\n\n".join(_map(client, "summarize", chunks, use_cache=use_cache, user_id=user_id))
+    if count_tokens(text) > budget:
+        text = split_chunks(text, budget)[0]
+        report["truncated"] = True
+    return text
+
+
+def prepare_input(client, operation, text, style=None, use_cache=True, report=None, user_id=None):
+    """Strip quoted history and signatures and bound the prompt size.
+
+    Autoreply answers the newest message and sees the older ones as
+    context, summarized in parallel when the thread is too long. Rewrite
+    rewrites only the newest message, split into chunks when needed, and
+    keeps the signature and quoted history verbatim. Fills ``report``
+    (token counts, chunks, calls).
+    """
+    report = report if report is not None else {}
+    report.update(input_tokens=count_tokens(text), chunks=0, calls=0, prompt_tokens=0, truncated=False)
+    thread = parse_thread(text)
+    body, history = thread.body, thread.history
+    if operation == "rewrite":
+        if not body:
+            body, suffix = text.strip(), ""
+        else:
+            suffix = "\n\n".join(part for part in (thread.signature, thread.tail) if part)
+        tokens = count_tokens(body)
+        if tokens > AI_REWRITE_MAX_INPUT_TOKENS:
+            raise ValueError(f"Text too long to rewrite: about {tokens} tokens, limit {AI_REWRITE_MAX_INPUT_TOKENS}.")
+        texts = [body] if tokens <= AI_INPUT_MAX_TOKENS else split_chunks(body, AI_CHUNK_TOKENS)
+        longest = max(count_tokens(t) for t in texts)
+        max_tokens = min(max(AI_OPERATIONS["rewrite"][2], int(longest * 1.5)), AI_REWRITE_MAX_TOKENS)
+        report.update(
+            cleaned_tokens=tokens, chunks=report["chunks"] + (len(texts) if len(texts) > 1 else 0),
+            calls=report["calls"] + len(texts), prompt_tokens=max(report["prompt_tokens"], longest),
+        )
+        return Prepared(texts, max_tokens, suffix and "\n\n" + suffix)
+
+    if not body and history:
+        body, history = history[0], history[1:]
+    body = body or text.strip()
+    context = "\n\n".join(history)
+    report["cleaned_tokens"] = count_tokens(body) + count_tokens(context)
+    if report["cleaned_tokens"] > AI_INPUT_MAX_TOKENS:
+        if context:
+            room = max(AI_INPUT_MAX_TOKENS - count_tokens(body), AI_INPUT_MAX_TOKENS // 3)
+            context = _condense(client, context, room, use_cache, report, user_id)
+        body = _condense(client, body, AI_INPUT_MAX_TOKENS - count_tokens(context), use_cache, report, user_id)
+    prompt = body if not context else f"{body}\n\nEarlier in the thread:\n{context}"
+    report["calls"] += 1
+    report["prompt_tokens"] = max(report["prompt_tokens"], count_tokens(prompt))
+    return Prepared([prompt], None, "")
+
+
+def run_long(client, operation, text, style=None, use_cache=True, user_id=None, report=None):
+    """``run_ai`` for autoreply/rewrite with ``prepare_input`` in front."""
+    report = report if report is not None else {}
+    start = time.perf_counter()
+    prepared = prepare_input(client, operation, text, style, use_cache, report, user_id)
+    ai_input_chunks.labels(operation=operation).observe(max(report["chunks"], 1))
+    if len(prepared.texts) == 1:
+        outputs = [run_ai(client, operation, prepared.texts[0], style, use_cache, user_id, prepared.max_tokens)]
+    else:
+        outputs = _map(client, operation, prepared.texts, style, use_cache, prepared.max_tokens, user_id)
+    report["elapsed"] = round(time.perf_counter() - start, 3)
+    return "\n\n".join(o or "" for o in outputs) + prepared.suffix
+
+
+def stream_long(client, operation, text, style=None, use_cache=True, user_id=None, report=None):
+    """``stream_ai`` for autoreply/rewrite with ``prepare_input`` in front.
+
+    A single text is streamed token by token; rewrite chunks run in
+    parallel and each is yielded whole, in order, as soon as it is ready.
+    """
+    report = report if report is not None else {}
+    start = time.perf_counter()
+    prepared = prepare_input(client, operation, text, style, use_cache, report, user_id)
+    ai_input_chunks.labels(operation=operation).observe(max(report["chunks"], 1))
+    if len(prepared.texts) == 1:
+        tokens = stream_ai(client, operation, prepared.texts[0], style, use_cache, user_id, prepared.max_tokens)
+        try:
+            yield from tokens
+        finally:
+            tokens.close()
+    else:
+        with _fan_out(operation, user_id):
+            pool = ThreadPoolExecutor(max_workers=min(AI_CHUNK_CONCURRENCY, len(prepared.texts)),
+                                      thread_name_prefix="ai-chunk")
+            try:
+                futures = [
+                    pool.submit(run_ai, client, operation, part, style, use_cache, None, prepared.max_tokens, True)
+                    for part in prepared.texts
+                ]
+                for i, future in enumerate(futures):
+                    yield ("\n\n" if i else "") + (future.result() or "")
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+    if prepared.suffix:
+        yield prepared.suffix
+    report["elapsed"] = round(time.perf_counter() - start, 3)
+
+
+def ai_autocomplete(client, text, use_cache=True, user_id=None):
+    return run_ai(client, "autocomplete", text, use_cache=use_cache, user_id=user_id)
+
+def ai_autoreply(client, text, use_cache=True, user_id=None, report=None):
+    return run_long(client, "autoreply", text, use_cache=use_cache, user_id=user_id, report=report)
+
+def ai_rewrite(client, text, style="professional", use_cache=True, user_id=None, report=None):
+    return run_long(client, "rewrite", text, style=style, use_cache=use_cache, user_id=user_id, report=report)
 
-def ai_autocomplete(client, text):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You complete emails professionally."},
-            {"role": "user", "content": text}
-        ],
-        max_tokens=120
-    )
-    return response.choices[0].message.content
-
-def ai_autoreply(client, text):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You write helpful email replies."},
-            {"role": "user", "content": f"Reply to this message:\n{text}"}
-        ],
-        max_tokens=150
-    )
-    return response.choices[0].message.content
-
-def ai_rewrite(client, text, style="professional"):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": f"Rewrite text in a {style} tone."},
-            {"role": "user", "content": text}
-        ],
-        max_tokens=150
-    )
-    return response.choices[0].message.content
-
-def ai_fix_grammar(client, text):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Fix grammar but keep meaning the same."},
-            {"role": "user", "content": text}
-        ],
-        max_tokens=150
-    )
-    return response.choices[0].message.content
\ No newline at end of file
+def ai_fix_grammar(client, text, use_cache=True, user_id=None):
+    return run_ai(client, "grammar", text, use_cache=use_cache, user_id=user_id)
@@ -1,23 +1,52 @@
 # app.py
+import startup  # first: timestamps the start of the import phase
 import os
 import json
-from flask import Flask, jsonify, request, render_template, redirect, url_for
-from flask_migrate import Migrate
+import time
+import click
+from datetime import datetime, timedelta
+from itertools import islice
+from flask import Flask, Response, jsonify, request, render_template, redirect, url_for, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from dotenv import load_dotenv
-from models import db, User, Template
+from models import db, User, Template, OutboxMessage, ScheduledEmail, RecipientList, Suppression
+import history
 from ai_utils import (
     encrypt_key,
-    decrypt_key,
+    rotate_encrypted,
+    decrypt_for_user,
+    forget_user_secrets,
     get_openai_client,
+    openai_client_stats,
     ai_autocomplete,
     ai_autoreply,
     ai_rewrite,
     ai_fix_grammar,
+    stream_ai,
+    stream_long,
+    PUBLIC_OPERATIONS,
+    LONG_INPUT_OPERATIONS,
 )
-from email_utils import send_email_smtp
+from ai_cache import response_cache
+import ai_batch
+import ai_limits
+from ai_limits import AIOverloaded
+from email_utils import build_message, resolve_credentials
+from smtp_engine import ASYNC_SMTP_CONNECTIONS, ASYNC_SMTP_QUEUE_PER_CONNECTION, DeliveryBatch
+import smtp_limits
+from template_utils import CompiledEmail
+from template_cache import template_cache
+from template_seed import TEMPLATES_PATH, seed_templates
+import outbox
+import scheduled
+import recipients
+import search
+import suppression
+import metrics
+import user_cache
 from werkzeug.security import generate_password_hash, check_password_hash
 
+startup.mark("imports")
 load_dotenv()
 
 app = Flask(__name__, template_folder="templates")
@@ -40,82 +69,84 @@ if db_uri:
 os.makedirs(os.path.join(app.root_path, "instance"), exist_ok=True)
 
 db.init_app(app)
-migrate = Migrate(app, db)
+startup.register_migrate_commands(app, db)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"
+metrics.init_app(app)
+
+@app.before_request
+def _ensure_background_workers():
+    startup.on_request(app, db)
+    history.start_writer(app)
+    outbox.start_workers(app)
+    scheduled.start_poller(app)
+
 
 # NOTE: your User.id is a string (UUID). DO NOT cast to int.
+# current_user is a cached, read-only UserSnapshot; see user_cache.py.
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
-
-
-# Templates file path (relative to this file)
-TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), "templates.json")
-
-def load_templates_file():
-    import json
-
-    try:
-        with open("templates.json") as f:
-            data = json.load(f)
-    except:
-        return []
-
-    cleaned = []
-    for item in data:
-        cleaned.append({
-            "title": item.get("title") or "",
-            "subject": item.get("subject") or "",
-            "body": item.get("body") or "",
-        })
-
-    # Insert into DB if not already present
-    for tpl in cleaned:
-        exists = Template.query.filter_by(title=tpl["title"]).first()
-        if not exists:
-            new_tpl = Template(
-                title=tpl["title"],
-                subject=tpl["subject"],
-                body=tpl["body"],
-            )
-            db.session.add(new_tpl)
-
-    db.session.commit()
-    return cleaned
-
+    return user_cache.load_user(user_id)
 
 
 # -------------------------
 # Templates API
 # -------------------------
+def _cached_json(body, etag):
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    # Browsers keep the copy but must revalidate; unchanged data costs a 304.
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp.make_conditional(request)
+
+
 @app.route("/api/templates")
 @login_required
 def api_templates():
-    db_count = Template.query.count()
-    if db_count:
-        templates = [
-            {"id": str(t.id), "title": t.title, "subject": t.subject, "body": t.body}
-            for t in Template.query.order_by(Template.created_at.desc()).all()
-        ]
-        return jsonify(templates)
-    else:
-        return jsonify(load_templates_file())
+    snap = template_cache.get()
+    return _cached_json(snap.list_body, snap.list_etag)
 
 
 @app.route("/api/templates/<template_id>")
 @login_required
 def api_template_get(template_id):
-    db_row = Template.query.filter_by(id=str(template_id)).first()
-    if db_row:
-        return jsonify({"id": str(db_row.id), "title": db_row.title, "subject": db_row.subject, "body": db_row.body})
-    data = load_templates_file()
-    for t in data:
-        if str(t.get("id")) == str(template_id):
-            return jsonify(t)
-    return jsonify({"error": "not found"}), 404
+    entry = template_cache.get().by_id.get(str(template_id))
+    if entry is None:
+        return jsonify({"error": "not found"}), 404
+    _, body, etag = entry
+    return _cached_json(body, etag)
+
+
+TEMPLATE_RENDER_MAX_ROWS = int(os.getenv("TEMPLATE_RENDER_MAX_ROWS", 100000))
+
+
+@app.route("/api/templates/<template_id>/render", methods=["POST"])
+@login_required
+def api_template_render(template_id):
+    """Fill a template's placeholders for one ``variables`` object or many ``rows``."""
+    entry = template_cache.get().by_id.get(str(template_id))
+    if entry is None:
+        return jsonify({"ok": False, "error": "not found"}), 404
+    tpl = entry[0]
+    compiled = CompiledEmail(tpl["subject"], tpl["body"])
+    data = request.get_json(silent=True) or {}
+
+    rows = data.get("rows")
+    if rows is None:
+        values = data.get("variables") or {}
+        if not isinstance(values, dict):
+            return jsonify({"ok": False, "error": "variables must be an object"}), 400
+        return jsonify({"ok": True, "variables": compiled.variables, **compiled.render(values)})
+
+    if not isinstance(rows, list) or len(rows) > TEMPLATE_RENDER_MAX_ROWS:
+        return jsonify({"ok": False, "error": f"rows must be a list of at most {TEMPLATE_RENDER_MAX_ROWS} objects"}), 400
+    results = [
+        compiled.render(row) if isinstance(row, dict) else {"error": "Row must be an object"}
+        for row in rows
+    ]
+    return jsonify({"ok": True, "variables": compiled.variables, "results": results})
 
 
 # -------------------------
@@ -133,8 +164,11 @@ def save_key():
         return jsonify({"ok": False, "msg": "Missing key"}), 400
     try:
         enc = encrypt_key(key)
-        current_user.openai_enc_key = enc
+        user = db.session.get(User, current_user.id)
+        user.openai_enc_key = enc
         db.session.commit()
+        user_cache.invalidate(user.id)
+        forget_user_secrets(user.id)
         return jsonify({"ok": True})
     except Exception as e:
         return jsonify({"ok": False, "msg": str(e)}), 500
@@ -145,13 +179,20 @@ def save_key():
 # -------------------------
 def _client_for_current_user():
     if current_user.is_authenticated and getattr(current_user, "openai_enc_key", None):
-        return get_openai_client(current_user.openai_enc_key)
+        return get_openai_client(current_user.openai_enc_key, user_id=current_user.id)
     return get_openai_client()
 
 
 # -------------------------
 # AI Endpoints
 # -------------------------
+def _overloaded(e):
+    resp = jsonify({"ok": False, "error": str(e)})
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp
+
+
 @app.route("/ai/autocomplete", methods=["POST"])
 @login_required
 def route_autocomplete():
@@ -161,8 +202,10 @@ def route_autocomplete():
         return jsonify({"ok": False, "error": "Empty text"}), 400
     try:
         client = _client_for_current_user()
-        out = ai_autocomplete(client, text)
+        out = ai_autocomplete(client, text, use_cache=not data.get("no_cache"), user_id=current_user.id)
         return jsonify({"ok": True, "text": out})
+    except AIOverloaded as e:
+        return _overloaded(e)
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -176,8 +219,13 @@ def route_autoreply():
         return jsonify({"ok": False, "error": "Empty text"}), 400
     try:
         client = _client_for_current_user()
-        out = ai_autoreply(client, text)
-        return jsonify({"ok": True, "text": out})
+        report = {}
+        out = ai_autoreply(client, text, use_cache=not data.get("no_cache"), user_id=current_user.id, report=report)
+        return jsonify({"ok": True, "text": out, "input": report})
+    except AIOverloaded as e:
+        return _overloaded(e)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -192,8 +240,13 @@ def route_rewrite():
         return jsonify({"ok": False, "error": "Empty text"}), 400
     try:
         client = _client_for_current_user()
-        out = ai_rewrite(client, text, style=style)
-        return jsonify({"ok": True, "text": out})
+        report = {}
+        out = ai_rewrite(client, text, style=style, use_cache=not data.get("no_cache"), user_id=current_user.id, report=report)
+        return jsonify({"ok": True, "text": out, "input": report})
+    except AIOverloaded as e:
+        return _overloaded(e)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -207,10 +260,157 @@ def route_grammar():
         return jsonify({"ok": False, "error": "Empty text"}), 400
     try:
         client = _client_for_current_user()
-        out = ai_fix_grammar(client, text)
+        out = ai_fix_grammar(client, text, use_cache=not data.get("no_cache"), user_id=current_user.id)
         return jsonify({"ok": True, "text": out})
+    except AIOverloaded as e:
+        return _overloaded(e)
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+@app.route("/ai/<operation>/stream", methods=["POST"])
+@login_required
+def route_ai_stream(operation):
+    """Server-sent-events variant of the /ai/* endpoints.
+
+    Emits ``data: {"delta": ...}`` per token chunk, then ``event: done``
+    with the full text (autoreply/rewrite: and the ``input`` report), or
+    ``event: error``.
+    """
+    if operation not in PUBLIC_OPERATIONS:
+        return jsonify({"ok": False, "error": "Unknown operation"}), 404
+    data = request.get_json() or {}
+    text = data.get("text", "").strip()
+    style = data.get("style", "professional") if operation == "rewrite" else None
+    if not text:
+        return jsonify({"ok": False, "error": "Empty text"}), 400
+    try:
+        client = _client_for_current_user()
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+    use_cache = not data.get("no_cache")
+    report = {}
+    if operation in LONG_INPUT_OPERATIONS:
+        tokens = stream_long(client, operation, text, style=style, use_cache=use_cache, user_id=current_user.id,
+                             report=report)
+    else:
+        tokens = stream_ai(client, operation, text, style=style, use_cache=use_cache, user_id=current_user.id)
+    # Pull the first chunk before committing to a 200 so overload and
+    # upstream errors still come back as normal HTTP errors.
+    try:
+        first = next(tokens, "")
+    except AIOverloaded as e:
+        return _overloaded(e)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+    def generate():
+        parts = [first]
+        try:
+            if first:
+                yield _sse({"delta": first})
+            for delta in tokens:
+                parts.append(delta)
+                yield _sse({"delta": delta})
+            done = {"text": "".join(parts)}
+            if report:
+                done["input"] = report
+            yield _sse(done, event="done")
+        except Exception as e:
+            yield _sse({"error": str(e)}, event="error")
+        finally:
+            # Runs on client disconnect too; closes the upstream stream.
+            tokens.close()
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/ai/batch", methods=["POST"])
+@login_required
+def route_ai_batch():
+    """Run many AI items concurrently, one NDJSON line per item as it finishes.
+
+    Body: ``{"items": [{"operation", "text", "style"?}, ...], "concurrency"?,
+    "no_cache"?}``. Lines carry the item's ``index``; failed items can be
+    sent again on their own. The last line is ``{"done": true, ...}``.
+    """
+    data = request.get_json(silent=True) or {}
+    items, error = ai_batch.parse_items(data.get("items"))
+    if error:
+        return jsonify({"ok": False, "error": error}), 400
+    try:
+        concurrency = int(data.get("concurrency") or ai_batch.AI_BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "concurrency must be an integer"}), 400
+    # More than the worker's global AI slots would only bounce off admission control.
+    concurrency = min(max(concurrency, 1), ai_batch.AI_BATCH_MAX_CONCURRENCY, ai_limits.global_limiter.max_concurrent)
+    try:
+        client = _client_for_current_user()
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
+    # Batches are admitted like one more AI operation, so a user runs one
+    # at a time (AI_LIMITS["batch"] overrides the defaults).
+    user_id = current_user.id
+    limiter = ai_limits.operation_limiter("batch")
+    try:
+        limiter.acquire(user_id)
+    except AIOverloaded as e:
+        return _overloaded(e)
+
+    def generate():
+        start = time.perf_counter()
+        counts = {"succeeded": 0, "failed": 0}
+        results = ai_batch.run_batch(client, items, concurrency=concurrency, use_cache=not data.get("no_cache"))
+        try:
+            for result in results:
+                counts["succeeded" if result["ok"] else "failed"] += 1
+                yield json.dumps(result) + "\n"
+        finally:
+            results.close()
+        yield json.dumps({
+            "done": True,
+            "items": len(items),
+            **counts,
+            "elapsed": round(time.perf_counter() - start, 3),
+        }) + "\n"
+
+    resp = Response(generate(), mimetype="application/x-ndjson")
+    # Runs even if the body is never read.
+    resp.call_on_close(lambda: limiter.release(user_id))
+    return resp
+
+
+@app.route("/ai/stats")
+@login_required
+def route_ai_stats():
+    return jsonify({
+        "clients": openai_client_stats(),
+        "cache": response_cache.stats(),
+        "limits": ai_limits.stats(),
+    })
+
+
+# -------------------------
+# Prometheus metrics
+# -------------------------
+@app.route("/metrics")
+def route_metrics():
+    if metrics.METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {metrics.METRICS_TOKEN}":
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    body, content_type = metrics.render_latest()
+    return Response(body, content_type=content_type)
 
 
 # -------------------------
@@ -225,24 +425,365 @@ def route_send():
 
     if not to:
         return jsonify({"ok": False, "error": "Missing recipient"}), 400
+    if suppression.is_suppressed(current_user.id, to):
+        return jsonify({"ok": False, "error": "Recipient is on the suppression list"}), 400
 
+    # The SMTP conversation happens on an outbox worker, not on this thread.
     try:
-        # Decrypt password if available
-        password = None
-        if current_user.email_enc_password:
-            password = decrypt_key(current_user.email_enc_password)
-
-        send_email_smtp(
-            to_address=to,
-            subject=subject,
-            body_text=body,
-            sender=current_user.email,
-            password=password
-        )
+        msg = outbox.enqueue_message(current_user.id, current_user.email, to, subject, body)
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+    return jsonify({"ok": True, "id": msg.id, "status": msg.status}), 202
+
+
+@app.route("/send/<message_id>")
+@login_required
+def route_send_status(message_id):
+    msg = OutboxMessage.query.filter_by(id=str(message_id), user_id=current_user.id).first()
+    if not msg:
+        return jsonify({"ok": False, "error": "not found"}), 404
+    return jsonify({"ok": True, **outbox.message_status(msg)})
+
+
+@app.route("/send/limits")
+@login_required
+def route_send_limits():
+    return jsonify({"ok": True, **smtp_limits.stats(current_user.email)})
+
+
+# -------------------------
+# Scheduled sends
+# -------------------------
+@app.route("/schedule", methods=["POST"])
+@login_required
+def route_schedule():
+    data = request.get_json(silent=True) or request.form
+    to = data.get("to")
+    if not to:
+        return jsonify({"ok": False, "error": "Missing recipient"}), 400
+    if suppression.is_suppressed(current_user.id, to):
+        return jsonify({"ok": False, "error": "Recipient is on the suppression list"}), 400
+    try:
+        run_at = scheduled.parse_run_at(data.get("run_at"))
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "run_at must be an ISO-8601 timestamp"}), 400
+    try:
+        job = scheduled.schedule_message(current_user.id, current_user.email, to, data.get("subject"), data.get("body"), run_at)
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+    return jsonify({"ok": True, **scheduled.job_status(job)}), 201
+
+
+@app.route("/api/scheduled")
+@login_required
+def api_scheduled():
+    jobs = (
+        ScheduledEmail.query
+        .filter_by(user_id=current_user.id, status="pending")
+        .order_by(ScheduledEmail.run_at)
+        .limit(100)
+        .all()
+    )
+    return jsonify([scheduled.job_status(j) for j in jobs])
+
+
+@app.route("/api/scheduled/<job_id>", methods=["DELETE"])
+@login_required
+def api_scheduled_cancel(job_id):
+    if scheduled.cancel_scheduled(str(job_id), current_user.id):
         return jsonify({"ok": True})
+    return jsonify({"ok": False, "error": "not found or already dispatched"}), 404
+
+
+# -------------------------
+# Bulk mail-merge send
+# -------------------------
+# Concurrent SMTP sessions per batch; each one stays open for the whole batch.
+BATCH_SEND_CONNECTIONS = max(1, int(os.getenv("BATCH_SEND_CONNECTIONS", ASYNC_SMTP_CONNECTIONS)))
+# Rows rendered and rate-shaped together; deferred ones go to the outbox.
+BATCH_SEND_WINDOW = BATCH_SEND_CONNECTIONS * ASYNC_SMTP_QUEUE_PER_CONNECTION
+
+
+def _batch_row(index, row, compiled):
+    """``(to, rendered)`` for a valid row, else the error line to stream back."""
+    if not isinstance(row, dict):
+        return None, {"index": index, "ok": False, "error": "Row must be an object"}
+    to = row.get("to") or row.get("email")
+    if not to:
+        return None, {"index": index, "ok": False, "error": "Missing recipient"}
+    values = row.get("vars") if isinstance(row.get("vars"), dict) else row
+    rendered = compiled.render(values)
+    # The address columns pick the recipient (and may fill {{email}}); they
+    # are not unknown variables.
+    rendered["unknown"] = [key for key in rendered["unknown"] if key not in ("to", "email")]
+    return (to, rendered), None
+
+
+@app.route("/send/batch", methods=["POST"])
+@login_required
+def route_send_batch():
+    """Mail-merge a stored template over a list of recipient rows.
+
+    Accepts either JSON ``{"template_id": ..., "recipients": [...]}`` or, for
+    very large lists, NDJSON whose first line is ``{"template_id": ...}`` and
+    every following line is one recipient row. ``"list_id"`` in place of the
+    rows sends to an uploaded recipient list. Results stream back as NDJSON,
+    one line per recipient (with any ``missing``/``unknown`` variables),
+    followed by a summary line. Rows over the
+    sender's rate limit and temporary SMTP failures are handed to the
+    outbox (``queued``) instead of failing.
+    """
+    if request.mimetype == "application/x-ndjson":
+        lines = (line for line in request.stream if line.strip())
+        try:
+            header = json.loads(next(lines))
+        except (StopIteration, ValueError):
+            return jsonify({"ok": False, "error": "First line must be a JSON header"}), 400
+        rows = lines
+    else:
+        header = request.get_json(silent=True) or {}
+        rows = iter(header.get("recipients") or [])
+
+    tpl = Template.query.filter_by(id=str(header.get("template_id"))).first()
+    if not tpl:
+        return jsonify({"ok": False, "error": "Template not found"}), 404
+
+    if header.get("list_id"):
+        lst = recipients.get_list(header["list_id"], current_user.id)
+        if not lst or lst.status != "ready":
+            return jsonify({"ok": False, "error": "Recipient list not found or not ready"}), 404
+        rows = recipients.iter_rows(lst)
+
+    try:
+        password = (
+            decrypt_for_user(current_user.id, current_user.email_enc_password)
+            if current_user.email_enc_password else None
+        )
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
+    try:
+        sender, password = resolve_credentials(current_user.email, password)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    user_id = current_user.id
+    compiled = CompiledEmail(tpl.subject, tpl.body)
+
+    def generate():
+        counts = {"sent": 0, "failed": 0, "queued": 0, "suppressed": 0}
+        inflight = {}  # index -> (to, rendered) until its result comes back
+        batch = DeliveryBatch(sender, password, connections=BATCH_SEND_CONNECTIONS)
+
+        def drain(results):
+            for r in results:
+                to, rendered = inflight.pop(r.key)
+                line = {"index": r.key, "to": to, "ok": r.ok}
+                # Placeholders left unfilled, and row columns the template does not use.
+                line.update((k, rendered[k]) for k in ("missing", "unknown") if rendered[k])
+                if r.ok:
+                    history.record(user_id, to, rendered["subject"], body=rendered["body"])
+                    counts["sent"] += 1
+                elif r.retry:
+                    # Temporary failure: hand it to the outbox, which retries with backoff.
+                    msg = outbox.enqueue_message(user_id, sender, to, rendered["subject"], rendered["body"])
+                    line.update(error=r.error, queued=msg.id)
+                    counts["queued"] += 1
+                else:
+                    if r.bounced:
+                        suppression.suppress(user_id, [to], reason="bounce")
+                    history.record(user_id, to, rendered["subject"], status="failed", error=r.error, body=rendered["body"])
+                    line["error"] = r.error
+                    counts["failed"] += 1
+                yield json.dumps(line) + "\n"
+
+        def flush(chunk):
+            blocked = set(suppression.suppressed_indexes(user_id, [to for _, (to, _) in chunk]))
+            for i in sorted(blocked):
+                index, (to, _) = chunk[i]
+                counts["suppressed"] += 1
+                yield json.dumps({"index": index, "to": to, "ok": False, "error": "Recipient is on the suppression list",
+                                  "suppressed": True}) + "\n"
+            chunk = [item for i, item in enumerate(chunk) if i not in blocked]
+            admitted, deferred, retry_after = smtp_limits.shape(sender, [to for _, (to, _) in chunk])
+            if deferred:
+                # Over the provider's rate: the outbox sends these once tokens refill.
+                not_before = datetime.utcnow() + timedelta(seconds=retry_after)
+                queued = []
+                for i in deferred:
+                    index, (to, rendered) = chunk[i]
+                    msg = outbox.enqueue_message(
+                        user_id, sender, to, rendered["subject"], rendered["body"],
+                        commit=False, not_before=not_before,
+                    )
+                    queued.append((index, to, msg))
+                db.session.flush()
+                queued = [(index, to, msg.id) for index, to, msg in queued]
+                db.session.commit()
+                for index, to, outbox_id in queued:
+                    counts["queued"] += 1
+                    yield json.dumps({"index": index, "to": to, "ok": False, "queued": outbox_id}) + "\n"
+            for i in admitted:
+                index, item = chunk[i]
+                inflight[index] = item
+                to, rendered = item
+                # Blocks while the sessions are busy, so only a bounded
+                # window of messages is ever built at once.
+                batch.submit(index, build_message(to, rendered["subject"], rendered["body"], sender))
+                yield from drain(batch.completed())
+
+        try:
+            chunk = []
+            for index, row in enumerate(rows):
+                if isinstance(row, (bytes, str)):
+                    try:
+                        row = json.loads(row)
+                    except ValueError:
+                        row = None
+                item, error = _batch_row(index, row, compiled)
+                if error:
+                    counts["failed"] += 1
+                    yield json.dumps(error) + "\n"
+                    continue
+                chunk.append((index, item))
+                if len(chunk) >= BATCH_SEND_WINDOW:
+                    yield from flush(chunk)
+                    chunk = []
+            yield from flush(chunk)
+            yield from drain(batch.finish())
+        except BaseException:
+            # Client went away: close the sessions, drop what has not been sent.
+            batch.cancel()
+            raise
+        summary = batch.summary()
+        yield json.dumps({
+            "done": True,
+            **counts,
+            "elapsed": summary["elapsed"],
+            "messages_per_second": summary["messages_per_second"],
+        }) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# -------------------------
+# Recipient lists
+# -------------------------
+@app.route("/api/recipients", methods=["POST"])
+@login_required
+def route_recipients_upload():
+    """Upload a CSV recipient list, either as the raw body (``text/csv``) or
+    as the ``file`` field of a multipart form. Parsed while it streams in.
+    """
+    if request.mimetype == "multipart/form-data":
+        boundary = request.mimetype_params.get("boundary")
+        if not boundary:
+            return jsonify({"ok": False, "error": "Missing multipart boundary"}), 400
+        stream = recipients.MultipartUpload(request.stream, boundary)
+        try:
+            found = stream.start()
+        except recipients.RecipientImportError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        if not found:
+            return jsonify({"ok": False, "error": "Missing file"}), 400
+        # Only fields sent before the file are seen; browsers send them in form order.
+        name = request.args.get("name") or stream.fields.get("name") or stream.filename
+        size_hint = request.content_length
+    else:
+        stream, name = request.stream, request.args.get("name")
+        size_hint = request.content_length
+    try:
+        lst, errors = recipients.import_csv(current_user.id, name, stream, size_hint=size_hint)
+    except recipients.RecipientImportError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify({"ok": True, "list": recipients.list_status(lst), "errors": errors}), 201
+
+
+@app.route("/api/recipients")
+@login_required
+def route_recipients():
+    lists = (
+        RecipientList.query.filter_by(user_id=current_user.id)
+        .order_by(RecipientList.created_at.desc())
+        .all()
+    )
+    return jsonify({"ok": True, "lists": [recipients.list_status(lst) for lst in lists]})
+
+
+@app.route("/api/recipients/<list_id>")
+@login_required
+def route_recipient_list(list_id):
+    lst = recipients.get_list(list_id, current_user.id)
+    if not lst:
+        return jsonify({"ok": False, "error": "not found"}), 404
+    try:
+        offset = max(int(request.args.get("offset", 0)), 0)
+        limit = min(max(int(request.args.get("limit", 20)), 0), 100)
+    except ValueError:
+        return jsonify({"ok": False, "error": "offset and limit must be integers"}), 400
+    rows = list(islice(recipients.iter_rows(lst, offset), limit))
+    return jsonify({"ok": True, "list": recipients.list_status(lst), "rows": rows})
+
+
+@app.route("/api/recipients/<list_id>", methods=["DELETE"])
+@login_required
+def route_recipient_list_delete(list_id):
+    lst = recipients.get_list(list_id, current_user.id)
+    if not lst:
+        return jsonify({"ok": False, "error": "not found"}), 404
+    recipients.delete_list(lst)
+    return jsonify({"ok": True})
+
+
+# -------------------------
+# Suppression list
+# -------------------------
+@app.route("/api/suppressions")
+@login_required
+def route_suppressions():
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+        before = int(request.args["before"]) if request.args.get("before") else None
+    except ValueError:
+        return jsonify({"ok": False, "error": "limit and before must be integers"}), 400
+    query = Suppression.query.filter_by(scope=suppression.scope_for(current_user.id))
+    if before is not None:
+        query = query.filter(Suppression.id < before)
+    entries = query.order_by(Suppression.id.desc()).limit(limit).all()
+    return jsonify({
+        "ok": True,
+        "total": suppression.count(current_user.id),
+        "entries": [suppression.entry_status(e) for e in entries],
+        "next_before": entries[-1].id if len(entries) == limit else None,
+    })
+
+
+@app.route("/api/suppressions", methods=["POST"])
+@login_required
+def route_suppressions_add():
+    data = request.get_json(silent=True) or {}
+    addresses = data.get("addresses") or ([data["address"]] if data.get("address") else [])
+    reason = data.get("reason") or "manual"
+    if not isinstance(addresses, list) or not addresses:
+        return jsonify({"ok": False, "error": "Provide address or addresses"}), 400
+    if reason not in suppression.SUPPRESSION_REASONS:
+        return jsonify({"ok": False, "error": "reason must be one of " + ", ".join(suppression.SUPPRESSION_REASONS)}), 400
+    valid, invalid = [], []
+    for address in addresses:
+        address, error = recipients.validate_address(str(address))
+        (valid.append(address) if address else invalid.append(error))
+    added = suppression.suppress(current_user.id, valid, reason=reason)
+    return jsonify({"ok": True, "added": added, "invalid": invalid}), 201
+
+
+@app.route("/api/suppressions/<path:address>", methods=["DELETE"])
+@login_required
+def route_suppressions_delete(address):
+    if suppression.unsuppress(current_user.id, address):
+        return jsonify({"ok": True})
+    return jsonify({"ok": False, "error": "not found"}), 404
+
+
 # -------------------------
 # Email Password (Keychain) UI
 # -------------------------
@@ -259,8 +800,11 @@ def email_password():
             message = "Missing email or password"
         else:
             encrypted = encrypt_key(sender_password)
-            current_user.email_enc_password = encrypted
+            user = db.session.get(User, current_user.id)
+            user.email_enc_password = encrypted
             db.session.commit()
+            user_cache.invalidate(user.id)
+            forget_user_secrets(user.id)
             message = "Password saved successfully!"
     else:
         sender_email = None
@@ -307,6 +851,8 @@ def register():
 @app.route("/logout")
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
+    forget_user_secrets(current_user.id)
     logout_user()
     return redirect(url_for("login"))
 
@@ -314,22 +860,47 @@ def logout():
 @app.route("/")
 @login_required
 def index():
-    templates = []
-    db_count = Template.query.count()
+    return render_template("index.html", templates=template_cache.get().names)
 
-    if db_count == 0:
-        js = load_templates_file()
-        templates = [{"id": str(i), "name": t.get("title")} for i, t in enumerate(js)]
-    else:
-        templates = [{"id": str(t.id), "name": t.title} for t in Template.query.all()]
 
-    return render_template("index.html", templates=templates)
+@app.route("/history", endpoint="history")
+@login_required
+def history_page():
+    return render_template("history.html")
 
 
-@app.route("/history")
+@app.route("/api/history")
 @login_required
-def history():
-    return render_template("history.html")
+def api_history():
+    try:
+        rows, next_cursor = history.page_for_user(
+            current_user.id,
+            cursor=request.args.get("cursor"),
+            limit=request.args.get("limit", 50),
+        )
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "Bad cursor or limit"}), 400
+    return jsonify({"ok": True, "items": [history.row_json(r) for r in rows], "next_cursor": next_cursor})
+
+
+# -------------------------
+# Search (templates + own sent mail)
+# -------------------------
+@app.route("/api/search")
+@login_required
+def api_search():
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"ok": False, "error": "Missing q"}), 400
+    kind = request.args.get("kind")
+    if kind and kind not in search.SEARCH_KINDS:
+        return jsonify({"ok": False, "error": "kind must be one of: " + ", ".join(search.SEARCH_KINDS)}), 400
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return jsonify({"ok": False, "error": "Bad limit"}), 400
+    results = search.search(q, current_user.id, kinds=(kind,) if kind else search.SEARCH_KINDS, limit=limit)
+    return jsonify({"ok": True, "results": results})
 
 
 # -------------------------
@@ -339,44 +910,92 @@ def history():
 # CLI helper to seed templates
 # ------------------------------------------
 @app.cli.command("seed-templates")
-def seed_templates():
-    count = Template.query.count()
-    if count:
-        print("Templates already present.")
-        return
-
-    data = load_templates_file()  # <-- THIS defines "data"
-
-    for t in data:
-        title = t.get("title") or t.get("id") or ""
-        subject = t.get("subject") or ""
-        body = t.get("body") or t.get("content") or ""
-
-        tpl = Template(
-            title=title,
-            subject=subject,
-            body=body
-        )
-        db.session.add(tpl)
+@click.option("--update", is_flag=True, help="Also overwrite subject/body of templates that already exist.")
+@click.option("--path", default=TEMPLATES_PATH, show_default=True, help="JSON file to import.")
+def seed_templates_command(update, path):
+    inserted, updated = seed_templates(path, update_existing=update)
+    print(f"Seeded templates: {inserted} inserted, {updated} updated.")
+
+
+@app.cli.command("suppress")
+@click.argument("addresses", nargs=-1, required=True)
+@click.option("--reason", default="manual", type=click.Choice(suppression.SUPPRESSION_REASONS), show_default=True)
+def suppress_command(addresses, reason):
+    """Suppress ADDRESSES for every sender (e.g. spam complaints)."""
+    added = suppression.suppress(None, addresses, reason=reason)
+    print(f"Suppressed {added} new address(es) for all senders.")
+
+
+@app.cli.command("rotate-keys")
+@click.option("--batch-size", default=500, show_default=True, help="Users re-encrypted per commit.")
+def rotate_keys_command(batch_size):
+    """Re-encrypt stored secrets under the first key in FERNET_KEYS.
+
+    Put the new key first in FERNET_KEYS, deploy, run this, and drop the
+    old key once USER_CACHE_TTL has passed (workers may still hold the old
+    ciphertext until then).
+    """
+    from cryptography.fernet import InvalidToken
+    rotated = failed = 0
+    last_id = ""
+    while True:
+        users = User.query.filter(User.id > last_id).order_by(User.id).limit(batch_size).all()
+        if not users:
+            break
+        for user in users:
+            for column in ("openai_enc_key", "email_enc_password"):
+                value = getattr(user, column)
+                if not value:
+                    continue
+                try:
+                    setattr(user, column, rotate_encrypted(value))
+                    rotated += 1
+                except InvalidToken:
+                    failed += 1
+                    print(f"User {user.id}: {column} does not decrypt with any key in FERNET_KEYS; left as is.")
+        db.session.commit()
+        last_id = users[-1].id
+    print(f"Re-encrypted {rotated} secret(s); {failed} could not be decrypted.")
+
+
+@app.cli.command("outbox-worker")
+def outbox_worker():
+    """Run outbox sender threads in the foreground."""
+    startup.prepare(app, db)
+    print("Outbox worker running. Press Ctrl+C to stop.")
+    if os.getenv("METRICS_PORT"):
+        # No web server in this process; expose SMTP metrics on their own port.
+        metrics.start_http_server(int(os.getenv("METRICS_PORT")))
+    history.start_writer(app)
+    scheduled.start_poller(app)
+    outbox.run_forever(app)
 
-    db.session.commit()
-    print("Seeded templates:", len(data))
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Run pending migrations and the first-boot template seed, once."""
+    migrated, seeded = startup.migrate_and_seed(app, db)
+    print("Database upgraded successfully." if migrated else "Database already up to date.")
+    if seeded:
+        print(f"Seeded {seeded} templates from templates.json.")
 
 
 # ------------------------------------------
-# Auto-run migrations on startup (free tier safe)
+# Startup
 # ------------------------------------------
-from flask_migrate import upgrade
+def create_app():
+    """App factory for gunicorn ("app:create_app()") and ``python app.py``.
+
+    Importing this module touches no database. Migrations and the template
+    seed run here (once across all workers, see startup.py), or on the
+    first request if the app was loaded some other way.
+    """
+    startup.prepare(app, db)
+    return app
 
-# Auto-run migrations on startup (only if database is empty)
-with app.app_context():
-    try:
-        upgrade()   # <-- This defines "upgrade" correctly
-        print("Database upgraded successfully.")
-    except Exception as e:
-        print(f"Migration skipped or failed: {e}")
 
+startup.mark("configure")
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
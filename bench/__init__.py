@@ -0,0 +1 @@
+"""Local load/benchmark suite: ``python -m bench.run --help``."""
@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_WORDS = "thanks for the update we will follow up with the details shortly".split()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "bad json"}})
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": "not found"}})
+
+        server.count("requests")
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+        completion_tokens = min(int(request.get("max_tokens") or server.completion_tokens), server.completion_tokens)
+        words = [_WORDS[i % len(_WORDS)] for i in range(completion_tokens)]
+        base = {
+            "id": "chatcmpl-" + uuid.uuid4().hex[:12],
+            "created": int(time.time()),
+            "model": request.get("model", "bench"),
+        }
+
+        time.sleep(server.latency)
+        if request.get("stream"):
+            server.count("streams")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for i, word in enumerate(words):
+                delta = {"content": (" " if i else "") + word}
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                self.wfile.write(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+                self.wfile.flush()
+                time.sleep(server.token_latency)
+            last = {**base, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            self.wfile.write(b"data: " + json.dumps(last).encode() + b"\n\n")
+            if (request.get("stream_options") or {}).get("include_usage"):
+                usage = {**base, "object": "chat.completion.chunk", "choices": [],
+                         "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                   "total_tokens": prompt_tokens + completion_tokens}}
+                self.wfile.write(b"data: " + json.dumps(usage).encode() + b"\n\n")
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+
+        time.sleep(server.token_latency * completion_tokens)
+        self._send_json(200, {
+            **base,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": " ".join(words)}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """OpenAI-compatible ``/v1/chat/completions`` (plain and streamed).
+
+    Replies take ``latency`` seconds plus ``token_latency`` per generated
+    token; any API key is accepted. Point the app at it with
+    ``OPENAI_BASE_URL=http://127.0.0.1:<port>/v1``.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_latency=0.0, completion_tokens=32):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.completion_tokens = completion_tokens
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "streams": 0}
+
+    @property
+    def base_url(self):
+        return "http://%s:%d/v1" % self.server_address[:2]
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="bench-fake-openai", daemon=True).start()
+        return self
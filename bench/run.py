@@ -0,0 +1,413 @@
+"""Drive the app against a local SMTP sink and fake OpenAI server.
+
+    python -m bench.run --users 8 --requests 50
+    python -m bench.run --scenarios send,desktop --smtp-data-latency 0.05
+    python -m bench.run --compare bench/results/bench-20261016-120000.json
+
+Every scenario runs ``--users`` concurrent virtual users (each with its own
+account and session) making ``--requests`` calls. The report holds
+p50/p95/p99 latency, throughput and SQL statements per request for each
+scenario and is written as JSON under bench/results/.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from bench.fake_openai import FakeOpenAIServer
+from bench.smtp_sink import SMTPSink
+
+BENCH_SENDER = "bench@example.com"
+BENCH_PASSWORD = "bench-password"
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SCENARIOS = ("templates", "templates_etag", "send", "ai", "ai_cached", "ai_stream", "desktop")
+DEFAULT_SCENARIOS = ("templates", "templates_etag", "send", "ai", "ai_cached", "desktop")
+
+SAMPLE_TEXT = (
+    "Hi team, the quarterly report is attached. Please review the numbers "
+    "before Thursday and let me know if anything looks off."
+)
+
+
+# -------------------------
+# Environment (must be set before the app is imported)
+# -------------------------
+def configure_env(args, sink, fake):
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    env = {
+        "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(sink.port),
+        "SMTP_STARTTLS": "0",
+        "DEFAULT_SENDER_EMAIL": BENCH_SENDER,
+        "SENDER_EMAIL": BENCH_SENDER,
+        "EMAIL_APP_PASSWORD": BENCH_PASSWORD,
+        "OPENAI_BASE_URL": fake.base_url,
+        "OPENAI_API_KEY": "sk-bench",
+    }
+    os.environ.update(env)
+    if not (os.getenv("FERNET_KEYS") or os.getenv("FERNET_KEY")):
+        from cryptography.fernet import Fernet
+        os.environ["FERNET_KEY"] = Fernet.generate_key().decode()
+    # Keep runs independent of whatever shared AI cache a developer has set up.
+    os.environ["AI_CACHE_DB"] = ""
+    return env
+
+
+# -------------------------
+# Measurement
+# -------------------------
+class QueryCounter:
+    """Counts SQL statements and time spent in them, per benchmark thread.
+
+    Statements from threads that are not inside ``track()`` (outbox
+    workers, the history writer) are added to ``background``.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.background = {"queries": 0, "seconds": 0.0}
+
+    def install(self, engine):
+        from sqlalchemy import event
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("bench_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["bench_started"].pop()
+        current = getattr(self._local, "current", None)
+        if current is None:
+            with self._lock:
+                self.background["queries"] += 1
+                self.background["seconds"] += elapsed
+        else:
+            current[0] += 1
+            current[1] += elapsed
+
+    @contextmanager
+    def track(self):
+        self._local.current = [0, 0.0]
+        try:
+            yield self._local.current
+        finally:
+            self._local.current = None
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def summarize(samples, wall, ok_statuses):
+    latencies = sorted(s["latency"] for s in samples)
+    statuses = Counter(str(s["status"]) for s in samples)
+    queries = sorted(s["queries"] for s in samples)
+    n = len(samples)
+    summary = {
+        "requests": n,
+        "errors": sum(count for status, count in statuses.items() if status not in ok_statuses),
+        "status": dict(statuses),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(n / wall, 2) if wall else None,
+        "latency_ms": {
+            "p50": _ms(percentile(latencies, 50)),
+            "p95": _ms(percentile(latencies, 95)),
+            "p99": _ms(percentile(latencies, 99)),
+            "mean": _ms(sum(latencies) / n) if n else None,
+            "max": _ms(latencies[-1]) if n else None,
+        },
+        "db": {
+            "queries_per_request": round(sum(queries) / n, 2) if n else None,
+            "queries_p95": percentile(queries, 95),
+            "ms_per_request": _ms(sum(s["db_seconds"] for s in samples) / n) if n else None,
+        },
+    }
+    ttfb = sorted(s["ttfb"] for s in samples if s.get("ttfb") is not None)
+    if ttfb:
+        summary["ttfb_ms"] = {"p50": _ms(percentile(ttfb, 50)), "p95": _ms(percentile(ttfb, 95)),
+                              "p99": _ms(percentile(ttfb, 99))}
+    return summary
+
+
+# -------------------------
+# Virtual users and scenarios
+# -------------------------
+class VirtualUser:
+    def __init__(self, app, index):
+        self.index = index
+        self.email = f"bench{index}@example.com"
+        self.client = app.test_client()
+        self.etag = None
+        self.client.post("/register", data={"email": self.email, "password": BENCH_PASSWORD})
+        self.client.post("/email_password", data={"sender_email": self.email, "sender_password": BENCH_PASSWORD})
+        self.client.post("/save_key", json={"openai_key": "sk-bench"})
+
+
+def _templates(vu, i):
+    return vu.client.get("/api/templates").status_code, None
+
+
+def _templates_etag(vu, i):
+    if vu.etag is None:
+        vu.etag = vu.client.get("/api/templates").headers.get("ETag")
+    return vu.client.get("/api/templates", headers={"If-None-Match": vu.etag}).status_code, None
+
+
+def _send(vu, i):
+    resp = vu.client.post("/send", json={
+        "to": f"rcpt{vu.index}-{i}@example.com",
+        "subject": f"Bench {i}",
+        "body": SAMPLE_TEXT,
+    })
+    return resp.status_code, None
+
+
+def _ai(vu, i):
+    # A unique text per call, so every request goes upstream.
+    text = f"{SAMPLE_TEXT} [{vu.index}-{i}-{random.random()}]"
+    return vu.client.post("/ai/rewrite", json={"text": text, "no_cache": True}).status_code, None
+
+
+def _ai_cached(vu, i):
+    return vu.client.post("/ai/rewrite", json={"text": SAMPLE_TEXT}).status_code, None
+
+
+def _ai_stream(vu, i):
+    text = f"{SAMPLE_TEXT} [{vu.index}-{i}-{random.random()}]"
+    start = time.perf_counter()
+    resp = vu.client.post("/ai/rewrite/stream", json={"text": text, "no_cache": True}, buffered=False)
+    ttfb = None
+    try:
+        for chunk in resp.response:
+            if ttfb is None and chunk:
+                ttfb = time.perf_counter() - start
+    finally:
+        resp.close()
+    return resp.status_code, ttfb
+
+
+def _desktop(vu, i):
+    import email_tool
+    email_tool.send_email_now(f"desk{vu.index}-{i}@example.com", f"Desktop {i}", SAMPLE_TEXT)
+    return "ok", None
+
+
+SCENARIO_CALLS = {
+    "templates": (_templates, {"200"}),
+    "templates_etag": (_templates_etag, {"304"}),
+    "send": (_send, {"202"}),
+    "ai": (_ai, {"200"}),
+    "ai_cached": (_ai_cached, {"200"}),
+    "ai_stream": (_ai_stream, {"200"}),
+    "desktop": (_desktop, {"ok"}),
+}
+
+
+def run_scenario(name, users, per_user, warmup, counter):
+    call, ok_statuses = SCENARIO_CALLS[name]
+    samples = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(users) + 1)
+
+    def worker(vu):
+        for i in range(warmup):
+            try:
+                call(vu, -1 - i)
+            except Exception:
+                pass
+        barrier.wait()
+        mine = []
+        for i in range(per_user):
+            with counter.track() as q:
+                start = time.perf_counter()
+                try:
+                    status, ttfb = call(vu, i)
+                except Exception as e:
+                    status, ttfb = type(e).__name__, None
+                latency = time.perf_counter() - start
+            mine.append({"latency": latency, "status": status, "ttfb": ttfb, "queries": q[0], "db_seconds": q[1]})
+        with lock:
+            samples.extend(mine)
+
+    threads = [threading.Thread(target=worker, args=(vu,), name=f"bench-{name}-{vu.index}") for vu in users]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    return summarize(samples, time.perf_counter() - start, ok_statuses)
+
+
+def wait_for_outbox(app, timeout):
+    """Wait until /send's queued messages are delivered; returns delivery stats."""
+    from models import OutboxMessage
+    start = time.perf_counter()
+    with app.app_context():
+        from models import db
+        while True:
+            pending = OutboxMessage.query.filter(OutboxMessage.status.in_(("queued", "sending"))).count()
+            db.session.remove()
+            if not pending or time.perf_counter() - start > timeout:
+                break
+            time.sleep(0.05)
+        counts = dict(
+            db.session.query(OutboxMessage.status, db.func.count()).group_by(OutboxMessage.status).all()
+        )
+        db.session.remove()
+    return {"seconds": round(time.perf_counter() - start, 3), "pending": pending, "by_status": counts}
+
+
+# -------------------------
+# Reporting
+# -------------------------
+def print_table(report):
+    print(f"\n{'scenario':<16}{'reqs':>6}{'err':>5}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'q/req':>7}")
+    for name, s in report["scenarios"].items():
+        if "skipped" in s:
+            print(f"{name:<16} skipped: {s['skipped']}")
+            continue
+        lat = s["latency_ms"]
+        print(f"{name:<16}{s['requests']:>6}{s['errors']:>5}{s['throughput_rps']:>9}"
+              f"{lat['p50']:>10}{lat['p95']:>10}{lat['p99']:>10}{s['db']['queries_per_request']:>7}")
+
+
+def print_comparison(report, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path}")
+    for name, s in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old or "skipped" in s or "skipped" in old:
+            continue
+        parts = []
+        for label, new_v, old_v in (
+            ("rps", s["throughput_rps"], old["throughput_rps"]),
+            ("p50", s["latency_ms"]["p50"], old["latency_ms"]["p50"]),
+            ("p95", s["latency_ms"]["p95"], old["latency_ms"]["p95"]),
+            ("p99", s["latency_ms"]["p99"], old["latency_ms"]["p99"]),
+        ):
+            change = f"{(new_v - old_v) / old_v * 100:+.1f}%" if old_v else "n/a"
+            parts.append(f"{label} {old_v}->{new_v} ({change})")
+        print(f"  {name:<16}" + "  ".join(parts))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__.splitlines()[0])
+    p.add_argument("--users", type=int, default=4, help="concurrent virtual users")
+    p.add_argument("--requests", type=int, default=25, help="requests per user per scenario")
+    p.add_argument("--warmup", type=int, default=2, help="unrecorded requests per user first")
+    p.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS),
+                   help="comma-separated, from: " + ", ".join(SCENARIOS))
+    p.add_argument("--smtp-connect-latency", type=float, default=0.0)
+    p.add_argument("--smtp-auth-latency", type=float, default=0.0)
+    p.add_argument("--smtp-data-latency", type=float, default=0.01)
+    p.add_argument("--ai-latency", type=float, default=0.05, help="seconds before the first token")
+    p.add_argument("--ai-token-latency", type=float, default=0.001, help="seconds per generated token")
+    p.add_argument("--ai-tokens", type=int, default=32, help="completion tokens per reply")
+    p.add_argument("--outbox-timeout", type=float, default=60, help="max seconds to wait for queued sends")
+    p.add_argument("--database-url", help="default: a fresh SQLite file in a temp dir")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", help="report path (default: bench/results/bench-<timestamp>.json)")
+    p.add_argument("--compare", metavar="BASELINE", help="earlier report to diff against")
+    args = p.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        p.error("unknown scenario(s): " + ", ".join(sorted(unknown)))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    sink = SMTPSink(connect_latency=args.smtp_connect_latency, auth_latency=args.smtp_auth_latency,
+                    data_latency=args.smtp_data_latency).start()
+    fake = FakeOpenAIServer(latency=args.ai_latency, token_latency=args.ai_token_latency,
+                            completion_tokens=args.ai_tokens).start()
+    env = configure_env(args, sink, fake)
+
+    # Imported late: the app reads its configuration at import time.
+    import app as appmod
+    from models import db
+    app = appmod.create_app()
+    counter = QueryCounter()
+    with app.app_context():
+        counter.install(db.engine)
+        dialect = db.engine.dialect.name
+
+    users = [VirtualUser(app, n) for n in range(args.users)]
+    report = {
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": dialect,
+            "smtp_port": env["SMTP_PORT"],
+        },
+        "scenarios": {},
+    }
+
+    for name in args.scenarios:
+        if name == "desktop":
+            try:
+                import email_tool
+            except Exception as e:  # tkinter/keyring missing on headless boxes
+                report["scenarios"][name] = {"skipped": f"email_tool unavailable: {e}"}
+                continue
+            # The desktop app reads its password from the OS keyring.
+            email_tool.get_stored_password = lambda sender: BENCH_PASSWORD
+        print(f"running {name} ({args.users} users x {args.requests})...", flush=True)
+        before = dict(sink.stats)
+        result = run_scenario(name, users, args.requests, args.warmup, counter)
+        if name == "send":
+            result["delivery"] = wait_for_outbox(app, args.outbox_timeout)
+            delivered = sink.stats["messages"] - before["messages"]
+            seconds = result["wall_seconds"] + result["delivery"]["seconds"]
+            result["delivery"]["delivered_per_second"] = round(delivered / seconds, 2) if seconds else None
+        result["smtp_sink"] = {k: sink.stats[k] - before[k] for k in sink.stats}
+        report["scenarios"][name] = result
+
+    from ai_cache import response_cache
+    from email_utils import smtp_pool
+    report["smtp_sink"] = dict(sink.stats)
+    report["fake_openai"] = dict(fake.stats)
+    report["background_db"] = {"queries": counter.background["queries"],
+                               "seconds": round(counter.background["seconds"], 3)}
+    report["app"] = {"smtp_pool": dict(smtp_pool.stats), "ai_cache": response_cache.stats()}
+
+    out = args.out or os.path.join(RESULTS_DIR, f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=False)
+
+    print_table(report)
+    if args.compare:
+        print_comparison(report, args.compare)
+    print(f"\nreport: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import socketserver
+import threading
+import time
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: EHLO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def _reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        sink = self.server
+        sink.count("connections")
+        time.sleep(sink.connect_latency)
+        self._reply("220 bench-sink ESMTP")
+        in_data = False
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            if in_data:
+                if line == ".":
+                    in_data = False
+                    time.sleep(sink.data_latency)
+                    sink.count("messages")
+                    self._reply("250 2.0.0 queued")
+                continue
+            verb = line[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self._reply("250-bench-sink")
+                self._reply("250 AUTH PLAIN LOGIN")
+            elif verb == "AUTH":
+                time.sleep(sink.auth_latency)
+                sink.count("auths")
+                self._reply("235 2.7.0 accepted")
+            elif verb == "RCPT" and sink.reject_domain and sink.reject_domain in line:
+                self._reply("550 5.1.1 no such user")
+            elif verb == "DATA":
+                in_data = True
+                self._reply("354 go ahead")
+            elif verb == "QUIT":
+                self._reply("221 bye")
+                return
+            else:
+                self._reply("250 ok")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """In-process SMTP server that accepts and discards mail.
+
+    Latencies (seconds) are added at connect, AUTH and end of DATA so runs
+    can model a slow provider. Recipients containing ``reject_domain`` get a
+    permanent 550.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, connect_latency=0.0, auth_latency=0.0,
+                 data_latency=0.0, reject_domain=None):
+        super().__init__((host, port), _SinkHandler)
+        self.connect_latency = connect_latency
+        self.auth_latency = auth_latency
+        self.data_latency = data_latency
+        self.reject_domain = reject_domain
+        self._lock = threading.Lock()
+        self.stats = {"connections": 0, "auths": 0, "messages": 0}
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="bench-smtp-sink", daemon=True).start()
+        return self
@@ -0,0 +1,147 @@
+import hashlib
+import math
+
+
+def _power_of_two(bits):
+    """The smallest power of two >= ``bits``, and at least 8 (one byte)."""
+    return 1 << max(int(bits - 1).bit_length(), 3)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over byte strings.
+
+    Uses ``bits / 8`` bytes no matter how many items are added. Lookups
+    never miss an added item; the chance that an item that was never added
+    looks present is about ``(1 - e^(-k*n/m)) ** k`` after ``n`` adds.
+    """
+
+    __slots__ = ("bits", "hashes", "count", "_mask", "_array")
+
+    def __init__(self, bits, hashes=7):
+        # A power of two, so an index is a mask instead of a modulo.
+        self.bits = _power_of_two(bits)
+        self.hashes = max(1, int(hashes))
+        self.count = 0
+        self._mask = self.bits - 1
+        self._array = bytearray(self.bits // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.001, max_bits=None):
+        """Size for ``capacity`` items at ``error_rate``, capped at ``max_bits``."""
+        capacity = max(int(capacity), 1)
+        bits = _power_of_two(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        if max_bits and bits > max_bits:
+            # Round the cap down, so rounding never takes the filter past it.
+            bits = max(_power_of_two(max_bits + 1) >> 1, 8)
+        hashes = round(bits / capacity * math.log(2))
+        return cls(bits, min(max(hashes, 1), 16))
+
+    @staticmethod
+    def digest(item):
+        """The two base hashes of ``item``, shared by every filter that checks it."""
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+    def _indexes(self, hashed):
+        h1, h2 = hashed
+        mask = self._mask
+        return [(h1 + i * h2) & mask for i in range(self.hashes)]
+
+    def add(self, item, hashed=None):
+        """Add ``item``; returns False if it was (probably) already present."""
+        array = self._array
+        new = False
+        for index in self._indexes(hashed or self.digest(item)):
+            byte, bit = index >> 3, 1 << (index & 7)
+            if not array[byte] & bit:
+                array[byte] |= bit
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def contains(self, item, hashed=None):
+        h1, h2 = hashed or self.digest(item)
+        array, mask = self._array, self._mask
+        # Stops at the first clear bit: a miss usually costs one or two probes.
+        for i in range(self.hashes):
+            index = (h1 + i * h2) & mask
+            if not array[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def __contains__(self, item):
+        return self.contains(item)
+
+    def error_rate(self):
+        """Estimated false-positive rate at the current fill."""
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    @property
+    def nbytes(self):
+        return len(self._array)
+
+
+class ScalableBloomFilter:
+    """Bloom filter for an unknown number of items.
+
+    Starts with one ``BloomFilter`` sized for ``initial_capacity`` and adds
+    a twice-as-large one, at a tighter error rate, each time the newest is
+    full, so the overall false-positive rate stays near ``error_rate``
+    however many items arrive. Once ``max_bits`` is spent it stops growing
+    and the rate rises instead.
+    """
+
+    __slots__ = ("error_rate_target", "max_bits", "count", "_filters", "_capacity", "_next_rate")
+
+    GROWTH = 2
+    TIGHTENING = 0.8
+
+    def __init__(self, initial_capacity=100000, error_rate=0.001, max_bits=None):
+        self.error_rate_target = error_rate
+        self.max_bits = max_bits
+        self.count = 0
+        self._filters = []
+        self._capacity = max(int(initial_capacity), 1)
+        # The series error_rate * (1 - r) * r**i sums to error_rate.
+        self._next_rate = error_rate * (1 - self.TIGHTENING)
+        self._grow()
+
+    def _grow(self):
+        budget = None if self.max_bits is None else self.max_bits - self.nbytes * 8
+        if self._filters and budget is not None and budget < 1024:
+            return False
+        if self._filters:
+            self._capacity *= self.GROWTH
+        self._filters.append(BloomFilter.for_capacity(self._capacity, self._next_rate, max_bits=budget))
+        self._next_rate *= self.TIGHTENING
+        return True
+
+    def add(self, item):
+        """Add ``item``; returns False if it was (probably) already present."""
+        hashed = BloomFilter.digest(item)
+        for f in self._filters:
+            if f.contains(item, hashed):
+                return False
+        newest = self._filters[-1]
+        if newest.count >= self._capacity:
+            self._grow()
+            newest = self._filters[-1]
+        newest.add(item, hashed)
+        self.count += 1
+        return True
+
+    def __contains__(self, item):
+        hashed = BloomFilter.digest(item)
+        return any(f.contains(item, hashed) for f in self._filters)
+
+    def error_rate(self):
+        """Estimated false-positive rate at the current fill."""
+        miss = 1.0
+        for f in self._filters:
+            miss *= 1 - f.error_rate()
+        return 1 - miss
+
+    @property
+    def nbytes(self):
+        return sum(f.nbytes for f in self._filters)
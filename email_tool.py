@@ -9,17 +9,22 @@ Email Automation Tool with:
 """
 
 import os
+import itertools
 import json
+import queue
+import smtplib
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import messagebox, scrolledtext, ttk
 from datetime import datetime
 from email.message import EmailMessage
-import smtplib
 import keyring
 from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
 import requests
+from email_utils import deliver_message, SMTP_STARTTLS
+from suppression_index import SuppressionIndex, normalize_address
 
 # -------------------------
 # Load environment / config
@@ -54,12 +59,55 @@ def save_templates(templates):
 
 TEMPLATES = load_templates()
 
+# -------------------------
+# Suppression list: one address per line
+# -------------------------
+SUPPRESSION_FILE = os.getenv("SUPPRESSION_FILE", "suppressions.txt")
+def load_suppressions():
+    try:
+        with open(SUPPRESSION_FILE, "r", encoding="utf-8") as f:
+            return SuppressionIndex(("*", normalize_address(line)) for line in f if line.strip())
+    except FileNotFoundError:
+        return SuppressionIndex()
+
+_suppression_lock = threading.Lock()  # sends run on several worker threads
+def add_suppression(address):
+    address = normalize_address(address)
+    with _suppression_lock:
+        if SUPPRESSIONS.add("*", address):
+            with open(SUPPRESSION_FILE, "a", encoding="utf-8") as f:
+                f.write(address + "\n")
+
+SUPPRESSIONS = load_suppressions()
+
 # -------------------------
 # Scheduler
 # -------------------------
 sched = BackgroundScheduler()
 sched.start()
 
+# -------------------------
+# Background work
+# -------------------------
+# Sends and AI calls run on a small pool; Tk may only be touched from the
+# main thread, so workers report through `results` and the GUI drains it
+# every RESULT_POLL_MS (see poll_results).
+WORKER_THREADS = int(os.getenv("DESKTOP_WORKER_THREADS", 4))
+MAX_PENDING_JOBS = int(os.getenv("DESKTOP_MAX_PENDING_JOBS", 200))
+RESULT_POLL_MS = int(os.getenv("DESKTOP_RESULT_POLL_MS", 100))
+executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="email-tool")
+results = queue.Queue()  # (job id, state, detail)
+_job_ids = itertools.count(1)
+
+def run_job(job_id, fn, args):
+    results.put((job_id, "running", None))
+    try:
+        value = fn(*args)
+    except Exception as e:
+        results.put((job_id, "failed", e))
+    else:
+        results.put((job_id, "done", value))
+
 # -------------------------
 # Keyring helpers
 # -------------------------
@@ -79,6 +127,8 @@ def send_email_now(to_address, subject, body_text):
     pw = get_stored_password(sender)
     if not pw:
         raise ValueError("No password stored. Use 'Set Password' first.")
+    if SUPPRESSIONS.contains("*", to_address):
+        raise ValueError(f"{to_address} is on the suppression list ({SUPPRESSION_FILE})")
 
     msg = EmailMessage()
     msg["From"] = sender
@@ -86,26 +136,32 @@ def send_email_now(to_address, subject, body_text):
     msg["Subject"] = subject
     msg.set_content(body_text)
 
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30) as smtp:
-        smtp.ehlo()
-        if SMTP_PORT == 587:
-            smtp.starttls()
-            smtp.ehlo()
-        smtp.login(sender, pw)
-        smtp.send_message(msg)
+    # Reuses an authenticated session from the shared pool when one is alive.
+    try:
+        deliver_message(msg, sender, pw, server=SMTP_SERVER, port=SMTP_PORT, starttls=SMTP_STARTTLS and SMTP_PORT == 587)
+    except smtplib.SMTPRecipientsRefused as e:
+        # Hard bounce: never try this address again.
+        if all(code >= 500 for code, _ in e.recipients.values()):
+            add_suppression(to_address)
+        raise
 
 def send_email_threadsafe(to_address, subject, body_text):
-    def _send():
-        try:
-            send_email_now(to_address, subject, body_text)
-            messagebox.showinfo("Success", f"Email sent to {to_address}")
-        except Exception as e:
-            messagebox.showerror("Error sending", f"{e}")
-    threading.Thread(target=_send, daemon=True).start()
+    # Outcome shows in the status panel: no dialog per send.
+    return submit_job(f"Send to {to_address}", send_email_now, to_address, subject, body_text)
+
+def start_scheduled(job_id, fn, args):
+    # Fires on APScheduler's thread; the work itself goes to the shared pool.
+    results.put((job_id, "queued", None))
+    executor.submit(run_job, job_id, fn, args)
 
 def schedule_email(run_at_dt, to_address, subject, body_text):
-    job = sched.add_job(send_email_now, 'date', run_date=run_at_dt, args=[to_address, subject, body_text])
-    return job
+    job_id = add_job_row(f"Send to {to_address}", f"scheduled {run_at_dt:%Y-%m-%d %H:%M}")
+    try:
+        return sched.add_job(start_scheduled, 'date', run_date=run_at_dt,
+                             args=[job_id, send_email_now, (to_address, subject, body_text)])
+    except Exception:
+        remove_job_row(job_id)
+        raise
 
 # -------------------------
 # Google Gemini helper
@@ -245,20 +301,19 @@ save_tpl_btn = tk.Button(frm_templates, text="Save New Template", command=save_c
 save_tpl_btn.grid(row=1, column=2, padx=4)
 
 # AI Buttons
+def replace_body(text):
+    txt_body.delete("1.0", tk.END)
+    txt_body.insert("1.0", text)
+
+def show_ai_error(e):
+    messagebox.showerror("AI error", str(e))
+
 def on_ai_autocomplete():
     body = txt_body.get("1.0", tk.END).strip()
     if not body:
         messagebox.showerror("Empty", "Message body empty. Start typing to auto-complete.")
         return
-    # run in thread
-    def work():
-        try:
-            txt = ai_autocomplete_action(body)
-            # insert as replacement or append
-            root.after(0, lambda: (txt_body.delete("1.0", tk.END), txt_body.insert("1.0", txt)))
-        except Exception as e:
-            root.after(0, lambda: messagebox.showerror("AI error", str(e)))
-    threading.Thread(target=work, daemon=True).start()
+    submit_job("AI auto-complete", ai_autocomplete_action, body, on_done=replace_body, on_error=show_ai_error)
 
 def on_ai_autoreply():
     subj = entry_subject.get().strip()
@@ -266,13 +321,7 @@ def on_ai_autoreply():
     if not orig:
         messagebox.showerror("Missing", "No message body to reply to.")
         return
-    def work():
-        try:
-            reply_text = ai_autoreply_action(subj, orig)
-            root.after(0, lambda: (txt_body.delete("1.0", tk.END), txt_body.insert("1.0", reply_text)))
-        except Exception as e:
-            root.after(0, lambda: messagebox.showerror("AI error", str(e)))
-    threading.Thread(target=work, daemon=True).start()
+    submit_job("AI auto-reply", ai_autoreply_action, subj, orig, on_done=replace_body, on_error=show_ai_error)
 
 ai_auto_complete_btn = tk.Button(frm_actions, text="AI Auto-Complete", command=on_ai_autocomplete)
 ai_auto_complete_btn.grid(row=0, column=0, padx=6)
@@ -340,13 +389,105 @@ btn_send_now.grid(row=2, column=1, padx=6, pady=6)
 btn_schedule = tk.Button(frm_actions, text="Schedule Send", command=on_schedule)
 btn_schedule.grid(row=2, column=2, padx=6, pady=6)
 
+# -------------------------
+# Status panel: in-flight and recent jobs
+# -------------------------
+KEEP_FINISHED_JOBS = 50
+frm_status = tk.Frame(root)
+frm_status.pack(padx=8, pady=6, fill="x")
+lbl_status = tk.Label(frm_status, text="No background jobs", anchor="w")
+lbl_status.pack(fill="x")
+tree_jobs = ttk.Treeview(frm_status, columns=("job", "state", "detail"), show="headings", height=6)
+for col, title, width in (("job", "Job", 260), ("state", "Status", 90), ("detail", "Detail", 320)):
+    tree_jobs.heading(col, text=title)
+    tree_jobs.column(col, width=width, anchor="w")
+tree_jobs.tag_configure("failed", foreground="red")
+tree_jobs.tag_configure("done", foreground="gray40")
+tree_jobs.pack(fill="x")
+
+jobs = {}  # job id -> {"label", "state", "on_done", "on_error"}; main thread only
+finished = []  # ids of finished jobs still listed, oldest first
+
+def update_status_label():
+    counts = {}
+    for job in jobs.values():
+        counts[job["state"]] = counts.get(job["state"], 0) + 1
+    if not counts:
+        lbl_status.config(text="No background jobs")
+        return
+    order = ("running", "queued", "scheduled", "done", "failed")
+    lbl_status.config(text=", ".join(f"{state}: {counts[state]}" for state in order if counts.get(state)))
+
+def add_job_row(label, state="queued", on_done=None, on_error=None):
+    job_id = next(_job_ids)
+    jobs[job_id] = {"label": label, "state": state.split()[0], "on_done": on_done, "on_error": on_error}
+    tree_jobs.insert("", 0, iid=str(job_id), values=(label, state, ""))
+    update_status_label()
+    return job_id
+
+def remove_job_row(job_id):
+    jobs.pop(job_id, None)
+    tree_jobs.delete(str(job_id))
+    update_status_label()
+
+def pending_jobs():
+    return sum(1 for job in jobs.values() if job["state"] in ("queued", "running"))
+
+def submit_job(label, fn, *args, on_done=None, on_error=None):
+    """Run ``fn(*args)`` on the worker pool; callbacks run on the Tk thread."""
+    if pending_jobs() >= MAX_PENDING_JOBS:
+        messagebox.showwarning("Busy", f"{MAX_PENDING_JOBS} jobs are already waiting; try again shortly.")
+        return None
+    job_id = add_job_row(label, on_done=on_done, on_error=on_error)
+    executor.submit(run_job, job_id, fn, args)
+    return job_id
+
+def apply_result(job_id, state, detail):
+    job = jobs.get(job_id)
+    if job is None:
+        return
+    job["state"] = state
+    text = "" if state == "running" or detail is None else str(detail)
+    if state == "done":
+        text = "" if job["on_done"] else (text or "ok")
+    tree_jobs.item(str(job_id), values=(job["label"], state, text.replace("\n", " ")[:200]), tags=(state,))
+    if state not in ("done", "failed"):
+        return
+    finished.append(job_id)
+    while len(finished) > KEEP_FINISHED_JOBS:
+        old = finished.pop(0)
+        jobs.pop(old, None)
+        tree_jobs.delete(str(old))
+    callback = job["on_done"] if state == "done" else job["on_error"]
+    if callback:
+        callback(detail)
+    elif state == "failed":
+        root.bell()
+
+def poll_results():
+    # Bounded per tick so a burst of results cannot stall the UI.
+    try:
+        for _ in range(100):
+            apply_result(*results.get_nowait())
+    except queue.Empty:
+        pass
+    update_status_label()
+    root.after(RESULT_POLL_MS, poll_results)
+
+root.after(RESULT_POLL_MS, poll_results)
+
 # Graceful shutdown
 def on_closing():
-    if messagebox.askokcancel("Quit", "Quit and stop scheduler?"):
+    busy = pending_jobs()
+    question = "Quit and stop scheduler?"
+    if busy:
+        question = f"{busy} send/AI job(s) still running or queued. Quit anyway?"
+    if messagebox.askokcancel("Quit", question):
         try:
             sched.shutdown(wait=False)
         except Exception:
             pass
+        executor.shutdown(wait=False, cancel_futures=True)
         root.destroy()
 root.protocol("WM_DELETE_WINDOW", on_closing)
 
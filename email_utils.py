@@ -1,18 +1,282 @@
 import os
+import atexit
+import hashlib
 import smtplib
+import threading
+import time
+from contextlib import contextmanager
 from email.message import EmailMessage
 from dotenv import load_dotenv
+from metrics import smtp_messages_total, smtp_phase_seconds, timed
 
 load_dotenv()
 
 SENDER_EMAIL = os.getenv("DEFAULT_SENDER_EMAIL", "").strip()
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 30))
+# Set SMTP_STARTTLS=0 only for plaintext relays such as a local test sink.
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0"
 
 # NEW — read Gmail App Password
 EMAIL_PASSWORD = os.getenv("EMAIL_APP_PASSWORD", "").strip()
 
-def send_email_smtp(to_address: str, subject: str, body_text: str, sender: str = None, password: str = None):
+# Connection pool limits (per worker process)
+SMTP_POOL_MAX_PER_KEY = int(os.getenv("SMTP_POOL_MAX_PER_KEY", 4))
+SMTP_POOL_MAX_IDLE = int(os.getenv("SMTP_POOL_MAX_IDLE", 16))
+SMTP_POOL_IDLE_TIMEOUT = float(os.getenv("SMTP_POOL_IDLE_TIMEOUT", 60))
+SMTP_POOL_NOOP_AFTER = float(os.getenv("SMTP_POOL_NOOP_AFTER", 2))
+SMTP_POOL_ACQUIRE_TIMEOUT = float(os.getenv("SMTP_POOL_ACQUIRE_TIMEOUT", 30))
+
+
+# -------------------------
+# SMTP connection pool
+# -------------------------
+def _fingerprint(password):
+    # Never keep the raw password next to the pooled session.
+    return hashlib.sha256((password or "").encode()).hexdigest()
+
+
+def _close_quietly(smtp):
+    try:
+        smtp.quit()
+    except Exception:
+        try:
+            smtp.close()
+        except Exception:
+            pass
+
+
+class _PooledConnection:
+    __slots__ = ("smtp", "fingerprint", "last_used")
+
+    def __init__(self, smtp, fingerprint):
+        self.smtp = smtp
+        self.fingerprint = fingerprint
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP sessions alive, keyed by (server, port, sender).
+
+    Idle sessions are health-checked with NOOP before reuse, dropped once
+    they sit idle longer than ``idle_timeout`` and capped both per key
+    (open sessions) and overall (idle sessions).
+    """
+
+    def __init__(self, max_per_key=SMTP_POOL_MAX_PER_KEY, max_idle=SMTP_POOL_MAX_IDLE,
+                 idle_timeout=SMTP_POOL_IDLE_TIMEOUT, noop_after=SMTP_POOL_NOOP_AFTER,
+                 acquire_timeout=SMTP_POOL_ACQUIRE_TIMEOUT, timeout=SMTP_TIMEOUT):
+        self.max_per_key = max_per_key
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.noop_after = noop_after
+        self.acquire_timeout = acquire_timeout
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._idle = {}   # key -> [_PooledConnection], most recently used last
+        self._open = {}   # key -> number of open sessions (idle + checked out)
+        self.stats = {"created": 0, "reused": 0, "evicted": 0, "broken": 0}
+
+    def _connect(self, server, port, sender, password, starttls):
+        with timed(smtp_phase_seconds, phase="connect"):
+            smtp = smtplib.SMTP(server, port, timeout=self.timeout)
+        try:
+            with timed(smtp_phase_seconds, phase="ehlo"):
+                smtp.ehlo()
+            if starttls:
+                with timed(smtp_phase_seconds, phase="starttls"):
+                    smtp.starttls()
+                    smtp.ehlo()
+            with timed(smtp_phase_seconds, phase="auth"):
+                smtp.login(sender, password)
+        except Exception:
+            _close_quietly(smtp)
+            raise
+        return smtp
+
+    def _idle_count(self):
+        return sum(len(conns) for conns in self._idle.values())
+
+    def _drop_locked(self, key, conn, doomed, stat):
+        doomed.append(conn)
+        self._open[key] -= 1
+        self.stats[stat] += 1
+        self._cond.notify_all()
+
+    def _reap_locked(self, now, doomed):
+        for key, conns in self._idle.items():
+            keep = []
+            for conn in conns:
+                if now - conn.last_used > self.idle_timeout:
+                    self._drop_locked(key, conn, doomed, "evicted")
+                else:
+                    keep.append(conn)
+            conns[:] = keep
+
+    def _checkout(self, key, fingerprint):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            doomed = []
+            conn = None
+            reserved = False
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    self._reap_locked(now, doomed)
+                    conns = self._idle.get(key, [])
+                    while conns:
+                        candidate = conns.pop()
+                        if candidate.fingerprint == fingerprint:
+                            conn = candidate
+                            break
+                        # Password changed since this session logged in.
+                        self._drop_locked(key, candidate, doomed, "evicted")
+                    if conn is not None:
+                        break
+                    if self._open.get(key, 0) < self.max_per_key:
+                        self._open[key] = self._open.get(key, 0) + 1
+                        reserved = True
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+            for stale in doomed:
+                _close_quietly(stale.smtp)
+
+            if conn is None and not reserved:
+                raise TimeoutError(f"No free SMTP connection for {key[2]}@{key[0]}:{key[1]}")
+            if reserved:
+                return None
+            if time.monotonic() - conn.last_used < self.noop_after:
+                self.stats["reused"] += 1
+                return conn
+            try:
+                with timed(smtp_phase_seconds, phase="noop"):
+                    ok = conn.smtp.noop()[0] == 250
+                if ok:
+                    self.stats["reused"] += 1
+                    return conn
+            except Exception:
+                pass
+            with self._cond:
+                self._drop_locked(key, conn, [], "broken")
+            _close_quietly(conn.smtp)
+
+    def _checkin(self, key, conn):
+        doomed = []
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._reap_locked(conn.last_used, doomed)
+            while self._idle_count() >= self.max_idle:
+                oldest_key = min(
+                    (k for k, conns in self._idle.items() if conns),
+                    key=lambda k: self._idle[k][0].last_used,
+                    default=None,
+                )
+                if oldest_key is None:
+                    break
+                self._drop_locked(oldest_key, self._idle[oldest_key].pop(0), doomed, "evicted")
+            if self.max_idle > 0:
+                self._idle.setdefault(key, []).append(conn)
+                self._cond.notify_all()
+            else:
+                self._drop_locked(key, conn, doomed, "evicted")
+        for stale in doomed:
+            _close_quietly(stale.smtp)
+
+    def _discard(self, key, conn):
+        with self._cond:
+            self._drop_locked(key, conn, [], "broken")
+        _close_quietly(conn.smtp)
+
+    @contextmanager
+    def connection(self, server, port, sender, password, starttls=True):
+        """Yield an authenticated ``smtplib.SMTP`` and return it to the pool afterwards."""
+        key = (server, port, sender)
+        fingerprint = _fingerprint(password)
+        conn = self._checkout(key, fingerprint)
+        if conn is None:
+            try:
+                conn = _PooledConnection(self._connect(server, port, sender, password, starttls), fingerprint)
+            except Exception:
+                with self._cond:
+                    self._open[key] -= 1
+                    self._cond.notify_all()
+                raise
+            self.stats["created"] += 1
+
+        try:
+            yield conn.smtp
+        except Exception:
+            # The session may still be usable (e.g. a refused recipient);
+            # reset it and keep it, otherwise drop it.
+            try:
+                conn.smtp.rset()
+            except Exception:
+                self._discard(key, conn)
+            else:
+                self._checkin(key, conn)
+            raise
+        else:
+            self._checkin(key, conn)
+
+    def close_all(self):
+        with self._cond:
+            doomed = [conn for conns in self._idle.values() for conn in conns]
+            for key, conns in self._idle.items():
+                self._open[key] -= len(conns)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in doomed:
+            _close_quietly(conn.smtp)
+
+
+smtp_pool = SMTPConnectionPool()
+atexit.register(smtp_pool.close_all)
+
+
+# -------------------------
+# Sending
+# -------------------------
+def deliver_message(msg, sender, password, server=None, port=None, starttls=None):
+    """Send a prepared ``EmailMessage`` over a pooled session.
+
+    A pooled session can die between the NOOP check and the send, so a
+    disconnect is retried once on a fresh connection.
+    """
+    server = server or SMTP_SERVER
+    port = port or SMTP_PORT
+    if starttls is None:
+        starttls = SMTP_STARTTLS
+    for attempt in range(2):
+        try:
+            with smtp_pool.connection(server, port, sender, password, starttls=starttls) as smtp:
+                with timed(smtp_phase_seconds, phase="data"):
+                    smtp.send_message(msg)
+            smtp_messages_total.labels(result="sent").inc()
+            return
+        except smtplib.SMTPServerDisconnected:
+            if attempt:
+                smtp_messages_total.labels(result="error").inc()
+                raise
+        except Exception:
+            smtp_messages_total.labels(result="error").inc()
+            raise
+
+
+def build_message(to_address, subject, body_text, sender):
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to_address
+    msg["Subject"] = subject
+    msg.set_content(body_text)
+    return msg
+
+
+def resolve_credentials(sender=None, password=None):
     sender = sender or SENDER_EMAIL
     if not sender:
         raise ValueError("No sender set in DEFAULT_SENDER_EMAIL")
@@ -21,15 +285,9 @@ def send_email_smtp(to_address: str, subject: str, body_text: str, sender: str =
     final_password = password or EMAIL_PASSWORD
     if not final_password:
         raise ValueError("Missing password. Please provide it or set EMAIL_APP_PASSWORD.")
+    return sender, final_password
 
-    msg = EmailMessage()
-    msg["From"] = sender
-    msg["To"] = to_address
-    msg["Subject"] = subject
-    msg.set_content(body_text)
 
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as smtp:
-        smtp.ehlo()
-        smtp.starttls()
-        smtp.login(sender, final_password)
-        smtp.send_message(msg)
\ No newline at end of file
+def send_email_smtp(to_address: str, subject: str, body_text: str, sender: str = None, password: str = None):
+    sender, final_password = resolve_credentials(sender, password)
+    deliver_message(build_message(to_address, subject, body_text, sender), sender, final_password)
@@ -7,8 +7,7 @@ cd "$(dirname "$0")"
 source .venv/bin/activate
 
 # Export environment variables
-export FLASK_APP=app.py
 export FLASK_ENV=development   # or production
 
-# Run Flask on a stable port
-flask run --host=127.0.0.1 --port=5000
\ No newline at end of file
+# Run Flask on a stable port; the factory migrates and seeds before serving
+flask --app "app:create_app()" run --host=127.0.0.1 --port=5000
\ No newline at end of file
@@ -1,7 +1,26 @@
 import os
+import shutil
+import tempfile
 
 port = os.getenv("PORT", "5000")
 bind = f"0.0.0.0:{port}"
 workers = 2
 threads = 4
 timeout = 120
+
+# Prometheus multi-process mode: each worker writes samples to this
+# directory and /metrics merges them. Must be set before workers import
+# prometheus_client.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "email-tool-metrics"))
+
+
+def on_starting(server):
+    # Stale files from a previous run would be merged into new scrapes.
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
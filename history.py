@@ -0,0 +1,133 @@
+import atexit
+import base64
+import os
+import queue
+import threading
+from datetime import datetime
+from sqlalchemy import insert, tuple_
+from models import db, gen_id, SearchDocument, SentEmail
+from search import sent_documents
+from thread_utils import once_per_process
+
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", 500))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", 1))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", 50000))
+HISTORY_PAGE_MAX = 200
+# Bodies are kept only for search; very long ones are cut here.
+HISTORY_BODY_MAX = int(os.getenv("HISTORY_BODY_MAX", 20000))
+
+_queue = queue.Queue(maxsize=HISTORY_QUEUE_SIZE)
+_flush_lock = threading.Lock()
+stats = {"recorded": 0, "written": 0, "dropped": 0, "flushes": 0}
+
+
+# -------------------------
+# Recording (batched, off the request thread)
+# -------------------------
+def record(user_id, to_addr, subject, status="sent", error=None, outbox_id=None, body=None):
+    """Queue one history row; the writer thread inserts rows in batches.
+
+    The body is not stored on the history row, only in the search index.
+    """
+    row = {
+        "id": gen_id(),
+        "user_id": user_id,
+        "outbox_id": outbox_id,
+        "to_addr": to_addr,
+        "subject": (subject or "")[:400],
+        "status": status,
+        "error": error,
+        "created_at": datetime.utcnow(),
+        "body": (body or "")[:HISTORY_BODY_MAX],
+    }
+    try:
+        _queue.put_nowait(row)
+        stats["recorded"] += 1
+    except queue.Full:
+        # History must never hold up a send.
+        stats["dropped"] += 1
+
+
+def _drain(first=None, limit=HISTORY_BATCH_SIZE):
+    rows = [first] if first is not None else []
+    while len(rows) < limit:
+        try:
+            rows.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return rows
+
+
+def flush(app, rows):
+    if not rows:
+        return
+    with _flush_lock, app.app_context():
+        try:
+            db.session.execute(insert(SentEmail), [{k: v for k, v in r.items() if k != "body"} for r in rows])
+            documents = sent_documents(rows)
+            if documents:
+                db.session.execute(insert(SearchDocument), documents)
+            db.session.commit()
+            stats["written"] += len(rows)
+            stats["flushes"] += 1
+        except Exception as e:
+            db.session.rollback()
+            stats["dropped"] += len(rows)
+            app.logger.warning("Could not write %d history rows: %s", len(rows), e)
+        finally:
+            db.session.remove()
+
+
+def _writer_loop(app):
+    while True:
+        try:
+            first = _queue.get(timeout=HISTORY_FLUSH_INTERVAL)
+        except queue.Empty:
+            continue
+        flush(app, _drain(first))
+
+
+@once_per_process
+def start_writer(app):
+    """Start the batch writer."""
+    threading.Thread(target=_writer_loop, args=(app,), name="history-writer", daemon=True).start()
+    atexit.register(lambda: flush(app, _drain(limit=HISTORY_QUEUE_SIZE)))
+
+
+# -------------------------
+# Keyset pagination
+# -------------------------
+def encode_cursor(row):
+    raw = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    return datetime.fromisoformat(created_at), row_id
+
+
+def page_for_user(user_id, cursor=None, limit=50):
+    """One page of a user's history, newest first, plus the cursor for the next page.
+
+    Seeks on the (user_id, created_at, id) index instead of using OFFSET, so
+    page N costs the same as page 1 however many rows the user has.
+    """
+    limit = max(1, min(int(limit), HISTORY_PAGE_MAX))
+    query = SentEmail.query.filter(SentEmail.user_id == user_id)
+    if cursor:
+        query = query.filter(tuple_(SentEmail.created_at, SentEmail.id) < decode_cursor(cursor))
+    rows = query.order_by(SentEmail.created_at.desc(), SentEmail.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def row_json(row):
+    return {
+        "id": row.id,
+        "to_addr": row.to_addr,
+        "subject": row.subject,
+        "status": row.status,
+        "error": row.error,
+        "created_at": row.created_at.isoformat() + "Z",
+    }
@@ -0,0 +1,137 @@
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Under gunicorn every worker writes its samples to files in this directory
+# (set in gunicorn_config.py before the workers import anything) and
+# /metrics merges them, so a scrape sees all workers, not just one.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "").strip()
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# Optional bearer token required by /metrics.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+smtp_phase_seconds = Histogram(
+    "smtp_phase_seconds", "Time spent in each phase of an SMTP session.",
+    ["phase"], buckets=LATENCY_BUCKETS,
+)
+smtp_messages_total = Counter("smtp_messages_total", "Messages handed to an SMTP server.", ["result"])
+smtp_rate_deferred_total = Counter(
+    "smtp_rate_deferred_total", "Messages put back on the queue by rate shaping.", ["bucket"],
+)
+
+ai_request_seconds = Histogram(
+    "ai_request_seconds", "Upstream AI call duration (streams: until the last token).",
+    ["operation", "mode"], buckets=LATENCY_BUCKETS,
+)
+ai_first_token_seconds = Histogram(
+    "ai_first_token_seconds", "Time to the first streamed token.",
+    ["operation"], buckets=LATENCY_BUCKETS,
+)
+ai_tokens = Histogram("ai_tokens", "Tokens per AI call.", ["operation", "kind"], buckets=TOKEN_BUCKETS)
+ai_input_chunks = Histogram(
+    "ai_input_chunks", "Chunks a long autoreply/rewrite input was split into (1: sent whole).",
+    ["operation"], buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24),
+)
+ai_requests_total = Counter(
+    "ai_requests_total", "AI calls by outcome (ok, error, cache_hit, rejected).", ["operation", "outcome"],
+)
+
+http_request_seconds = Histogram(
+    "http_request_seconds", "Request latency until the response is returned.",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+http_requests_total = Counter("http_requests_total", "Requests by route and status.", ["method", "route", "status"])
+http_db_queries = Histogram("http_db_queries", "SQL statements per request.", ["route"], buckets=QUERY_BUCKETS)
+http_db_seconds = Histogram("http_db_seconds", "Time in SQL per request.", ["route"], buckets=LATENCY_BUCKETS)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def observe_ai_usage(operation, usage):
+    if usage is None:
+        return
+    ai_tokens.labels(operation=operation, kind="prompt").observe(getattr(usage, "prompt_tokens", 0) or 0)
+    ai_tokens.labels(operation=operation, kind="completion").observe(getattr(usage, "completion_tokens", 0) or 0)
+
+
+# -------------------------
+# Flask wiring
+# -------------------------
+def _route(request):
+    # The URL rule, not the path, so ids do not explode label cardinality.
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def init_app(app):
+    """Time every request and count its SQL statements."""
+    if not METRICS_ENABLED:
+        return
+    from flask import g, has_request_context, request
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        # Background threads (outbox, history writer) have no request.
+        if has_request_context():
+            stats = g.get("_metrics_db")
+            if stats is not None:
+                stats[0] += 1
+                stats[1] += elapsed
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+        g._metrics_db = [0, 0.0]
+
+    @app.after_request
+    def _observe(response):
+        start = g.pop("_metrics_start", None)
+        if start is None:
+            return response
+        route = _route(request)
+        http_request_seconds.labels(method=request.method, route=route).observe(time.perf_counter() - start)
+        http_requests_total.labels(method=request.method, route=route, status=str(response.status_code)).inc()
+        queries, seconds = g.pop("_metrics_db", (0, 0.0))
+        http_db_queries.labels(route=route).observe(queries)
+        http_db_seconds.labels(route=route).observe(seconds)
+        return response
+
+
+def render_latest():
+    """Exposition text and content type for a scrape."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def start_http_server(port):
+    """Standalone exporter, for processes without a web server (outbox-worker)."""
+    from prometheus_client import start_http_server as _start
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        _start(port, registry=registry)
+    else:
+        _start(port)
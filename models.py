@@ -20,9 +20,153 @@ class User(db.Model, UserMixin):
 class Template(db.Model):
     __tablename__ = "template"
     id = db.Column(db.String, primary_key=True, default=gen_id)
-    title = db.Column(db.String(200), nullable=False)
+    title = db.Column(db.String(200), nullable=False, unique=True, index=True)
     subject = db.Column(db.String(400), nullable=True)
     body = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    email_enc_password = db.Column(db.Text, nullable=True)
\ No newline at end of file
+    email_enc_password = db.Column(db.Text, nullable=True)
+
+class OutboxMessage(db.Model):
+    __tablename__ = "outbox_message"
+    id = db.Column(db.String, primary_key=True, default=gen_id)
+    user_id = db.Column(db.String, db.ForeignKey("user.id"), nullable=True, index=True)
+    sender = db.Column(db.String(256), nullable=False)
+    to_addr = db.Column(db.String(320), nullable=False)
+    subject = db.Column(db.String(400), nullable=True)
+    body = db.Column(db.Text, nullable=True)
+    # queued -> sending -> sent | failed (sending falls back to queued on retry)
+    status = db.Column(db.String(16), nullable=False, default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lease_owner = db.Column(db.String(128), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_outbox_message_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+
+class ScheduledEmail(db.Model):
+    __tablename__ = "scheduled_email"
+    id = db.Column(db.String, primary_key=True, default=gen_id)
+    user_id = db.Column(db.String, db.ForeignKey("user.id"), nullable=True, index=True)
+    sender = db.Column(db.String(256), nullable=False)
+    to_addr = db.Column(db.String(320), nullable=False)
+    subject = db.Column(db.String(400), nullable=True)
+    body = db.Column(db.Text, nullable=True)
+    run_at = db.Column(db.DateTime, nullable=False)
+    # pending -> dispatched (handed to the outbox) | cancelled
+    status = db.Column(db.String(16), nullable=False, default="pending")
+    claimed_by = db.Column(db.String(128), nullable=True)
+    outbox_id = db.Column(db.String, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_scheduled_email_status_run_at", "status", "run_at"),
+    )
+
+
+class CacheVersion(db.Model):
+    """Version stamps that tell every worker when a cached table changed."""
+    __tablename__ = "cache_version"
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RateBucket(db.Model):
+    """Token buckets shared by every worker; see smtp_limits.py."""
+    __tablename__ = "rate_bucket"
+    name = db.Column(db.String(400), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # time.time() of the last refill
+
+
+class SentEmail(db.Model):
+    __tablename__ = "sent_email"
+    id = db.Column(db.String, primary_key=True, default=gen_id)
+    user_id = db.Column(db.String, db.ForeignKey("user.id"), nullable=True)
+    outbox_id = db.Column(db.String, nullable=True)
+    to_addr = db.Column(db.String(320), nullable=False)
+    subject = db.Column(db.String(400), nullable=True)
+    status = db.Column(db.String(16), nullable=False, default="sent")  # sent | failed
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Serves the keyset-paginated history: newest first per user.
+        db.Index("ix_sent_email_user_id_created_at", "user_id", "created_at", "id"),
+    )
+
+
+class SearchDocument(db.Model):
+    """Searchable copy of templates and sent mail.
+
+    The full-text index itself is dialect specific and lives only in the
+    migration: an FTS5 table kept in sync by triggers on SQLite, a generated
+    tsvector column with a GIN index on Postgres.
+    """
+    __tablename__ = "search_document"
+    # An INTEGER PRIMARY KEY is SQLite's rowid alias; the FTS5 index points
+    # at it (content_rowid), so VACUUM cannot renumber rows under the index.
+    seq = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.String, nullable=False, default=gen_id)
+    kind = db.Column(db.String(16), nullable=False)  # template | sent
+    ref_id = db.Column(db.String, nullable=False)
+    # "public" for templates, "u<user id>" for a user's sent mail; it is part
+    # of the text index so per-user filtering happens inside the index.
+    owner = db.Column(db.String(64), nullable=False)
+    title = db.Column(db.String(400), nullable=True)
+    subject = db.Column(db.String(400), nullable=True)
+    body = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint("id", name="uq_search_document_id"),
+        db.UniqueConstraint("kind", "ref_id", name="uq_search_document_kind_ref_id"),
+        db.Index("ix_search_document_owner", "owner"),
+    )
+
+
+class RecipientList(db.Model):
+    """An uploaded recipient list; the rows live in ``RecipientChunk``s."""
+    __tablename__ = "recipient_list"
+    id = db.Column(db.String, primary_key=True, default=gen_id)
+    user_id = db.Column(db.String, db.ForeignKey("user.id"), nullable=False, index=True)
+    name = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default="importing")  # importing | ready | failed
+    columns = db.Column(db.Text, nullable=False, default="[]")  # JSON list of merge-field names
+    total_rows = db.Column(db.Integer, nullable=False, default=0)
+    valid_rows = db.Column(db.Integer, nullable=False, default=0)
+    invalid_rows = db.Column(db.Integer, nullable=False, default=0)
+    duplicate_rows = db.Column(db.Integer, nullable=False, default=0)
+    chunk_count = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class RecipientChunk(db.Model):
+    """Up to RECIPIENT_CHUNK_ROWS rows as zlib-compressed JSON lines."""
+    __tablename__ = "recipient_chunk"
+    list_id = db.Column(db.String, db.ForeignKey("recipient_list.id", ondelete="CASCADE"), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    row_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class Suppression(db.Model):
+    """Addresses that must not be mailed again (bounced, unsubscribed, ...)."""
+    __tablename__ = "suppression"
+    # Increasing, so workers can load just the rows added since they last looked.
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(64), nullable=False)  # user id, or "*" for every sender
+    address = db.Column(db.String(320), nullable=False)  # normalized (lowercase)
+    reason = db.Column(db.String(32), nullable=False, default="manual")  # bounce | unsubscribe | complaint | manual
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint("scope", "address", name="uq_suppression_scope_address"),
+    )
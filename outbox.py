@@ -0,0 +1,294 @@
+import os
+import random
+import smtplib
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, update
+from models import db, User, OutboxMessage
+from ai_utils import decrypt_for_user
+from email_utils import build_message, send_email_smtp
+import history
+import smtp_engine
+import smtp_limits
+import suppression
+from thread_utils import once_per_process
+
+# Threads per web worker process; set to 0 when a dedicated
+# `flask outbox-worker` process does the sending.
+OUTBOX_WORKER_THREADS = int(os.getenv("OUTBOX_WORKER_THREADS", 2))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 10))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 2))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", 120))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", 30))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", 3600))
+# Claimed rows from one sender go out through smtp_engine sessions;
+# 0 sends them one by one over the pooled synchronous connection.
+OUTBOX_ASYNC_CONNECTIONS = int(os.getenv("OUTBOX_ASYNC_CONNECTIONS", 2))
+
+_wakeup = threading.Event()
+
+
+# -------------------------
+# Enqueue / status
+# -------------------------
+def enqueue_message(user_id, sender, to_addr, subject, body, commit=True, not_before=None):
+    msg = OutboxMessage(
+        user_id=user_id,
+        sender=sender,
+        to_addr=to_addr,
+        subject=subject or "",
+        body=body or "",
+        next_attempt_at=not_before or datetime.utcnow(),
+    )
+    db.session.add(msg)
+    if commit:
+        db.session.commit()
+        notify()
+    return msg
+
+
+def notify():
+    """Wake this process's sender threads after new rows are committed."""
+    _wakeup.set()
+
+
+def message_status(msg):
+    return {
+        "id": msg.id,
+        "to": msg.to_addr,
+        "status": msg.status,
+        "attempts": msg.attempts,
+        "last_error": msg.last_error,
+        "next_attempt_at": msg.next_attempt_at.isoformat() if msg.status == "queued" else None,
+        "created_at": msg.created_at.isoformat() if msg.created_at else None,
+        "sent_at": msg.sent_at.isoformat() if msg.sent_at else None,
+    }
+
+
+# -------------------------
+# Claiming (lease based)
+# -------------------------
+def _claimable(now):
+    return or_(
+        and_(OutboxMessage.status == "queued", OutboxMessage.next_attempt_at <= now),
+        # A worker died mid-send; its lease ran out, so the row is fair game again.
+        and_(OutboxMessage.status == "sending", OutboxMessage.lease_expires_at < now),
+    )
+
+
+def claim_batch(owner, limit=OUTBOX_BATCH_SIZE):
+    """Lease up to ``limit`` due messages for ``owner``.
+
+    Candidates are read first (``FOR UPDATE SKIP LOCKED`` on Postgres, a
+    no-op on SQLite), then leased with a conditional UPDATE that re-checks
+    the claim predicate, so two workers can never lease the same row.
+    """
+    now = datetime.utcnow()
+    ids = [
+        row.id
+        for row in db.session.query(OutboxMessage.id)
+        .filter(_claimable(now))
+        .order_by(OutboxMessage.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ]
+    if not ids:
+        db.session.rollback()
+        return []
+
+    db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(ids), _claimable(now))
+        .values(
+            status="sending",
+            lease_owner=owner,
+            lease_expires_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+            attempts=OutboxMessage.attempts + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return (
+        OutboxMessage.query
+        .filter(OutboxMessage.id.in_(ids), OutboxMessage.lease_owner == owner, OutboxMessage.status == "sending")
+        .all()
+    )
+
+
+# -------------------------
+# Delivery
+# -------------------------
+def _is_permanent(exc):
+    if isinstance(exc, (ValueError, smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return True
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code >= 500
+
+
+def backoff_delay(attempts):
+    delay = min(OUTBOX_BACKOFF_BASE * (2 ** max(attempts - 1, 0)), OUTBOX_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _finish(msg, owner, **values):
+    # Only the current lease holder may record the outcome.
+    db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id == msg.id, OutboxMessage.lease_owner == owner)
+        .values(lease_owner=None, lease_expires_at=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _password_for(user_id):
+    user = db.session.get(User, user_id) if user_id else None
+    if user and user.email_enc_password:
+        return decrypt_for_user(user.id, user.email_enc_password)
+    return None
+
+
+def _settle(msg, owner, error=None, permanent=False, bounced=False):
+    if bounced:
+        # The mailbox does not exist: never try it again from this account.
+        suppression.suppress(msg.user_id, [msg.to_addr], reason="bounce")
+    if error is None:
+        _finish(msg, owner, status="sent", last_error=None, sent_at=datetime.utcnow())
+        history.record(msg.user_id, msg.to_addr, msg.subject, status="sent", outbox_id=msg.id, body=msg.body)
+        return True
+    if permanent or msg.attempts >= OUTBOX_MAX_ATTEMPTS:
+        _finish(msg, owner, status="failed", last_error=error)
+        history.record(msg.user_id, msg.to_addr, msg.subject, status="failed", error=error, outbox_id=msg.id, body=msg.body)
+    else:
+        _finish(
+            msg, owner,
+            status="queued",
+            last_error=error,
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=backoff_delay(msg.attempts)),
+        )
+    return False
+
+
+def deliver(msg, owner):
+    try:
+        send_email_smtp(
+            to_address=msg.to_addr,
+            subject=msg.subject,
+            body_text=msg.body,
+            sender=msg.sender,
+            password=_password_for(msg.user_id),
+        )
+    except Exception as e:
+        bounced = isinstance(e, smtplib.SMTPRecipientsRefused) and all(
+            code >= 500 for code, _ in e.recipients.values()
+        )
+        return _settle(msg, owner, str(e), _is_permanent(e), bounced)
+    return _settle(msg, owner)
+
+
+def deliver_many(msgs, owner):
+    """Deliver messages that share a sender through one ``smtp_engine`` batch."""
+    first = msgs[0]
+    try:
+        batch = smtp_engine.DeliveryBatch(
+            first.sender,
+            _password_for(first.user_id),
+            connections=min(OUTBOX_ASYNC_CONNECTIONS, len(msgs)),
+        )
+    except Exception as e:
+        return sum(_settle(msg, owner, str(e), _is_permanent(e)) for msg in msgs)
+    by_id = {msg.id: msg for msg in msgs}
+    results, _ = batch.run(
+        (msg.id, build_message(msg.to_addr, msg.subject, msg.body, batch.sender)) for msg in msgs
+    )
+    return sum(_settle(by_id[r.key], owner, r.error, not r.retry, r.bounced) for r in results)
+
+
+def _defer(msgs, owner, delay):
+    """Put rate-limited rows back on the queue; this does not count as an attempt."""
+    db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_([msg.id for msg in msgs]), OutboxMessage.lease_owner == owner)
+        .values(
+            status="queued",
+            lease_owner=None,
+            lease_expires_at=None,
+            attempts=OutboxMessage.attempts - 1,
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=delay * random.uniform(1.0, 1.2)),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def process_once(owner, limit=OUTBOX_BATCH_SIZE):
+    batch = claim_batch(owner, limit=limit)
+    groups = {}
+    for msg in batch:
+        groups.setdefault((msg.user_id, msg.sender), []).append(msg)
+    for msgs in groups.values():
+        blocked = set(suppression.suppressed_indexes(msgs[0].user_id, [msg.to_addr for msg in msgs]))
+        for i in blocked:
+            _settle(msgs[i], owner, "Recipient is on the suppression list", permanent=True)
+        msgs = [msg for i, msg in enumerate(msgs) if i not in blocked]
+        if not msgs:
+            continue
+        admitted, deferred, retry_after = smtp_limits.shape(msgs[0].sender, [msg.to_addr for msg in msgs])
+        if deferred:
+            _defer([msgs[i] for i in deferred], owner, retry_after)
+        msgs = [msgs[i] for i in admitted]
+        if not msgs:
+            continue
+        if len(msgs) > 1 and OUTBOX_ASYNC_CONNECTIONS > 0:
+            deliver_many(msgs, owner)
+        else:
+            for msg in msgs:
+                deliver(msg, owner)
+    return len(batch)
+
+
+# -------------------------
+# Worker loop
+# -------------------------
+def _worker_loop(app, owner, stop):
+    while not stop.is_set():
+        processed = 0
+        try:
+            with app.app_context():
+                processed = process_once(owner)
+        except Exception as e:
+            app.logger.warning("Outbox worker %s failed: %s", owner, e)
+        finally:
+            with app.app_context():
+                db.session.remove()
+        if not processed:
+            _wakeup.wait(OUTBOX_POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def start_workers(app, threads=OUTBOX_WORKER_THREADS, daemon=True):
+    """Start sender threads once per process (safe to call on every request)."""
+    if threads <= 0:
+        return []
+    return _start_workers(app, threads, daemon) or []
+
+
+@once_per_process
+def _start_workers(app, threads, daemon):
+    stop = threading.Event()
+    workers = []
+    for i in range(threads):
+        owner = f"{socket.gethostname()}:{os.getpid()}:{i}:{uuid.uuid4().hex[:8]}"
+        t = threading.Thread(target=_worker_loop, args=(app, owner, stop), name=f"outbox-{i}", daemon=daemon)
+        t.start()
+        workers.append(t)
+    return workers
+
+
+def run_forever(app, threads=None):
+    workers = start_workers(app, threads=threads or max(OUTBOX_WORKER_THREADS, 1), daemon=False)
+    while any(t.is_alive() for t in workers):
+        time.sleep(1)
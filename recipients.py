@@ -0,0 +1,337 @@
+import csv
+import io
+import json
+import os
+import re
+import zlib
+from sqlalchemy import delete, insert, select, update
+from bloom import ScalableBloomFilter
+from models import db, RecipientChunk, RecipientList
+
+# Rows per stored chunk; an import holds at most one chunk in memory.
+RECIPIENT_CHUNK_ROWS = int(os.getenv("RECIPIENT_CHUNK_ROWS", 1000))
+# Duplicate detection: a Bloom filter that grows with the list (capped at
+# 2**28 bits = 32 MB) flags rows that may repeat an earlier address, and
+# each flagged row is then checked exactly against the rows already
+# stored, so a distinct address is never dropped. The error rate only
+# decides how many rows need that check (~17 bits per address at 0.001).
+RECIPIENT_BLOOM_MAX_BITS = int(os.getenv("RECIPIENT_BLOOM_MAX_BITS", 1 << 28))
+RECIPIENT_BLOOM_ERROR_RATE = float(os.getenv("RECIPIENT_BLOOM_ERROR_RATE", 0.001))
+# Rows the filter sizes for before it first grows, when the upload size is unknown.
+RECIPIENT_BLOOM_INITIAL_ROWS = int(os.getenv("RECIPIENT_BLOOM_INITIAL_ROWS", 100000))
+# Flagged rows held before they are checked against the stored chunks;
+# each check reads the list so far once.
+RECIPIENT_MAX_SUSPECTS = int(os.getenv("RECIPIENT_MAX_SUSPECTS", 100000))
+# Invalid rows reported back (all of them are counted).
+RECIPIENT_MAX_ERRORS = int(os.getenv("RECIPIENT_MAX_ERRORS", 100))
+
+# Typical row size, to guess the row count of an upload from its length.
+_AVG_ROW_BYTES = 32
+EMAIL_COLUMNS = ("email", "to", "email address", "e-mail", "address")
+EMAIL_RE = re.compile(
+    r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+    r"@(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63}"
+)
+
+
+class RecipientImportError(ValueError):
+    """The upload is not a usable recipient CSV; maps to HTTP 400."""
+
+
+def validate_address(value):
+    """``(address, None)`` for a syntactically valid address, else ``(None, reason)``."""
+    address = (value or "").strip()
+    if address.startswith("<") and address.endswith(">"):
+        address = address[1:-1].strip()
+    if not address:
+        return None, "Missing email address"
+    if len(address) > 254 or not EMAIL_RE.fullmatch(address):
+        return None, f"Invalid email address: {address[:80]}"
+    if len(address.rsplit("@", 1)[0]) > 64:
+        return None, "Local part longer than 64 characters"
+    return address, None
+
+
+def list_status(lst):
+    return {
+        "id": lst.id,
+        "name": lst.name,
+        "status": lst.status,
+        "columns": json.loads(lst.columns or "[]"),
+        "rows": lst.total_rows,
+        "valid": lst.valid_rows,
+        "invalid": lst.invalid_rows,
+        "duplicates": lst.duplicate_rows,
+        "chunks": lst.chunk_count,
+        "error": lst.error,
+        "created_at": lst.created_at.isoformat() + "Z",
+    }
+
+
+# -------------------------
+# Import
+# -------------------------
+def _text_stream(raw):
+    if isinstance(raw, io.RawIOBase):
+        raw = io.BufferedReader(raw)
+    return io.TextIOWrapper(raw, encoding="utf-8-sig", errors="replace", newline="")
+
+
+class MultipartUpload(io.RawIOBase):
+    """The ``file`` part of a multipart/form-data body, read straight off the wire.
+
+    ``request.files`` would spool the whole upload to a temp file first;
+    this hands the CSV parser each piece as it arrives. Call ``start()``
+    before reading: it collects the small fields sent ahead of the file
+    (``fields``) and returns False if there is no file part.
+    """
+
+    def __init__(self, stream, boundary, field="file", read_size=65536):
+        from werkzeug.sansio.multipart import MultipartDecoder
+        self._stream = stream
+        self._decoder = MultipartDecoder(boundary.encode("latin-1"))
+        self._field = field
+        self._read_size = read_size
+        self._part = None
+        self._pending = b""
+        self._eof = False
+        self.fields = {}
+        self.filename = None
+
+    def readable(self):
+        return True
+
+    def _next_data(self):
+        """Next bytes of the file part, or b"" once it has ended."""
+        from werkzeug.sansio.multipart import NEED_DATA, Data, Epilogue, Field, File
+        while not self._eof:
+            try:
+                event = self._decoder.next_event()
+            except ValueError:
+                raise RecipientImportError("Truncated multipart body") from None
+            if event is NEED_DATA:
+                chunk = self._stream.read(self._read_size)
+                if not chunk and self._decoder.complete:
+                    raise RecipientImportError("Truncated multipart body")
+                self._decoder.receive_data(chunk or None)
+            elif isinstance(event, (Field, File)):
+                if self._part is not None and isinstance(self._part, File) and self._part.name == self._field:
+                    self._eof = True  # the file is done; later fields are not needed
+                    return b""
+                self._part = event
+                if isinstance(event, File) and event.name == self._field:
+                    self.filename = event.filename
+                    return None
+            elif isinstance(event, Data):
+                if isinstance(self._part, File) and self._part.name == self._field:
+                    if event.data:
+                        return bytes(event.data)
+                elif isinstance(self._part, Field) and len(self.fields.get(self._part.name, "")) < 1000:
+                    value = self.fields.get(self._part.name, "") + event.data.decode("utf-8", "replace")
+                    self.fields[self._part.name] = value
+            elif isinstance(event, Epilogue):
+                self._eof = True
+        return b""
+
+    def start(self):
+        return self._next_data() is None
+
+    def readinto(self, buffer):
+        while not self._pending:
+            data = self._next_data()
+            if data == b"":
+                return 0
+            self._pending = data or b""
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def _header(row):
+    columns = [name.strip() for name in row]
+    lowered = [name.casefold() for name in columns]
+    for candidate in EMAIL_COLUMNS:
+        if candidate in lowered:
+            email_index = lowered.index(candidate)
+            break
+    else:
+        raise RecipientImportError("CSV header needs an email column (" + ", ".join(EMAIL_COLUMNS) + ")")
+    fields = [(i, name) for i, name in enumerate(columns) if i != email_index and name]
+    return email_index, fields
+
+
+def import_csv(user_id, name, stream, size_hint=None):
+    """Parse a CSV upload row by row and store it as a ``RecipientList``.
+
+    The first row is the header: one column holds the address, every other
+    named column becomes a merge field. Rows are validated and deduplicated
+    (case-insensitively) as they are read and written out in chunks, so
+    memory stays flat however large the file is. Rows the Bloom filter
+    flags are confirmed against the stored rows before being counted as
+    duplicates; the few false alarms are stored after the rows read since
+    the last check. Returns ``(recipient_list, errors)`` with up to
+    RECIPIENT_MAX_ERRORS invalid rows.
+    """
+    lst = RecipientList(user_id=user_id, name=(name or "Recipients")[:200])
+    db.session.add(lst)
+    db.session.commit()
+    list_id = lst.id
+
+    seen = ScalableBloomFilter(
+        max(RECIPIENT_BLOOM_INITIAL_ROWS, (size_hint or 0) // _AVG_ROW_BYTES),
+        RECIPIENT_BLOOM_ERROR_RATE,
+        max_bits=RECIPIENT_BLOOM_MAX_BITS,
+    )
+    counts = {"total_rows": 0, "valid_rows": 0, "invalid_rows": 0, "duplicate_rows": 0, "chunk_count": 0}
+    errors = []
+    buffer = []
+    suspects = {}  # lowercased address -> stored line, for rows the filter flagged
+
+    def flush():
+        if buffer:
+            data = zlib.compress("\n".join(buffer).encode("utf-8"), 6)
+            db.session.execute(
+                insert(RecipientChunk.__table__).values(
+                    list_id=list_id, seq=counts["chunk_count"], row_count=len(buffer), data=data,
+                )
+            )
+            counts["chunk_count"] += 1
+            buffer.clear()
+        db.session.execute(update(RecipientList).where(RecipientList.id == list_id).values(**counts))
+        db.session.commit()
+
+    def confirm():
+        # Flagged rows whose address is already stored are duplicates; the
+        # rest were false alarms and are kept.
+        flush()
+        if not suspects:
+            return
+        for address in _stored_addresses(list_id):
+            if suspects.pop(address, None) is not None:
+                counts["duplicate_rows"] += 1
+                if not suspects:
+                    break
+        for line in suspects.values():
+            counts["valid_rows"] += 1
+            buffer.append(line)
+            if len(buffer) >= RECIPIENT_CHUNK_ROWS:
+                flush()
+        suspects.clear()
+        flush()
+
+    try:
+        reader = csv.reader(_text_stream(stream))
+        header = next(reader, None)
+        if header is None:
+            raise RecipientImportError("Empty CSV")
+        email_index, fields = _header(header)
+        db.session.execute(
+            update(RecipientList)
+            .where(RecipientList.id == list_id)
+            .values(columns=json.dumps([name for _, name in fields]))
+        )
+        dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+        for row in reader:
+            if not any(row):
+                continue
+            counts["total_rows"] += 1
+            address, error = validate_address(row[email_index] if email_index < len(row) else "")
+            if error:
+                counts["invalid_rows"] += 1
+                if len(errors) < RECIPIENT_MAX_ERRORS:
+                    errors.append({"line": reader.line_num, "error": error})
+                continue
+            line = dumps([address] + [row[i].strip() if i < len(row) else "" for i, _ in fields])
+            key = address.lower()
+            if not seen.add(key.encode("utf-8")):
+                if key in suspects:
+                    counts["duplicate_rows"] += 1
+                else:
+                    suspects[key] = line
+                    if len(suspects) >= RECIPIENT_MAX_SUSPECTS:
+                        confirm()
+                continue
+            counts["valid_rows"] += 1
+            buffer.append(line)
+            if len(buffer) >= RECIPIENT_CHUNK_ROWS:
+                flush()
+        confirm()
+    except (RecipientImportError, csv.Error, UnicodeError) as e:
+        db.session.rollback()
+        _fail(list_id, counts, str(e))
+        raise RecipientImportError(str(e)) from e
+    except BaseException as e:
+        # Client disconnects and the like: keep the row so the failure is visible.
+        db.session.rollback()
+        _fail(list_id, counts, str(e) or type(e).__name__)
+        raise
+
+    db.session.execute(update(RecipientList).where(RecipientList.id == list_id).values(status="ready"))
+    db.session.commit()
+    return db.session.get(RecipientList, list_id), errors
+
+
+def _stored_addresses(list_id):
+    """Lowercased addresses of the rows stored so far, chunk by chunk."""
+    seqs = db.session.execute(
+        select(RecipientChunk.seq).where(RecipientChunk.list_id == list_id).order_by(RecipientChunk.seq)
+    ).scalars().all()
+    for seq in seqs:
+        data = db.session.execute(
+            select(RecipientChunk.data).where(RecipientChunk.list_id == list_id, RecipientChunk.seq == seq)
+        ).scalar()
+        for line in zlib.decompress(data).decode("utf-8").split("\n"):
+            yield json.loads(line)[0].lower()
+
+
+def _fail(list_id, counts, error):
+    db.session.execute(
+        update(RecipientList)
+        .where(RecipientList.id == list_id)
+        .values(status="failed", error=error[:1000], **counts)
+    )
+    db.session.commit()
+
+
+# -------------------------
+# Reading back
+# -------------------------
+def get_list(list_id, user_id):
+    return RecipientList.query.filter_by(id=str(list_id), user_id=user_id).first()
+
+
+def iter_rows(lst, offset=0):
+    """Yield ``{"to": address, <merge field>: value, ...}`` one chunk at a time."""
+    columns = json.loads(lst.columns or "[]")
+    start = 0
+    if offset:
+        # Skip whole chunks by their row counts instead of decoding them.
+        for seq, row_count in db.session.execute(
+            select(RecipientChunk.seq, RecipientChunk.row_count)
+            .where(RecipientChunk.list_id == lst.id)
+            .order_by(RecipientChunk.seq)
+        ):
+            if offset < row_count:
+                break
+            offset -= row_count
+            start = seq + 1
+    for seq in range(start, lst.chunk_count):
+        data = db.session.execute(
+            select(RecipientChunk.data).where(RecipientChunk.list_id == lst.id, RecipientChunk.seq == seq)
+        ).scalar()
+        if data is None:
+            continue
+        lines = zlib.decompress(data).decode("utf-8").split("\n")
+        for line in lines[offset:]:
+            values = json.loads(line)
+            row = dict(zip(columns, values[1:]))
+            row["to"] = values[0]
+            yield row
+        offset = 0
+
+
+def delete_list(lst):
+    db.session.execute(delete(RecipientChunk).where(RecipientChunk.list_id == lst.id))
+    db.session.execute(delete(RecipientList).where(RecipientList.id == lst.id))
+    db.session.commit()
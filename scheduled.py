@@ -0,0 +1,140 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from sqlalchemy import update
+from models import db, ScheduledEmail
+import outbox
+from thread_utils import once_per_process
+
+SCHEDULER_POLL_INTERVAL = float(os.getenv("SCHEDULER_POLL_INTERVAL", 5))
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", 200))
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") != "0"
+
+
+
+def parse_run_at(value):
+    """Parse an ISO-8601 timestamp into a naive UTC datetime (how the DB stores it)."""
+    run_at = datetime.fromisoformat(str(value).strip())
+    if run_at.tzinfo is not None:
+        run_at = run_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return run_at
+
+
+def schedule_message(user_id, sender, to_addr, subject, body, run_at):
+    job = ScheduledEmail(
+        user_id=user_id,
+        sender=sender,
+        to_addr=to_addr,
+        subject=subject or "",
+        body=body or "",
+        run_at=run_at,
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def cancel_scheduled(job_id, user_id):
+    result = db.session.execute(
+        update(ScheduledEmail)
+        .where(ScheduledEmail.id == job_id, ScheduledEmail.user_id == user_id, ScheduledEmail.status == "pending")
+        .values(status="cancelled")
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def job_status(job):
+    return {
+        "id": job.id,
+        "to": job.to_addr,
+        "subject": job.subject,
+        "run_at": job.run_at.isoformat() + "Z",
+        "status": job.status,
+        "outbox_id": job.outbox_id,
+    }
+
+
+# -------------------------
+# Poller
+# -------------------------
+def dispatch_due(owner, limit=SCHEDULER_BATCH_SIZE):
+    """Move one batch of due jobs into the outbox.
+
+    Only the ``(status, run_at)`` index range of due rows is read, never the
+    whole pending backlog. Claiming, enqueueing and marking happen in one
+    transaction, and the claim re-checks ``status == 'pending'``, so pollers
+    running in several gunicorn workers cannot dispatch the same job twice.
+    """
+    now = datetime.utcnow()
+    ids = [
+        row.id
+        for row in db.session.query(ScheduledEmail.id)
+        .filter(ScheduledEmail.status == "pending", ScheduledEmail.run_at <= now)
+        .order_by(ScheduledEmail.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ]
+    if not ids:
+        db.session.rollback()
+        return 0
+
+    try:
+        db.session.execute(
+            update(ScheduledEmail)
+            .where(ScheduledEmail.id.in_(ids), ScheduledEmail.status == "pending")
+            .values(status="dispatched", claimed_by=owner)
+            .execution_options(synchronize_session=False)
+        )
+        jobs = ScheduledEmail.query.filter(
+            ScheduledEmail.id.in_(ids), ScheduledEmail.claimed_by == owner, ScheduledEmail.status == "dispatched"
+        ).all()
+        msgs = [
+            outbox.enqueue_message(job.user_id, job.sender, job.to_addr, job.subject, job.body, commit=False)
+            for job in jobs
+        ]
+        db.session.flush()
+        for job, msg in zip(jobs, msgs):
+            job.outbox_id = msg.id
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if jobs:
+        outbox.notify()
+    return len(jobs)
+
+
+def _poller_loop(app, owner):
+    while True:
+        dispatched = 0
+        try:
+            with app.app_context():
+                dispatched = dispatch_due(owner)
+        except Exception as e:
+            app.logger.warning("Scheduler poller %s failed: %s", owner, e)
+        finally:
+            with app.app_context():
+                db.session.remove()
+        # A full batch means more are probably due; go again right away.
+        if dispatched < SCHEDULER_BATCH_SIZE:
+            time.sleep(SCHEDULER_POLL_INTERVAL)
+
+
+def start_poller(app, daemon=True):
+    """Start the due-job poller once per process (safe to call on every request)."""
+    if not SCHEDULER_ENABLED:
+        return None
+    return _start_poller(app, daemon)
+
+
+@once_per_process
+def _start_poller(app, daemon):
+    owner = f"{socket.gethostname()}:{os.getpid()}:sched:{uuid.uuid4().hex[:8]}"
+    t = threading.Thread(target=_poller_loop, args=(app, owner), name="scheduler", daemon=daemon)
+    t.start()
+    return t
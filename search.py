@@ -0,0 +1,172 @@
+import os
+import re
+from sqlalchemy import DateTime, bindparam, delete, func, insert, literal, or_, select, text
+from models import db, SearchDocument, Template
+
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 50))
+SEARCH_KINDS = ("template", "sent")
+SEARCH_MAX_TERMS = 8
+SNIPPET_WORDS = 16
+
+_TERM_RE = re.compile(r"\w+")
+
+# bm25 weights for (owner, title, subject, body); owner only filters.
+_SQLITE_SEARCH = """
+SELECT d.kind, d.ref_id, d.title, d.subject, d.created_at,
+       snippet(search_document_fts, 3, '[', ']', '...', :words) AS snippet
+FROM search_document_fts
+JOIN search_document d ON d.seq = search_document_fts.rowid
+WHERE search_document_fts MATCH :match
+ORDER BY bm25(search_document_fts, 0.0, 10.0, 5.0, 1.0)
+LIMIT :limit
+"""
+
+# Rank inside the GIN-filtered set first; ts_headline only runs on the page.
+_POSTGRES_SEARCH = """
+SELECT hit.kind, hit.ref_id, hit.title, hit.subject, hit.created_at,
+       ts_headline('simple', coalesce(hit.body, ''), hit.query,
+                   'StartSel=[, StopSel=], MaxWords=' || :words || ', MinWords=5') AS snippet
+FROM (
+    SELECT d.kind, d.ref_id, d.title, d.subject, d.body, d.created_at, q.query,
+           ts_rank_cd(d.search_vector, q.query) AS rank
+    FROM search_document d, to_tsquery('simple', :tsquery) AS q(query)
+    WHERE d.search_vector @@ q.query AND d.owner IN :owners
+    ORDER BY rank DESC, d.created_at DESC
+    LIMIT :limit
+) AS hit
+ORDER BY hit.rank DESC, hit.created_at DESC
+"""
+
+
+def owner_token(user_id):
+    """Owner value for a user's documents; a single FTS token (no dashes)."""
+    return "u" + str(user_id).replace("-", "")
+
+
+def _terms(q):
+    return [t.casefold() for t in _TERM_RE.findall(q or "")][:SEARCH_MAX_TERMS]
+
+
+def _owners(user_id, kinds):
+    owners = []
+    if "template" in kinds:
+        owners.append("public")
+    if "sent" in kinds and user_id is not None:
+        owners.append(owner_token(user_id))
+    return owners
+
+
+# -------------------------
+# Querying
+# -------------------------
+def search(q, user_id, kinds=SEARCH_KINDS, limit=20):
+    """Ranked prefix search over templates and the user's own sent mail.
+
+    Every term must match (as a word prefix) in the title, subject or body.
+    Templates are visible to everyone; sent mail only to its sender.
+    """
+    terms = _terms(q)
+    owners = _owners(user_id, kinds)
+    if not terms or not owners:
+        return []
+    limit = max(1, min(int(limit), SEARCH_MAX_RESULTS))
+
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        match = "owner : (%s) AND {title subject body} : (%s)" % (
+            " OR ".join(owners),
+            " AND ".join('"%s"*' % t for t in terms),
+        )
+        rows = db.session.execute(
+            text(_SQLITE_SEARCH).columns(created_at=DateTime), {"match": match, "words": SNIPPET_WORDS, "limit": limit}
+        ).mappings().all()
+    elif dialect == "postgresql":
+        stmt = text(_POSTGRES_SEARCH).bindparams(bindparam("owners", expanding=True)).columns(created_at=DateTime)
+        rows = db.session.execute(stmt, {
+            "tsquery": " & ".join("%s:*" % t for t in terms),
+            "owners": owners,
+            "words": SNIPPET_WORDS,
+            "limit": limit,
+        }).mappings().all()
+    else:
+        rows = _search_like(terms, owners, limit)
+    return [_hit_json(row) for row in rows]
+
+
+def _search_like(terms, owners, limit):
+    # Unindexed fallback for other databases: correct, newest first, slow.
+    query = select(
+        SearchDocument.kind, SearchDocument.ref_id, SearchDocument.title,
+        SearchDocument.subject, SearchDocument.created_at,
+        func.substr(SearchDocument.body, 1, 200).label("snippet"),
+    ).where(SearchDocument.owner.in_(owners))
+    for term in terms:
+        pattern = f"%{term}%"
+        query = query.where(or_(
+            SearchDocument.title.ilike(pattern),
+            SearchDocument.subject.ilike(pattern),
+            SearchDocument.body.ilike(pattern),
+        ))
+    query = query.order_by(SearchDocument.created_at.desc()).limit(limit)
+    return db.session.execute(query).mappings().all()
+
+
+def _hit_json(row):
+    return {
+        "kind": row["kind"],
+        "id": row["ref_id"],
+        "title": row["title"],
+        "subject": row["subject"],
+        "snippet": row["snippet"],
+        "created_at": row["created_at"].isoformat() + "Z",
+    }
+
+
+# -------------------------
+# Index maintenance
+# -------------------------
+def index_templates(titles):
+    """(Re)index the templates with these titles; caller commits.
+
+    Only rows of search_document are written; the FTS5 triggers or the
+    generated tsvector column keep the text index in step.
+    """
+    if not titles:
+        return
+    ids = select(Template.id).where(Template.title.in_(titles))
+    db.session.execute(
+        delete(SearchDocument)
+        .where(SearchDocument.kind == "template", SearchDocument.ref_id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(insert(SearchDocument).from_select(
+        ["id", "kind", "ref_id", "owner", "title", "subject", "body", "created_at"],
+        select(
+            literal("template:") + Template.id,
+            literal("template"),
+            Template.id,
+            literal("public"),
+            Template.title,
+            Template.subject,
+            Template.body,
+            func.coalesce(Template.created_at, func.current_timestamp()),
+        ).where(Template.title.in_(titles)),
+    ))
+
+
+def sent_documents(rows):
+    """Search rows for a batch of history rows (see history.flush)."""
+    return [
+        {
+            "id": "sent:" + row["id"],
+            "kind": "sent",
+            "ref_id": row["id"],
+            "owner": owner_token(row["user_id"]),
+            "title": row["to_addr"],
+            "subject": row["subject"],
+            "body": row.get("body"),
+            "created_at": row["created_at"],
+        }
+        for row in rows
+        if row["user_id"] is not None
+    ]
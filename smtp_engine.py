@@ -0,0 +1,319 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from email_utils import (
+    SMTP_POOL_IDLE_TIMEOUT, SMTP_POOL_MAX_IDLE, SMTP_POOL_NOOP_AFTER, SMTP_PORT, SMTP_SERVER,
+    SMTP_STARTTLS, SMTP_TIMEOUT, _fingerprint, resolve_credentials,
+)
+from metrics import smtp_messages_total, smtp_phase_seconds, timed
+
+# Concurrent authenticated sessions per batch. Providers cap these (Gmail
+# allows about 15 per account), so keep it modest.
+ASYNC_SMTP_CONNECTIONS = int(os.getenv("ASYNC_SMTP_CONNECTIONS", 4))
+# Most providers close a session after ~100 messages; reconnect before that.
+ASYNC_SMTP_MAX_PER_SESSION = int(os.getenv("ASYNC_SMTP_MAX_PER_SESSION", 100))
+# Messages buffered per session; ``submit`` blocks once the buffer is full.
+ASYNC_SMTP_QUEUE_PER_CONNECTION = int(os.getenv("ASYNC_SMTP_QUEUE_PER_CONNECTION", 4))
+
+# ``retry`` is True for failures worth trying again later (4xx replies,
+# dropped connections); permanent ones (5xx, bad credentials) are False.
+# ``bounced`` marks a permanent refusal of the recipient itself.
+DeliveryResult = namedtuple("DeliveryResult", "key ok error retry bounced")
+
+_CLOSE = object()
+
+
+# -------------------------
+# Event loop thread
+# -------------------------
+# One loop per process, shared by every batch; callers stay synchronous.
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop, _loop_pid
+    pid = os.getpid()
+    if _loop_pid != pid:
+        with _loop_lock:
+            if _loop_pid != pid:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="smtp-engine", daemon=True).start()
+                _loop, _loop_pid = loop, pid
+    return _loop
+
+
+def is_permanent(exc):
+    # aiosmtplib is imported lazily, like the other network SDKs.
+    import aiosmtplib
+    if isinstance(exc, ValueError):
+        return True
+    if isinstance(exc, aiosmtplib.SMTPRecipientsRefused):
+        return all(r.code >= 500 for r in exc.recipients)
+    return isinstance(exc, aiosmtplib.SMTPResponseException) and exc.code >= 500
+
+
+def _describe(exc):
+    recipients = getattr(exc, "recipients", None)
+    if recipients and all(hasattr(r, "code") for r in recipients):
+        return "; ".join(f"{r.code} {r.message}" for r in recipients)
+    return str(exc) or type(exc).__name__
+
+
+async def _close(smtp):
+    if smtp is None:
+        return
+    try:
+        await smtp.quit()
+    except Exception:
+        smtp.close()
+
+
+# -------------------------
+# Idle sessions
+# -------------------------
+# Sessions outlive their batch so back-to-back batches (the outbox claims
+# a few rows at a time) skip the handshake. Only touched on the loop thread.
+_idle = {}  # (server, port, sender, password fingerprint) -> [(smtp, sent, last_used)]
+
+
+async def _reap(now):
+    doomed = []
+    for key, conns in _idle.items():
+        doomed += [c for c in conns if now - c[2] > SMTP_POOL_IDLE_TIMEOUT]
+        conns[:] = [c for c in conns if now - c[2] <= SMTP_POOL_IDLE_TIMEOUT]
+    total = sorted((c for conns in _idle.values() for c in conns), key=lambda c: c[2])
+    for conn in total[:max(len(total) - SMTP_POOL_MAX_IDLE, 0)]:
+        doomed.append(conn)
+        for conns in _idle.values():
+            if conn in conns:
+                conns.remove(conn)
+    for smtp, _, _ in doomed:
+        await _close(smtp)
+
+
+async def _checkout(key):
+    now = time.monotonic()
+    await _reap(now)
+    conns = _idle.get(key, [])
+    while conns:
+        smtp, sent, last_used = conns.pop()
+        if now - last_used < SMTP_POOL_NOOP_AFTER:
+            return smtp, sent
+        try:
+            with timed(smtp_phase_seconds, phase="noop"):
+                await smtp.noop()
+            return smtp, sent
+        except Exception:
+            smtp.close()
+    return None, 0
+
+
+async def _checkin(key, smtp, sent):
+    if sent >= ASYNC_SMTP_MAX_PER_SESSION or not smtp.is_connected:
+        await _close(smtp)
+        return
+    _idle.setdefault(key, []).append((smtp, sent, time.monotonic()))
+    await _reap(time.monotonic())
+
+
+# -------------------------
+# Batches
+# -------------------------
+class DeliveryBatch:
+    """Send many messages from one sender over ``connections`` SMTP sessions.
+
+    Each session logs in once and sends message after message from a shared
+    queue, so a batch pays for the handshake ``connections`` times instead
+    of once per message. A session that drops mid-send is replaced and the
+    message tried once more; anything that still fails comes back as a
+    ``DeliveryResult`` with ``retry`` telling whether to queue it again.
+
+    Use from synchronous code::
+
+        batch = DeliveryBatch(sender, password)
+        for key, msg in messages:
+            batch.submit(key, msg)
+            handle(batch.completed())
+        handle(batch.finish())
+    """
+
+    def __init__(self, sender=None, password=None, server=None, port=None, starttls=None,
+                 connections=ASYNC_SMTP_CONNECTIONS):
+        self.sender, self._password = resolve_credentials(sender, password)
+        self.server = server or SMTP_SERVER
+        self.port = port or SMTP_PORT
+        self.starttls = SMTP_STARTTLS if starttls is None else starttls
+        self.connections = max(1, connections)
+        self.stats = {"sent": 0, "failed": 0, "retry": 0, "sessions": 0, "reused": 0}
+        self._key = (self.server, self.port, self.sender, _fingerprint(self._password))
+        self._fatal = None
+        # Keys submitted but not yet reported; every key gets exactly one result.
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._results = queue.Queue()
+        self._queue = asyncio.Queue(maxsize=self.connections * ASYNC_SMTP_QUEUE_PER_CONNECTION)
+        self._loop = _get_loop()
+        self._started = time.perf_counter()
+        self._elapsed = None
+        self._done = asyncio.run_coroutine_threadsafe(self._run(), self._loop)
+
+    # Called from the caller's thread.
+    def submit(self, key, msg):
+        """Queue ``msg``; blocks while every session already has a full buffer."""
+        with self._pending_lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+        asyncio.run_coroutine_threadsafe(self._queue.put((key, msg)), self._loop).result()
+
+    def completed(self):
+        """Results that are ready now, without waiting."""
+        out = []
+        while True:
+            try:
+                out.append(self._results.get_nowait())
+            except queue.Empty:
+                return out
+
+    def finish(self):
+        """Stop accepting messages and yield the remaining results as they land."""
+        for _ in range(self.connections):
+            asyncio.run_coroutine_threadsafe(self._queue.put(_CLOSE), self._loop).result()
+        while not self._done.done():
+            try:
+                yield self._results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        yield from self.completed()
+        # A session that died without reporting must not lose its message.
+        with self._pending_lock:
+            orphans = [key for key, count in self._pending.items() for _ in range(count)]
+            self._pending.clear()
+        for key in orphans:
+            self.stats["retry"] += 1
+            yield DeliveryResult(key, False, "Session ended before the message was sent", True, False)
+        self._done.result()
+        self._elapsed = time.perf_counter() - self._started
+
+    def run(self, messages):
+        """Submit every ``(key, msg)`` pair and wait; returns ``(results, summary)``."""
+        results = []
+        try:
+            for key, msg in messages:
+                self.submit(key, msg)
+                results.extend(self.completed())
+            results.extend(self.finish())
+        except BaseException:
+            self.cancel()
+            raise
+        return results, self.summary()
+
+    def cancel(self):
+        """Abandon the batch (the caller went away); open sessions are closed."""
+        self._done.cancel()
+
+    def summary(self):
+        elapsed = self._elapsed if self._elapsed is not None else time.perf_counter() - self._started
+        return {
+            **self.stats,
+            "elapsed": round(elapsed, 4),
+            "messages_per_second": round(self.stats["sent"] / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+    # Runs on the engine loop.
+    async def _run(self):
+        await asyncio.gather(*(self._session() for _ in range(self.connections)))
+
+    async def _connect(self):
+        import aiosmtplib
+        smtp = aiosmtplib.SMTP(hostname=self.server, port=self.port, timeout=SMTP_TIMEOUT, start_tls=False)
+        with timed(smtp_phase_seconds, phase="connect"):
+            await smtp.connect()
+        try:
+            with timed(smtp_phase_seconds, phase="ehlo"):
+                await smtp.ehlo()
+            if self.starttls:
+                with timed(smtp_phase_seconds, phase="starttls"):
+                    await smtp.starttls()
+            with timed(smtp_phase_seconds, phase="auth"):
+                await smtp.login(self.sender, self._password)
+        except BaseException:
+            smtp.close()
+            raise
+        self.stats["sessions"] += 1
+        return smtp
+
+    def _report(self, key, exc=None):
+        with self._pending_lock:
+            count = self._pending.get(key, 0)
+            if count == 0:
+                return  # already reported
+            if count == 1:
+                del self._pending[key]
+            else:
+                self._pending[key] = count - 1
+        if exc is None:
+            self.stats["sent"] += 1
+            smtp_messages_total.labels(result="sent").inc()
+            self._results.put(DeliveryResult(key, True, None, False, False))
+            return
+        import aiosmtplib
+        retry = not is_permanent(exc)
+        bounced = not retry and isinstance(exc, (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPRecipientRefused))
+        self.stats["retry" if retry else "failed"] += 1
+        smtp_messages_total.labels(result="error").inc()
+        self._results.put(DeliveryResult(key, False, _describe(exc), retry, bounced))
+
+    async def _session(self):
+        import aiosmtplib
+        dropped = (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPTimeoutError, ConnectionError)
+        smtp = None
+        sent = 0
+        try:
+            while True:
+                job = await self._queue.get()
+                if job is _CLOSE:
+                    if smtp is not None:
+                        smtp, idle = None, smtp
+                        await _checkin(self._key, idle, sent)
+                    return
+                key, msg = job
+                for attempt in range(2):
+                    if self._fatal is not None:
+                        # Could not log in; don't retry the handshake for every message.
+                        self._report(key, self._fatal)
+                        break
+                    try:
+                        if smtp is None or sent >= ASYNC_SMTP_MAX_PER_SESSION:
+                            await _close(smtp)
+                            smtp, sent = None, 0
+                            smtp, sent = await _checkout(self._key)
+                            if smtp is not None:
+                                self.stats["reused"] += 1
+                            else:
+                                try:
+                                    smtp = await self._connect()
+                                except Exception as e:
+                                    self._fatal = e
+                                    self._report(key, e)
+                                    break
+                        with timed(smtp_phase_seconds, phase="data"):
+                            await smtp.send_message(msg, sender=self.sender)
+                        sent += 1
+                        self._report(key)
+                        break
+                    except dropped as e:
+                        smtp.close()
+                        smtp = None
+                        if attempt:
+                            self._report(key, e)
+                    except Exception as e:
+                        # Refused message: aiosmtplib already reset the envelope.
+                        self._report(key, e)
+                        break
+        finally:
+            await _close(smtp)
+
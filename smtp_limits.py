@@ -0,0 +1,184 @@
+import json
+import os
+import time
+from collections import namedtuple
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from email_utils import SMTP_SERVER
+from metrics import smtp_rate_deferred_total
+from models import db, RateBucket
+
+SMTP_RATE_LIMITS_ENABLED = os.getenv("SMTP_RATE_LIMITS_ENABLED", "1") != "0"
+# Built-in limits for the usual SMTP_SERVER targets, kept under what the
+# providers publish (Gmail: ~500/day per account, Outlook: 30/minute).
+# Scopes: "account" (one sender on that server), "provider" (all senders
+# of this app on that server) and "domain" (per recipient domain, per
+# server). Each takes "<scope>_per_minute" with "<scope>_burst", and/or
+# "<scope>_per_day". A missing entry means no limit for that scope.
+PROVIDER_LIMITS = {
+    "smtp.gmail.com": {
+        "account_per_minute": 20, "account_burst": 10, "account_per_day": 450,
+        "provider_per_minute": 300, "provider_burst": 60,
+    },
+    "smtp.office365.com": {
+        "account_per_minute": 30, "account_burst": 10, "account_per_day": 9000,
+        "provider_per_minute": 300, "provider_burst": 60,
+    },
+    "smtp-mail.outlook.com": {
+        "account_per_minute": 30, "account_burst": 10, "account_per_day": 280,
+        "provider_per_minute": 300, "provider_burst": 60,
+    },
+}
+# Overrides and other servers, merged over the built-ins, e.g.
+# SMTP_RATE_LIMITS='{"smtp.gmail.com": {"account_per_day": 1900}, "default": {"account_per_minute": 60}}'
+# "default" applies to servers with no entry of their own.
+SMTP_RATE_LIMITS = json.loads(os.getenv("SMTP_RATE_LIMITS", "{}") or "{}")
+# Deferred messages wait at least this long before they are tried again.
+SMTP_RATE_MIN_DEFER = float(os.getenv("SMTP_RATE_MIN_DEFER", 1))
+
+Bucket = namedtuple("Bucket", "name scope rate capacity")  # rate in tokens/second
+
+
+# -------------------------
+# Configuration
+# -------------------------
+def limits_for(server=None):
+    server = (server or SMTP_SERVER).lower()
+    limits = dict(PROVIDER_LIMITS.get(server, {}))
+    override = SMTP_RATE_LIMITS.get(server)
+    if override is None and not limits:
+        override = SMTP_RATE_LIMITS.get("default")
+    limits.update(override or {})
+    return limits
+
+
+def _scope_buckets(limits, scope, name):
+    out = []
+    per_minute = limits.get(f"{scope}_per_minute")
+    if per_minute:
+        burst = limits.get(f"{scope}_burst") or max(1, per_minute // 4)
+        out.append(Bucket(f"{name}:min", scope, per_minute / 60.0, float(burst)))
+    per_day = limits.get(f"{scope}_per_day")
+    if per_day:
+        out.append(Bucket(f"{name}:day", scope, per_day / 86400.0, float(per_day)))
+    return out
+
+
+def buckets_for(sender, domain=None, server=None):
+    """The buckets one message from ``sender`` to ``domain`` has to pass."""
+    if not SMTP_RATE_LIMITS_ENABLED:
+        return []
+    server = (server or SMTP_SERVER).lower()
+    limits = limits_for(server)
+    buckets = _scope_buckets(limits, "account", f"account:{server}:{sender.lower()}")
+    buckets += _scope_buckets(limits, "provider", f"provider:{server}")
+    if domain:
+        buckets += _scope_buckets(limits, "domain", f"domain:{server}:{domain.lower()}")
+    return buckets
+
+
+def recipient_domain(address):
+    return address.rsplit("@", 1)[-1].strip().strip(">").lower()
+
+
+# -------------------------
+# Shared token buckets
+# -------------------------
+def _ensure(buckets, now):
+    table = RateBucket.__table__
+    with db.engine.connect() as conn:
+        have = set(conn.scalars(select(table.c.name).where(table.c.name.in_([b.name for b in buckets]))))
+    for bucket in buckets:
+        if bucket.name in have:
+            continue
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.insert().values(name=bucket.name, tokens=bucket.capacity, updated_at=now))
+        except IntegrityError:
+            pass  # another worker created it first
+
+
+def acquire(buckets, want):
+    """Take up to ``want`` tokens from all of ``buckets`` at once.
+
+    Returns ``(granted, retry_after)``: the same number is taken from every
+    bucket, and ``retry_after`` is how long until the tightest bucket has a
+    token again (0 when everything was granted). The rows are locked in
+    name order inside one transaction, so workers never oversubscribe and
+    never deadlock.
+    """
+    if not buckets or want <= 0:
+        return want, 0.0
+    table = RateBucket.__table__
+    buckets = sorted(buckets, key=lambda b: b.name)
+    now = time.time()
+    _ensure(buckets, now)
+    available = {}
+    with db.engine.begin() as conn:
+        for bucket in buckets:
+            # A no-op write takes the row lock (SQLite: the write lock) first.
+            conn.execute(update(table).where(table.c.name == bucket.name).values(updated_at=table.c.updated_at))
+        rows = conn.execute(
+            select(table.c.name, table.c.tokens, table.c.updated_at).where(table.c.name.in_([b.name for b in buckets]))
+        )
+        state = {row.name: row for row in rows}
+        for bucket in buckets:
+            row = state[bucket.name]
+            available[bucket] = min(bucket.capacity, row.tokens + max(now - row.updated_at, 0.0) * bucket.rate)
+        granted = min(want, *(int(tokens) for tokens in available.values()))
+        for bucket in buckets:
+            conn.execute(
+                update(table)
+                .where(table.c.name == bucket.name)
+                .values(tokens=available[bucket] - granted, updated_at=now)
+            )
+    if granted == want:
+        return granted, 0.0
+    waits = {b: (1 - (available[b] - granted)) / b.rate for b in buckets if available[b] - granted < 1}
+    tightest = max(waits, key=waits.get)
+    smtp_rate_deferred_total.labels(bucket=tightest.scope).inc(want - granted)
+    return granted, max(waits[tightest], SMTP_RATE_MIN_DEFER)
+
+
+def shape(sender, to_addrs, server=None):
+    """Split recipients into those that may be sent now and those that must wait.
+
+    Recipients are grouped by domain and each group takes its tokens in
+    one step, so a batch lines up with the account, provider and domain
+    limits. Returns ``(admitted, deferred, retry_after)`` where the first
+    two are lists of indexes into ``to_addrs`` (admitted ones grouped by
+    domain).
+    """
+    if not SMTP_RATE_LIMITS_ENABLED or not limits_for(server):
+        return list(range(len(to_addrs))), [], 0.0
+    groups = {}
+    for index, to in enumerate(to_addrs):
+        groups.setdefault(recipient_domain(to), []).append(index)
+    admitted, deferred, retry_after = [], [], 0.0
+    for domain, indexes in groups.items():
+        granted, wait = acquire(buckets_for(sender, domain, server), len(indexes))
+        admitted += indexes[:granted]
+        deferred += indexes[granted:]
+        retry_after = max(retry_after, wait)
+    return admitted, deferred, retry_after
+
+
+def stats(sender, server=None):
+    """Tokens left in ``sender``'s account and provider buckets, without taking any."""
+    buckets = buckets_for(sender, server=server)
+    table = RateBucket.__table__
+    now = time.time()
+    with db.engine.connect() as conn:
+        rows = {
+            row.name: row
+            for row in conn.execute(select(table).where(table.c.name.in_([b.name for b in buckets])))
+        }
+    out = {}
+    for bucket in buckets:
+        row = rows.get(bucket.name)
+        tokens = bucket.capacity if row is None else min(
+            bucket.capacity, row.tokens + max(now - row.updated_at, 0.0) * bucket.rate
+        )
+        out[bucket.name] = {"tokens": round(tokens, 2), "capacity": bucket.capacity,
+                            "per_minute": round(bucket.rate * 60, 4)}
+    return {"enabled": SMTP_RATE_LIMITS_ENABLED, "server": (server or SMTP_SERVER).lower(), "buckets": out}
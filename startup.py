@@ -0,0 +1,298 @@
+import glob
+import importlib.abc
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Imported first by app.py, so this is (close to) the start of the worker.
+_T0 = time.perf_counter()
+
+# Run pending migrations and the first-boot template seed when a process
+# prepares the app. Deployments that run `flask --app app init-db` as a
+# release step can set STARTUP_MIGRATE=0 so workers skip even the check.
+STARTUP_MIGRATE = os.getenv("STARTUP_MIGRATE", "1") != "0"
+# Per-package import times in the startup report (adds a little overhead).
+STARTUP_PROFILE_IMPORTS = os.getenv("STARTUP_PROFILE_IMPORTS", "0") != "0"
+STARTUP_IMPORT_TOP = 20
+
+# Any fixed 64-bit number; every process of this app must use the same one.
+MIGRATION_LOCK_KEY = 0x454D41494C544F4F
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+_REVISION_RE = re.compile(r"^revision\s*=\s*['\"](\w+)['\"]", re.M)
+_DOWN_REVISION_RE = re.compile(r"^down_revision\s*=\s*(.+)$", re.M)
+
+_state = {"last_mark": _T0, "prepared": False, "first_request": None}
+_prepare_lock = threading.Lock()
+_report = {
+    "pid": os.getpid(),
+    "phases": {},
+    "migrated": None,
+    "seeded": None,
+    "ready_seconds": None,
+    "first_request_seconds": None,
+    "imports": None,
+}
+
+
+# -------------------------
+# Timing
+# -------------------------
+def mark(phase):
+    """Record the time since the previous mark under ``phase``."""
+    now = time.perf_counter()
+    _report["phases"][phase] = round(now - _state["last_mark"], 4)
+    _state["last_mark"] = now
+
+
+def report():
+    out = dict(_report)
+    out["phases"] = dict(_report["phases"])
+    if _import_timer is not None:
+        out["imports"] = _import_timer.summary()
+    return out
+
+
+class _TimedLoader:
+    __slots__ = ("_loader", "_name", "_timer")
+
+    def __init__(self, loader, name, timer):
+        self._loader = loader
+        self._name = name
+        self._timer = timer
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._timer.enter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.leave(self._name)
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """Self time of each module's import, like ``python -X importtime``."""
+
+    def __init__(self):
+        self.self_time = {}
+        self._local = threading.local()
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, name, self)
+                return spec
+        return None
+
+    def enter(self):
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append([time.perf_counter(), 0.0])
+
+    def leave(self, name):
+        start, children = self._local.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.self_time[name] = elapsed - children
+        if self._local.stack:
+            self._local.stack[-1][1] += elapsed
+
+    def summary(self):
+        packages = {}
+        for name, seconds in list(self.self_time.items()):
+            top = name.split(".", 1)[0]
+            packages[top] = packages.get(top, 0.0) + seconds
+        ranked = sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:STARTUP_IMPORT_TOP]
+        return {
+            "total_seconds": round(sum(packages.values()), 4),
+            "by_package": {name: round(seconds, 4) for name, seconds in ranked},
+        }
+
+
+_import_timer = None
+if STARTUP_PROFILE_IMPORTS:
+    _import_timer = _ImportTimer()
+    sys.meta_path.insert(0, _import_timer)
+
+
+# -------------------------
+# Flask-Migrate, on demand
+# -------------------------
+def ensure_migrate(app, db):
+    """Attach Flask-Migrate; it imports Alembic, so only when actually needed."""
+    if "migrate" not in app.extensions:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+
+def register_migrate_commands(app, db):
+    """``flask db ...`` without importing Alembic in every web worker.
+
+    Mirrors the options of ``flask_migrate.cli.db``; the subcommands are
+    Flask-Migrate's own, loaded when the group is used.
+    """
+    import click
+    from flask import g
+    from flask.cli import with_appcontext
+
+    class LazyMigrateGroup(click.Group):
+        def _target(self):
+            ensure_migrate(app, db)
+            from flask_migrate.cli import db as db_group
+            return db_group
+
+        def list_commands(self, ctx):
+            return self._target().list_commands(ctx)
+
+        def get_command(self, ctx, name):
+            return self._target().get_command(ctx, name)
+
+    @app.cli.group("db", cls=LazyMigrateGroup)
+    @click.option("-d", "--directory", default=None,
+                  help='Migration script directory (default is "migrations")')
+    @click.option("-x", "--x-arg", multiple=True,
+                  help="Additional arguments consumed by custom env.py scripts")
+    @with_appcontext
+    def db_commands(directory, x_arg):
+        """Perform database migrations."""
+        g.directory = directory
+        g.x_arg = x_arg
+
+
+# -------------------------
+# Migrations, once per deployment
+# -------------------------
+def _script_heads(directory=MIGRATIONS_DIR):
+    """Head revisions read straight from the migration files (no Alembic import)."""
+    revisions, parents = set(), set()
+    for path in glob.glob(os.path.join(directory, "versions", "*.py")):
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        rev = _REVISION_RE.search(source)
+        down = _DOWN_REVISION_RE.search(source)
+        if rev:
+            revisions.add(rev.group(1))
+        if down:
+            parents.update(re.findall(r"['\"](\w+)['\"]", down.group(1)))
+    return revisions - parents
+
+
+def _current_revisions(db):
+    from sqlalchemy import inspect, text
+    with db.engine.connect() as conn:
+        if not inspect(conn).has_table("alembic_version"):
+            return set()
+        return {row[0] for row in conn.execute(text("SELECT version_num FROM alembic_version"))}
+
+
+@contextmanager
+def migration_lock(app, db):
+    """Serialize startup work across processes.
+
+    Postgres: a session-level advisory lock, so it also covers machines.
+    Elsewhere (SQLite): an flock on a file in the instance folder, where
+    Flask-SQLAlchemy also keeps relative SQLite databases.
+    """
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy import text
+        with db.engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                conn.commit()
+        return
+    try:
+        import fcntl
+    except ImportError:  # Windows: single-process dev server
+        yield
+        return
+    os.makedirs(app.instance_path, exist_ok=True)
+    path = os.path.join(app.instance_path, "startup.lock")
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def migrate_and_seed(app, db):
+    """Upgrade to head and seed templates if needed, under ``migration_lock``.
+
+    Only the first process to get the lock does any work; the rest find
+    the schema at head and the templates present. Returns
+    ``(migrated, seeded)``.
+    """
+    from template_seed import seed_templates_if_empty
+    with app.app_context(), migration_lock(app, db):
+        migrated = False
+        if _current_revisions(db) != _script_heads():
+            ensure_migrate(app, db)
+            from flask_migrate import upgrade
+            upgrade()
+            migrated = True
+        try:
+            seeded = seed_templates_if_empty()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+    return migrated, seeded
+
+
+def prepare(app, db, migrate=None):
+    """Once per process: migrate/seed (unless disabled) and record the time."""
+    if _state["prepared"]:
+        return
+    with _prepare_lock:
+        if _state["prepared"]:
+            return
+        _state["last_mark"] = time.perf_counter()
+        if STARTUP_MIGRATE if migrate is None else migrate:
+            try:
+                _report["migrated"], _report["seeded"] = migrate_and_seed(app, db)
+                if _report["migrated"]:
+                    print("Database upgraded successfully.")
+                if _report["seeded"]:
+                    print(f"Seeded {_report['seeded']} templates from templates.json.")
+            except Exception as e:
+                print(f"Startup migration/seed failed: {e}")
+        mark("prepare")
+        _report["ready_seconds"] = round(time.perf_counter() - _T0, 4)
+        # If this ran in a gunicorn master (--preload), forked workers
+        # must not inherit the connections it opened.
+        with app.app_context():
+            db.engine.dispose()
+        _state["prepared"] = True
+
+
+def on_request(app, db):
+    """before_request hook: prepare if nobody did, and time the first request."""
+    if _state["first_request"] is not None:
+        return
+    if not _state["prepared"]:
+        # On a thread of its own, outside the request context: the template
+        # seed refuses to run inside a request.
+        worker = threading.Thread(target=prepare, args=(app, db), name="startup-prepare")
+        worker.start()
+        worker.join()
+    with _prepare_lock:
+        if _state["first_request"] is not None:
+            return
+        _state["first_request"] = time.perf_counter()
+        _report["first_request_seconds"] = round(_state["first_request"] - _T0, 4)
+    print("Startup report: " + json.dumps(report(), sort_keys=True))
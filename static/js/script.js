@@ -51,35 +51,67 @@ document.addEventListener('DOMContentLoaded', () => {
             btn.disabled = true;
         }
 
+        // Render into the suggestion box or straight into the field as tokens arrive.
+        const box = document.getElementById("aiSuggestionBox");
+        const content = document.getElementById("aiSuggestionText");
+        const render = (value) => {
+            if (updateSuggestion) {
+                if (box && content) {
+                    box.style.display = "block";
+                    content.innerText = value;
+                }
+            } else {
+                textField.value = value;
+            }
+        };
+
         try {
-            const res = await fetch(route, {
+            const res = await fetch(route + "/stream", {
                 method: "POST",
-                headers: { "Content-Type": "application/json" },
+                headers: { "Content-Type": "application/json", "Accept": "text/event-stream" },
                 body: JSON.stringify({ text })
             });
 
-            const j = await res.json();
-
-            if (!j.ok) {
+            if (!res.ok || !res.body) {
+                const j = await res.json().catch(() => ({}));
                 throw new Error(j.error || "AI error");
             }
 
-            // Accept any field returned by backend
-            let result = j.text || j.reply || j.rewritten || j.fixed;
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            let result = "";
 
-            if (!result) {
-                result = "Error: No response from AI.";
-            }
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
 
-            if (updateSuggestion) {
-                const box = document.getElementById("aiSuggestionBox");
-                const content = document.getElementById("aiSuggestionText");
-                if (box && content) {
-                    box.style.display = "block";
-                    content.innerText = result;
+                // SSE events are separated by a blank line.
+                let sep;
+                while ((sep = buffer.indexOf("\n\n")) !== -1) {
+                    const raw = buffer.slice(0, sep);
+                    buffer = buffer.slice(sep + 2);
+                    let event = "message";
+                    let data = "";
+                    for (const line of raw.split("\n")) {
+                        if (line.startsWith("event: ")) event = line.slice(7);
+                        else if (line.startsWith("data: ")) data += line.slice(6);
+                    }
+                    if (!data) continue;
+                    const payload = JSON.parse(data);
+                    if (event === "error") throw new Error(payload.error || "AI error");
+                    if (event === "done") {
+                        result = payload.text;
+                    } else {
+                        result += payload.delta;
+                    }
+                    render(result);
                 }
-            } else {
-                textField.value = result;
+            }
+
+            if (!result) {
+                render("Error: No response from AI.");
             }
         } catch (err) {
             showMessage(err.message, "error");
@@ -173,7 +205,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
                 const j = await res.json();
                 if (j.ok) {
-                    showMessage("Email sent successfully!", "success");
+                    showMessage("Email queued for delivery.", "success");
+                    pollSendStatus(j.id);
                 } else {
                     throw new Error(j.error);
                 }
@@ -185,4 +218,104 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         };
     }
+
+    /* -----------------------------
+       SCHEDULE EMAIL
+    ------------------------------ */
+    const scheduleBtn = document.getElementById("scheduleBtn");
+    if (scheduleBtn) {
+        scheduleBtn.onclick = async () => {
+            const to = document.getElementById("to").value;
+            const subject = document.getElementById("subject").value;
+            const body = document.getElementById("body").value;
+            const when = document.getElementById("scheduleAt").value;
+
+            if (!to || !subject || !body || !when) {
+                return showMessage("Please fill in To, Subject, Body and a send time.", "warning");
+            }
+
+            scheduleBtn.disabled = true;
+            try {
+                const res = await fetch("/schedule", {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    // datetime-local is in the browser's timezone; send UTC.
+                    body: JSON.stringify({ to, subject, body, run_at: new Date(when).toISOString() })
+                });
+
+                const j = await res.json();
+                if (!j.ok) throw new Error(j.error);
+                showMessage("Email scheduled for " + new Date(j.run_at).toLocaleString(), "success");
+            } catch (err) {
+                showMessage(err.message, "error");
+            } finally {
+                scheduleBtn.disabled = false;
+            }
+        };
+    }
+
+    /* -----------------------------
+       Poll queued send until it settles
+    ------------------------------ */
+    async function pollSendStatus(id, attempt = 0) {
+        if (!id || attempt > 60) return;
+        try {
+            const res = await fetch("/send/" + id);
+            const j = await res.json();
+            if (j.status === "sent") return showMessage("Email sent to " + j.to, "success");
+            if (j.status === "failed") return showMessage("Sending to " + j.to + " failed: " + j.last_error, "error");
+        } catch (err) {
+            // transient network error; keep polling
+        }
+        setTimeout(() => pollSendStatus(id, attempt + 1), Math.min(1000 * (attempt + 1), 10000));
+    }
+
+    /* -----------------------------
+       HISTORY (keyset pages)
+    ------------------------------ */
+    const historyRows = document.getElementById("historyRows");
+    if (historyRows) {
+        const moreBtn = document.getElementById("historyMore");
+        let cursor = null;
+
+        const loadHistory = async () => {
+            const url = "/api/history?limit=50" + (cursor ? "&cursor=" + encodeURIComponent(cursor) : "");
+            try {
+                const res = await fetch(url);
+                const j = await res.json();
+                if (!j.ok) throw new Error(j.error);
+
+                if (j.items.length) {
+                    const empty = document.getElementById("historyEmpty");
+                    if (empty) empty.remove();
+                }
+                for (const item of j.items) {
+                    const tr = document.createElement("tr");
+                    const badge = item.status === "sent" ? "bg-success" : "bg-danger";
+                    const cells = [new Date(item.created_at).toLocaleString(), item.to_addr, item.subject];
+                    for (const value of cells) {
+                        const td = document.createElement("td");
+                        td.textContent = value || "";
+                        tr.appendChild(td);
+                    }
+                    const statusTd = document.createElement("td");
+                    const span = document.createElement("span");
+                    span.className = "badge rounded-pill " + badge;
+                    span.textContent = item.status === "sent" ? "Sent" : "Failed";
+                    if (item.error) span.title = item.error;
+                    statusTd.appendChild(span);
+                    tr.appendChild(statusTd);
+                    historyRows.appendChild(tr);
+                }
+
+                cursor = j.next_cursor;
+                moreBtn.style.display = cursor ? "inline-block" : "none";
+            } catch (err) {
+                showMessage(err.message, "error");
+            }
+        };
+
+        moreBtn.onclick = loadHistory;
+        loadHistory();
+    }
 });
@@ -0,0 +1,145 @@
+import os
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+from models import db, Suppression
+from suppression_index import SuppressionIndex, normalize_address
+from versioned_cache import VersionedCache, bump_version
+
+# How often each worker looks for suppressions added by other workers.
+# Entries added by this worker apply at once.
+SUPPRESSION_CHECK_INTERVAL = float(os.getenv("SUPPRESSION_CHECK_INTERVAL", 2))
+# Re-read this many ids below the newest one seen: a transaction that
+# committed late can land below it.
+SUPPRESSION_ID_OVERLAP = int(os.getenv("SUPPRESSION_ID_OVERLAP", 1000))
+SUPPRESSION_REASONS = ("bounce", "unsubscribe", "complaint", "manual")
+VERSION_NAME = "suppression"
+GLOBAL_SCOPE = "*"
+
+
+def scope_for(user_id):
+    return str(user_id) if user_id else GLOBAL_SCOPE
+
+
+class SuppressionCache(VersionedCache):
+    """This worker's ``SuppressionIndex``, kept in step with the table.
+
+    New rows are picked up incrementally by id. Deleting rows bumps the
+    ``suppression`` CacheVersion, which makes every worker rebuild.
+    """
+
+    def __init__(self, check_interval=SUPPRESSION_CHECK_INTERVAL):
+        super().__init__(VERSION_NAME, check_interval)
+        self._last_id = 0
+
+    def _rows_after(self, after_id):
+        return db.session.execute(
+            select(Suppression.id, Suppression.scope, Suppression.address)
+            .where(Suppression.id > after_id)
+            .order_by(Suppression.id)
+            .execution_options(yield_per=10000)
+        )
+
+    def load(self, version):
+        last = [0]
+
+        def entries():
+            for row_id, scope, address in self._rows_after(0):
+                last[0] = max(last[0], row_id)
+                yield scope, address
+
+        index = SuppressionIndex(entries())
+        self._last_id = last[0]
+        return index
+
+    def refresh(self, index):
+        for row_id, scope, address in self._rows_after(max(self._last_id - SUPPRESSION_ID_OVERLAP, 0)):
+            index.add(scope, address)
+            self._last_id = max(self._last_id, row_id)
+
+    def note_added(self, entries):
+        with self._lock:
+            if self._value is not None:
+                for scope, address in entries:
+                    self._value.add(scope, address)
+
+
+suppression_cache = SuppressionCache()
+
+
+# -------------------------
+# Checks
+# -------------------------
+def is_suppressed(user_id, address):
+    return suppression_cache.get().contains(scope_for(user_id), address)
+
+
+def suppressed_indexes(user_id, addresses):
+    """Positions in ``addresses`` that must not be mailed by ``user_id``."""
+    return suppression_cache.get().filter(scope_for(user_id), addresses)
+
+
+# -------------------------
+# Writes
+# -------------------------
+def _insert_ignore(rows):
+    dialect = db.engine.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        result = db.session.execute(
+            insert(Suppression).values(rows).on_conflict_do_nothing(index_elements=["scope", "address"])
+        )
+        return result.rowcount
+    added = 0
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.add(Suppression(**row))
+            added += 1
+        except IntegrityError:
+            pass
+    return added
+
+
+def suppress(user_id, addresses, reason="manual"):
+    """Add addresses for ``user_id`` (None: every sender). Returns how many were new."""
+    scope = scope_for(user_id)
+    rows = {}
+    for address in addresses:
+        address = normalize_address(address)
+        if address:
+            rows[address] = {"scope": scope, "address": address, "reason": reason}
+    if not rows:
+        return 0
+    added = _insert_ignore(list(rows.values()))
+    db.session.commit()
+    suppression_cache.note_added((scope, address) for address in rows)
+    return added
+
+
+def unsuppress(user_id, address):
+    result = db.session.execute(
+        delete(Suppression).where(
+            Suppression.scope == scope_for(user_id), Suppression.address == normalize_address(address)
+        )
+    )
+    if result.rowcount:
+        bump_version(VERSION_NAME)
+    db.session.commit()
+    suppression_cache.expire(reload=True)
+    return result.rowcount > 0
+
+
+def entry_status(entry):
+    return {
+        "id": entry.id,
+        "address": entry.address,
+        "reason": entry.reason,
+        "created_at": entry.created_at.isoformat() + "Z",
+    }
+
+
+def count(user_id):
+    return db.session.scalar(select(func.count()).select_from(Suppression).where(Suppression.scope == scope_for(user_id)))
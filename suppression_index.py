@@ -0,0 +1,104 @@
+from array import array
+
+_MASK64 = (1 << 64) - 1
+# Adds since the last rebuild live in a set; past this many, rebuild.
+_MAX_RECENT = 65536
+
+
+def normalize_address(address):
+    address = (address or "").strip()
+    if address.startswith("<") and address.endswith(">"):
+        address = address[1:-1].strip()
+    return address.lower()
+
+
+def _key_hash(scope, address):
+    return hash(f"{scope}\0{address}") & _MASK64
+
+
+class SuppressionIndex:
+    """Constant-time "is this (scope, address) suppressed?" in ~12 bytes an entry.
+
+    Entries are 64-bit hashes of ``scope + address`` in a sorted
+    ``array('Q')`` plus a directory of where each top-bits prefix starts,
+    so a lookup is one hash and a scan of a bucket that averages one entry.
+    Scope is a user id, or ``"*"`` for every sender. ``hash()`` is seeded
+    per process, which is fine: every process builds its own index from
+    the stored addresses. A 64-bit collision (odds ~n/2**64) reads as
+    suppressed.
+    """
+
+    __slots__ = ("_state", "_scopes", "size")
+
+    def __init__(self, entries=()):
+        """``entries``: iterable of ``(scope, normalized address)``."""
+        self._scopes = set()
+        hashes = []
+        for scope, address in entries:
+            self._scopes.add(scope)
+            hashes.append(_key_hash(scope, address))
+        self._build(hashes)
+
+    def _build(self, hashes):
+        hashes = sorted(set(hashes))
+        bits = max(len(hashes), 1).bit_length()
+        shift = 64 - bits
+        starts = array("I", bytes(4 * ((1 << bits) + 1)))
+        for h in hashes:
+            starts[(h >> shift) + 1] += 1
+        for i in range(1, len(starts)):
+            starts[i] += starts[i - 1]
+        # One tuple, swapped in a single assignment, so lock-free readers
+        # never see the arrays of one build with the directory of another.
+        self._state = (array("Q", hashes), starts, shift, set())
+        self.size = len(hashes)
+
+    def _has(self, h):
+        hashes, starts, shift, recent = self._state
+        prefix = h >> shift
+        lo, hi = starts[prefix], starts[prefix + 1]
+        if lo != hi and h in hashes[lo:hi]:
+            return True
+        return h in recent
+
+    def add(self, scope, address):
+        """Add one entry (already normalized); returns False if it was present.
+
+        Not safe to call from several threads at once; lookups are.
+        """
+        h = _key_hash(scope, address)
+        if self._has(h):
+            return False
+        self._scopes.add(scope)
+        hashes, _, _, recent = self._state
+        recent.add(h)
+        self.size += 1
+        if len(recent) > _MAX_RECENT:
+            self._build(list(hashes) + list(recent))
+        return True
+
+    def contains(self, scope, address):
+        """Suppressed for ``scope`` directly or for every sender ("*")."""
+        address = normalize_address(address)
+        if self._has(_key_hash(scope, address)):
+            return True
+        return "*" in self._scopes and self._has(_key_hash("*", address))
+
+    def filter(self, scope, addresses):
+        """Indexes of the suppressed entries of ``addresses``."""
+        has = self._has
+        check_global = "*" in self._scopes
+        out = []
+        for i, address in enumerate(addresses):
+            address = normalize_address(address)
+            if has(_key_hash(scope, address)) or (check_global and has(_key_hash("*", address))):
+                out.append(i)
+        return out
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        hashes, starts, _, _ = self._state
+        return hashes.itemsize * len(hashes) + starts.itemsize * len(starts)
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import os
+from models import Template
+from versioned_cache import VersionedCache
+
+# How often each worker asks the DB whether templates changed. Writes made by
+# this worker show up immediately; writes by other workers within this window.
+TEMPLATE_CACHE_CHECK_INTERVAL = float(os.getenv("TEMPLATE_CACHE_CHECK_INTERVAL", 5))
+VERSION_NAME = "templates"
+
+
+def _etag_for(body):
+    return hashlib.sha256(body.encode()).hexdigest()[:32]
+
+
+class TemplateSnapshot:
+    """Immutable view of the template table plus pre-serialized responses."""
+
+    def __init__(self, version, templates):
+        self.version = version
+        self.templates = templates
+        self.list_body = json.dumps(templates)
+        self.list_etag = _etag_for(self.list_body)
+        self.by_id = {}
+        for t in templates:
+            body = json.dumps(t)
+            self.by_id[t["id"]] = (t, body, _etag_for(body))
+        self.names = [{"id": t["id"], "name": t["title"]} for t in templates]
+
+
+class TemplateCache(VersionedCache):
+    def __init__(self, check_interval=TEMPLATE_CACHE_CHECK_INTERVAL):
+        super().__init__(VERSION_NAME, check_interval)
+
+    def load(self, version):
+        templates = [
+            {"id": str(t.id), "title": t.title, "subject": t.subject, "body": t.body}
+            for t in Template.query.order_by(Template.created_at.desc()).all()
+        ]
+        return TemplateSnapshot(version, templates)
+
+
+template_cache = TemplateCache()
@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import datetime
+from flask import has_request_context
+from sqlalchemy import insert
+from models import db, gen_id, Template
+from search import index_templates
+from template_cache import template_cache
+
+TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates.json")
+SEED_CHUNK_SIZE = int(os.getenv("SEED_CHUNK_SIZE", 1000))
+
+
+def read_templates_file(path=TEMPLATES_PATH):
+    """Read templates.json into clean rows, one per distinct title (first wins)."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+
+    rows = {}
+    for item in data:
+        title = (item.get("title") or item.get("id") or "").strip()
+        if title and title not in rows:
+            rows[title] = {
+                "title": title,
+                "subject": item.get("subject") or "",
+                "body": item.get("body") or item.get("content") or "",
+            }
+    return list(rows.values())
+
+
+def _insert_stmt(update_existing):
+    # ON CONFLICT keeps concurrent seeders (several workers booting) from
+    # tripping over the unique title index.
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(Template)
+    stmt = dialect_insert(Template)
+    if update_existing:
+        return stmt.on_conflict_do_update(
+            index_elements=["title"],
+            set_={"subject": stmt.excluded.subject, "body": stmt.excluded.body},
+        )
+    return stmt.on_conflict_do_nothing(index_elements=["title"])
+
+
+def seed_templates(path=TEMPLATES_PATH, update_existing=False):
+    """Bulk-load templates.json: one existence query, then chunked multi-row inserts.
+
+    Returns ``(inserted, updated)``. Refuses to run inside a request; seeding
+    happens at startup or from ``flask seed-templates``.
+    """
+    if has_request_context():
+        raise RuntimeError("Template seeding must not run inside a request")
+
+    rows = read_templates_file(path)
+    if not rows:
+        return 0, 0
+
+    existing = {title for (title,) in db.session.query(Template.title)}
+    if update_existing:
+        pending = rows
+    else:
+        pending = [r for r in rows if r["title"] not in existing]
+    if not pending:
+        return 0, 0
+
+    now = datetime.utcnow()
+    stmt = _insert_stmt(update_existing)
+    for start in range(0, len(pending), SEED_CHUNK_SIZE):
+        chunk = [{"id": gen_id(), "created_at": now, **r} for r in pending[start:start + SEED_CHUNK_SIZE]]
+        db.session.execute(stmt, chunk)
+        index_templates([r["title"] for r in chunk])
+    db.session.commit()
+    template_cache.bump()
+
+    updated = sum(1 for r in pending if r["title"] in existing)
+    return len(pending) - updated, updated
+
+
+def seed_templates_if_empty(path=TEMPLATES_PATH):
+    if db.session.query(Template.id).first() is not None:
+        return 0
+    inserted, _ = seed_templates(path)
+    return inserted
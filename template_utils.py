@@ -0,0 +1,112 @@
+import re
+from functools import lru_cache
+
+# Placeholders look like "[Client Name]" or "[service/location]".
+PLACEHOLDER_RE = re.compile(r"\[([^\[\]\n]{1,80})\]")
+
+
+@lru_cache(maxsize=4096)
+def _normalize(name):
+    return " ".join(name.split()).casefold()
+
+
+def normalize_name(name):
+    """Placeholder names match case-insensitively and ignore extra spaces."""
+    # Rows reuse the same few keys, so the memoized form does the real work.
+    return _normalize(name if isinstance(name, str) else str(name))
+
+
+def normalize_values(values):
+    return {normalize_name(k): str(v) for k, v in values.items() if v is not None}
+
+
+class CompiledTemplate:
+    """A template parsed once into literal segments and placeholder slots.
+
+    The text is turned into a positional ``str.format`` pattern, so
+    rendering a row is a dict lookup per distinct slot plus one C-level
+    ``format`` call; the source is never scanned again.
+    """
+
+    __slots__ = ("source", "slots", "display", "_pattern", "_raw")
+
+    def __init__(self, source):
+        self.source = source or ""
+        self.slots = []      # distinct normalized names, in first-seen order
+        self.display = {}    # normalized name -> name as written in the template
+        index = {}
+        pieces = []
+        pos = 0
+        for m in PLACEHOLDER_RE.finditer(self.source):
+            pieces.append(self._escape(self.source[pos:m.start()]))
+            name = normalize_name(m.group(1))
+            if name not in index:
+                index[name] = len(self.slots)
+                self.slots.append(name)
+                self.display[name] = m.group(1)
+            pieces.append("{%d}" % index[name])
+            pos = m.end()
+        pieces.append(self._escape(self.source[pos:]))
+        self._pattern = "".join(pieces)
+        # Unfilled slots render back as their original placeholder.
+        self._raw = ["[%s]" % self.display[name] for name in self.slots]
+
+    @staticmethod
+    def _escape(text):
+        return text.replace("{", "{{").replace("}", "}}")
+
+    def render(self, lookup):
+        """Render with ``lookup`` (already passed through ``normalize_values``)."""
+        if not self.slots:
+            return self.source
+        return self._pattern.format(*[lookup.get(name, raw) for name, raw in zip(self.slots, self._raw)])
+
+    def missing(self, lookup):
+        return [self.display[name] for name in self.slots if name not in lookup]
+
+
+@lru_cache(maxsize=1024)
+def compile_template(text):
+    return CompiledTemplate(text)
+
+
+class CompiledEmail:
+    """Subject and body compiled together so reports cover both."""
+
+    __slots__ = ("subject", "body", "slots")
+
+    def __init__(self, subject, body):
+        self.subject = compile_template(subject or "")
+        self.body = compile_template(body or "")
+        self.slots = set(self.subject.slots) | set(self.body.slots)
+
+    @property
+    def variables(self):
+        names = dict(self.subject.display)
+        for name, shown in self.body.display.items():
+            names.setdefault(name, shown)
+        return list(names.values())
+
+    def render(self, values):
+        lookup = {}
+        unknown = []
+        for key, value in values.items():
+            name = normalize_name(key)
+            if name not in self.slots:
+                unknown.append(key)
+            if value is not None:
+                lookup[name] = value if isinstance(value, str) else str(value)
+        missing = list(dict.fromkeys(self.subject.missing(lookup) + self.body.missing(lookup)))
+        return {
+            "subject": self.subject.render(lookup),
+            "body": self.body.render(lookup),
+            "missing": missing,
+            "unknown": unknown,
+        }
+
+
+def fill_placeholders(text, values):
+    """Replace known placeholders in ``text``; unknown ones are left as-is."""
+    if not text:
+        return text or ""
+    return compile_template(text).render(normalize_values(values))
@@ -0,0 +1,26 @@
+import functools
+import os
+import threading
+
+
+def once_per_process(start):
+    """Decorator: run ``start`` once per process; later calls return None.
+
+    Safe to call on every request. Keyed by pid, so a worker forked after
+    the parent started its threads (gunicorn --preload) starts its own.
+    """
+    lock = threading.Lock()
+    started = {"pid": None}
+
+    @functools.wraps(start)
+    def wrapper(*args, **kwargs):
+        pid = os.getpid()
+        if started["pid"] == pid:
+            return None
+        with lock:
+            if started["pid"] == pid:
+                return None
+            started["pid"] = pid
+            return start(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,75 @@
+import os
+import threading
+from dataclasses import dataclass
+from flask_login import UserMixin
+from cache_utils import TTLCache
+from models import db, User
+
+# Per worker. Writes in this worker invalidate at once; other workers see
+# a change within USER_CACHE_TTL seconds.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 30))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 4096))
+
+
+@dataclass(frozen=True, eq=False)
+class UserSnapshot(UserMixin):
+    """Read-only copy of a ``User`` row, detached from any session.
+
+    This is what ``current_user`` is on normal requests. Routes that change
+    the user load the ORM row with ``db.session.get(User, current_user.id)``
+    and call ``invalidate`` after committing.
+    """
+
+    id: str
+    email: str
+    openai_enc_key: str = None
+    email_enc_password: str = None
+
+    @classmethod
+    def from_row(cls, user):
+        return cls(
+            id=user.id,
+            email=user.email,
+            openai_enc_key=user.openai_enc_key,
+            email_enc_password=user.email_enc_password,
+        )
+
+
+_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# user id -> [loads in flight, generation]. invalidate() bumps the
+# generation so a load that raced with a write is not cached. The entry
+# goes away with the last load, so only users being loaded right now are
+# tracked.
+_loading = {}
+_lock = threading.Lock()
+
+
+def load_user(user_id):
+    user_id = str(user_id)
+    snapshot = _cache.get(user_id)
+    if snapshot is not None:
+        return snapshot
+    with _lock:
+        state = _loading.setdefault(user_id, [0, 0])
+        state[0] += 1
+        generation = state[1]
+    try:
+        row = db.session.get(User, user_id)
+        snapshot = UserSnapshot.from_row(row) if row is not None else None
+    finally:
+        with _lock:
+            state[0] -= 1
+            if not state[0]:
+                del _loading[user_id]
+            if snapshot is not None and state[1] == generation:
+                _cache.set(user_id, snapshot)
+    return snapshot
+
+
+def invalidate(user_id):
+    user_id = str(user_id)
+    with _lock:
+        state = _loading.get(user_id)
+        if state is not None:
+            state[1] += 1
+        _cache.pop(user_id)
@@ -0,0 +1,76 @@
+import threading
+import time
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from models import db, CacheVersion
+
+
+def bump_version(name):
+    """Increment CacheVersion ``name`` in the current transaction; the caller commits."""
+    stmt = update(CacheVersion).where(CacheVersion.name == name).values(version=CacheVersion.version + 1)
+    if db.session.execute(stmt).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(CacheVersion(name=name, version=1))
+    except IntegrityError:
+        # Another worker created the row first.
+        db.session.execute(stmt)
+
+
+class VersionedCache:
+    """Per-worker copy of a table, rebuilt when its CacheVersion row changes.
+
+    ``get`` touches the DB at most once per ``check_interval``: it reads the
+    version and calls ``load(version)`` if it moved, else ``refresh(value)``.
+    Writes made by this worker call ``bump`` (or ``expire``) and show up at
+    once; writes by other workers within the interval.
+    """
+
+    def __init__(self, name, check_interval):
+        self.name = name
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def load(self, version):
+        raise NotImplementedError
+
+    def refresh(self, value):
+        """Catch up ``value`` when the version has not moved; nothing by default."""
+
+    def _db_version(self):
+        row = db.session.get(CacheVersion, self.name)
+        return row.version if row else 0
+
+    def _fresh(self):
+        return self._value is not None and time.monotonic() - self._checked_at < self.check_interval
+
+    def get(self):
+        if self._fresh():
+            return self._value
+        with self._lock:
+            if not self._fresh():
+                version = self._db_version()
+                if self._value is None or version != self._version:
+                    self._value = self.load(version)
+                    self._version = version
+                else:
+                    self.refresh(self._value)
+                self._checked_at = time.monotonic()
+            return self._value
+
+    def expire(self, reload=False):
+        """Check the DB on the next ``get``; ``reload`` also forces a full ``load``."""
+        with self._lock:
+            self._checked_at = 0.0
+            if reload:
+                self._version = None
+
+    def bump(self):
+        """Record a write so every worker reloads; call after committing."""
+        bump_version(self.name)
+        db.session.commit()
+        self.expire()